@@ -22,7 +22,9 @@
         (while I modified it for using the "cryptography" package).
 
         * in essence this script can act like a CA in a limited fashion
-           (but is far from complete, because it doesn't handle CRLs, or anything more than code_signing, server_auth and client_auth certificates)
+           (but is far from complete, because it doesn't handle anything more than code_signing, server_auth and client_auth certificates)
+           revoked certificates are tracked in the certificate index and published as a full CRL (crl.pem) plus a small delta CRL
+           (delta-crl.pem) with the revocations since the last full CRL -- see revoke_certificate() and publish_crls()
            the certificates issued by this script have been tested using a DD-WRT Router (a NetGear R7000), using the DD-WRT OpenVPN guide as a reference for setup.
                Sign up on the DD-WRT forum (http://www.dd-wrt.com) for access to the OpenVPN configuratuon guide document.
 
@@ -32,17 +34,35 @@
     Updated most of the references in the original script to PY3 compatability, and dropped compatability for PY2, sorry if that's important to you.
 '''
 import os
+import io
 from os.path import exists
+import re
+import csv
+import json
+import queue
+import time
+import uuid
+import secrets
+import sqlite3
 import datetime
+import threading
+import base64
+import string
+import tarfile
+import zipfile
+import argparse
 import configparser
-from cryptography.hazmat.backends.openssl.rsa import _RSAPrivateKey as RSAPrivateKey
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import cryptography
 from cryptography import x509
+from cryptography.x509 import ocsp
 
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
 from cryptography.hazmat.primitives import serialization
 
 cfg = configparser.RawConfigParser()
@@ -54,6 +74,12 @@ else:
     # using expandvars to be able to embed environment variables in path
     BASE_PATH = os.path.expandvars("%USERPROFILE%\\Documents\\Customers")
 
+# hand out random 128-bit serial numbers (RFC 5280 style) instead of sequential ones from serials.ini
+RANDOM_SERIALS = cfg.getboolean('general', 'RANDOM_SERIALS', fallback=False)
+
+# passphrase the pre-generated keys in the key pool are encrypted with (ini [general] KEY_POOL_PASSPHRASE, or the environment variable)
+KEY_POOL_PASSPHRASE = cfg.get('general', 'KEY_POOL_PASSPHRASE', fallback=None) or os.environ.get('OPENVPN_KEY_POOL_PASSPHRASE')
+
 # ExtendedKeyUsage
 EKU = {
     'server_auth': x509.oid.ExtendedKeyUsageOID.SERVER_AUTH,
@@ -61,6 +87,17 @@ EKU = {
     'code_signing': x509.oid.ExtendedKeyUsageOID.CODE_SIGNING,
 }
 
+# key algorithms make_key knows about -- for ec the key_size picks the curve
+KEY_ALGORITHMS = ('rsa', 'ec', 'ed25519')
+EC_CURVES = {
+    256: ec.SECP256R1,
+    384: ec.SECP384R1,
+    521: ec.SECP521R1,
+}
+PRIVATE_KEY_TYPES = (rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey, ed25519.Ed25519PrivateKey)
+# RSA key sizes the issuance daemon takes in a request
+RSA_KEY_SIZES = (2048, 3072, 4096)
+
 # Modified https://gist.github.com/Justasic/908ef5f4fa162f15b3b8
 #   in order to start using "cryptography" module instead of the OpenSSL library, as the OpenSSL author suggests it shouldn't be used in favor of cryptography
 # Kudos to these articles that helped me when I went astray
@@ -69,17 +106,168 @@ EKU = {
 #     https://github.com/pyca/cryptography/issues/4272
 #     https://gist.github.com/major/8ac9f98ae8b07f46b208
 
-def make_key(key_size=2048):
+def ec_key_size(key_size=2048):
     '''
-        Make an RSA key
+        the curve size for an ec key: 256, 384 or 521 -- the RSA default of 2048 (ie: no key_size given) means 256,
+            anything else raises ValueError instead of quietly making a P-256 key
     '''
-    key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=key_size,
-        backend=default_backend()
-    )
+    if key_size == 2048:
+        return 256
+    if key_size not in EC_CURVES:
+        raise ValueError(f"key_size for ec (the curve) must be one of: {', '.join(str(size) for size in EC_CURVES)} -- not {key_size}")
+    return key_size
+
+def make_key(key_size=2048, key_algorithm='rsa'):
+    '''
+        Make a private key (rsa, ec or ed25519)
+
+        ec keys are way faster to make and cheaper on the routers during the TLS handshake:
+            key_size picks the curve (256, 384 or 521, the RSA default of 2048 gets P-256, anything else is a ValueError)
+            ed25519 ignores key_size, and needs OpenVPN 2.4.7+ built against OpenSSL 1.1.1+ on both ends (older DD-WRT builds won't do it)
+    '''
+    if key_algorithm == 'rsa':
+        key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=key_size,
+            backend=default_backend()
+        )
+    elif key_algorithm == 'ec':
+        key = ec.generate_private_key(EC_CURVES[ec_key_size(key_size)]())
+    elif key_algorithm == 'ed25519':
+        key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise Exception(f"Unknown key algorithm: {key_algorithm} (use one of: {', '.join(KEY_ALGORITHMS)})")
     return key
 
+def key_type(key_size=2048, key_algorithm='rsa'):
+    '''
+        name for a kind of key, ie: rsa-2048, ec-256, ed25519 (the same ec key_size normalizing as make_key)
+    '''
+    if key_algorithm == 'ec':
+        return f'ec-{ec_key_size(key_size)}'
+    if key_algorithm == 'ed25519':
+        return 'ed25519'
+    return f'{key_algorithm}-{key_size}'
+
+def signing_hash(key, hash_algorithm=hashes.SHA256()):
+    '''
+        the hash to sign with for a private key -- ed25519 signs without a separate hash (cryptography wants None)
+    '''
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return None
+    return hash_algorithm
+
+
+class KeyPool(object):
+    '''
+        Pool of pre-generated private keys for a customer, so issuing a cert doesn't have to wait on make_key
+
+        The keys live encrypted (with KEY_POOL_PASSPHRASE) in {BASE_PATH}\\{cust_name}\\openvpn\\keypool\\<key_type>, one file per key
+            (ie: keypool\\rsa-2048, keypool\\ec-256, keypool\\ed25519).
+        take() claims a key with an atomic rename (so two issuers can never get the same key) and falls back to make_key when
+            the pool is empty.  start() runs a background thread that refills every size back up to target once nothing
+            has been taken for idle_seconds, fill() does the same thing synchronously (ie: from a scheduled task).
+    '''
+    def __init__(self, cust_name, sizes=(2048,), target=10, passphrase=None, idle_seconds=5, check_interval=1, key_algorithm='rsa'):
+        self.base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+        self.pool_dir = f'{self.base_dir}\\keypool'
+        self.sizes = tuple(sizes)
+        self.key_algorithm = key_algorithm
+        self.target = target
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+
+        passphrase = passphrase or KEY_POOL_PASSPHRASE
+        if not passphrase:
+            raise Exception('The key pool needs a passphrase (KEY_POOL_PASSPHRASE in the ini [general] section or the OPENVPN_KEY_POOL_PASSPHRASE environment variable)')
+        self._passphrase = passphrase.encode('utf-8') if isinstance(passphrase, str) else passphrase
+
+        self.taken = 0
+        self.fallbacks = 0
+        self._last_take = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def key_dir(self, key_size, key_algorithm=None):
+        return f'{self.pool_dir}\\{key_type(key_size, key_algorithm or self.key_algorithm)}'
+
+    def count(self, key_size, key_algorithm=None):
+        key_dir = self.key_dir(key_size, key_algorithm)
+        if not exists(key_dir):
+            return 0
+        return sum(1 for name in os.listdir(key_dir) if name.endswith('.pem'))
+
+    def add(self, key, key_size, key_algorithm=None):
+        '''
+            store a key in the pool (written to a temp name first, so take() never sees a half written file)
+        '''
+        key_dir = self.key_dir(key_size, key_algorithm)
+        os.makedirs(key_dir, exist_ok=True)
+
+        data = key.private_bytes(serialization.Encoding.PEM,
+                                 format=serialization.PrivateFormat.PKCS8,
+                                 encryption_algorithm=serialization.BestAvailableEncryption(self._passphrase))
+        name = uuid.uuid4().hex
+        with open(f'{key_dir}\\{name}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{key_dir}\\{name}.tmp', f'{key_dir}\\{name}.pem')
+
+    def take(self, key_size=2048, key_algorithm=None):
+        '''
+            a key from the pool, or a freshly generated one if the pool is empty
+        '''
+        key_algorithm = key_algorithm or self.key_algorithm
+        self._last_take = time.monotonic()
+        key_dir = self.key_dir(key_size, key_algorithm)
+        if exists(key_dir):
+            for name in os.listdir(key_dir):
+                if not name.endswith('.pem'):
+                    continue
+                keyfile = f'{key_dir}\\{name}'
+                claimed = f'{keyfile}.{os.getpid()}.{threading.get_ident()}.taken'
+                try:
+                    os.rename(keyfile, claimed)
+                except OSError:
+                    # somebody else got this one first
+                    continue
+                with open(claimed, 'rb') as f:
+                    data = f.read()
+                os.remove(claimed)
+                self.taken += 1
+                return serialization.load_pem_private_key(data, password=self._passphrase)
+
+        self.fallbacks += 1
+        return make_key(key_size, key_algorithm)
+
+    def fill(self, key_size=None, stop_when_busy=False):
+        '''
+            generate keys until every size (or just key_size) is back up to target
+        '''
+        for size in ([key_size] if key_size else self.sizes):
+            while self.count(size) < self.target:
+                if self._stop.is_set() or (stop_when_busy and not self._is_idle()):
+                    return
+                self.add(make_key(size, self.key_algorithm), size)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _is_idle(self):
+        return time.monotonic() - self._last_take >= self.idle_seconds
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            if self._is_idle():
+                self.fill(stop_when_busy=True)
+            self._stop.wait(self.check_interval)
 
 def make_csr(priv_key, CN, C=None, ST=None, L=None, O=None, OU=None, sans:list=None, password=None, extendedKeyUsage=None, hash_algorithm=hashes.SHA256()):
     '''
@@ -117,7 +305,7 @@ def make_csr(priv_key, CN, C=None, ST=None, L=None, O=None, OU=None, sans:list=N
         csr = csr.add_extension(x509.SubjectAlternativeName(dns_name_list),
                                 critical=False)
 
-    request = csr.sign(priv_key, hash_algorithm)
+    request = csr.sign(priv_key, signing_hash(priv_key, hash_algorithm))
 
     return request
 
@@ -144,12 +332,12 @@ def create_subject_names(CN, C, ST, L, O, OU, email):
     return subject_names
 
 
-def create_ca(CN, C="", ST="", L="", O="", OU="", valid_days=3650 * 2, key_size=2048, hash_algorithm=hashes.SHA256()):
+def create_ca(CN, C="", ST="", L="", O="", OU="", valid_days=3650 * 2, key_size=2048, hash_algorithm=hashes.SHA256(), key_algorithm='rsa'):
     '''
         Create a CA Certificate (20 year validaty by default -- give or take a few leap days)
     '''
 
-    root_key = make_key(key_size)
+    root_key = make_key(key_size, key_algorithm)
 
     subject_names = create_subject_names(CN, C, ST, L, O, OU, email='')
     ca_subject = x509.Name(subject_names)
@@ -167,13 +355,15 @@ def create_ca(CN, C="", ST="", L="", O="", OU="", valid_days=3650 * 2, key_size=
         x509.BasicConstraints(ca=True, path_length=None), critical=True,
     )
 
-    root_cert = root_cert.sign(root_key, hash_algorithm, default_backend())
+    root_cert = root_cert.sign(root_key, signing_hash(root_key, hash_algorithm), default_backend())
 
     return (root_cert, root_key)
 
-def create_certificate_from_csr(csr, root_key, serial, root_cert, valid_days=3650 * 2):
+def create_certificate_from_csr(csr, root_key, serial, root_cert, valid_days=3650 * 2, extensions:list=None):
     '''
         Create a certificate from CA cert (20 year validity by default -- give or take a few leap days)
+
+        extensions is a list of (extension value, critical) to put in the cert instead of copying the ones the csr asked for
     '''
     cert = x509.CertificateBuilder().subject_name(csr.subject
         ).issuer_name(
@@ -188,12 +378,15 @@ def create_certificate_from_csr(csr, root_key, serial, root_cert, valid_days=365
             datetime.datetime.utcnow() + datetime.timedelta(days=valid_days)
         )
 
-    for ext in csr.extensions:
+    if extensions is None:
+        extensions = [(ext.value, ext.critical) for ext in csr.extensions]
+    for (value, critical) in extensions:
         cert = cert.add_extension(
-            ext.value, ext.critical
+            value, critical
         )
 
-    cert = cert.sign(root_key, csr.signature_hash_algorithm)
+    # the CA key decides the hash (an ed25519 csr has no hash of its own, and an ed25519 CA can't use one)
+    cert = cert.sign(root_key, signing_hash(root_key, csr.signature_hash_algorithm or hashes.SHA256()))
         # return certificate
     return cert
 
@@ -208,9 +401,10 @@ def dump_file_in_mem(material, file_format=serialization.Encoding.PEM):
 
     data = None
     if isinstance(material, cryptography.x509.base.Certificate) or \
-       isinstance(material, cryptography.x509.base.CertificateSigningRequest):
+       isinstance(material, cryptography.x509.base.CertificateSigningRequest) or \
+       isinstance(material, cryptography.x509.base.CertificateRevocationList):
         data = material.public_bytes(file_format)
-    elif isinstance(material, RSAPrivateKey):
+    elif isinstance(material, PRIVATE_KEY_TYPES):
         data = material.private_bytes(file_format,
                                       format=serialization.PrivateFormat.PKCS8,
                                       encryption_algorithm=serialization.NoEncryption())
@@ -230,14 +424,15 @@ def load_from_file(materialfile, objtype, file_format=serialization.Encoding.PEM
             load_func = x509.load_pem_x509_certificate
         elif objtype == "CertificateSigningRequest":
             load_func = x509.load_pem_x509_csr
-        elif objtype == "RSAPrivateKey":
+        elif objtype in ("PrivateKey", "RSAPrivateKey"):
+            # load_pem_private_key figures out rsa/ec/ed25519 from the PEM itself
             load_func = serialization.load_pem_private_key
     else:
         raise Exception(f"Unsupported material type: {objtype} - file_format: {file_format}")
 
     with open(materialfile, 'r') as fp:
         buf = fp.read()
-    if objtype == "RSAPrivateKey":
+    if objtype in ("PrivateKey", "RSAPrivateKey"):
         material = load_func(buf.encode('utf-8'), password=None)
     else:
         material = load_func(buf.encode('utf-8'))
@@ -247,7 +442,7 @@ def retrieve_key_from_file(keyfile):
     '''
         Get a key from the file
     '''
-    return load_from_file(keyfile, "RSAPrivateKey")
+    return load_from_file(keyfile, "PrivateKey")
 
 def retrieve_csr_from_file(csrfile):
     '''
@@ -270,37 +465,411 @@ def dump_string_to_file(strng, file, write_mode = 'x'):
         f.close()
     return True
 
+class FileLock(object):
+    '''
+        Exclusive lock on a lock file (msvcrt on Windows, fcntl everywhere else) -- use it as a context manager
+    '''
+    def __init__(self, lockfile, timeout=30, poll_interval=0.05):
+        self.lockfile = lockfile
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def acquire(self):
+        self._fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if os.name == 'nt':
+                    import msvcrt
+                    msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(self._fd)
+                    self._fd = None
+                    raise TimeoutError(f'timed out waiting for the lock on {self.lockfile}')
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+class SerialAllocator(object):
+    '''
+        Hands out serial numbers for a CA so parallel issuers never collide
+
+        sequential (the default): serials.ini is read and rewritten while holding an exclusive lock on serials.ini.lock, and the new
+            contents go to a temp file that replaces serials.ini in one step (a crash never leaves a half written file).
+            reserve(N) does that once for a whole block of N serials.
+        random_serials=True: random 128-bit serials (RFC 5280 recommends unpredictable serials), no file I/O at all
+    '''
+    def __init__(self, filename, random_serials=False, lock_timeout=30):
+        self.filename = filename
+        self.random_serials = random_serials
+        self.lock_timeout = lock_timeout
+
+    def next(self):
+        return self.reserve(1)[0]
+
+    def reserve(self, count):
+        if count < 1:
+            return []
+
+        if self.random_serials:
+            serials = set()
+            while len(serials) < count:
+                serial = secrets.randbits(128)
+                # serials 0 and 1 are off limits (1 is the CA)
+                if serial > 1:
+                    serials.add(serial)
+            return list(serials)
+
+        with FileLock(f'{self.filename}.lock', timeout=self.lock_timeout):
+            config = configparser.ConfigParser()
+            if exists(self.filename):
+                config.read(self.filename)
+                first_serial = int(config['ca']['last_used_serial_number']) + 1
+            else:
+                # the CA would be serial 1 and the file doesn't exist, so its likely that its never issued a certificate
+                config['ca'] = {}
+                first_serial = 2
+            config['ca']['last_used_serial_number'] = str(first_serial + count - 1)
+
+            tmpfile = f'{self.filename}.{os.getpid()}.tmp'
+            with open(tmpfile, 'w') as f:
+                config.write(f, space_around_delimiters=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpfile, self.filename)
+
+        return list(range(first_serial, first_serial + count))
+
 def get_next_serial(filename):
     '''
         Get the next serial number
+    '''
+    return get_next_serials(filename, 1)[0]
 
-          # this is by no means perfect, and could totally have issues in a race condition but..
-          #   in my testing, I'm the only one making cert request calls, so it's sufficient.
+def get_next_serials(filename, count):
     '''
+        Reserve a block of serial numbers in one locked read/write of the serials file (for bulk issuance)
+    '''
+    return SerialAllocator(filename, random_serials=RANDOM_SERIALS).reserve(count)
 
-    if not exists(filename):
-        # the CA would be serial 1 and the file doesn't exist, so its likely that its never issued a certificate
-        with open(filename,'x') as f:
-            f.write('[ca]\nlast_used_serial_number=2')
-        return 2
-    else:
-        config = configparser.ConfigParser()
-        config.read(filename)
-        next_serial = int(config['ca']['last_used_serial_number']) + 1
-        config['ca']['last_used_serial_number'] = str(next_serial)
-        with open(filename, 'w') as f:
-            config.write(f, space_around_delimiters=False)
-        return next_serial
+def cert_not_before(cert):
+    '''
+        not_valid_before as an aware UTC datetime (not_valid_before_utc only exists in newer versions of cryptography)
+    '''
+    if hasattr(cert, 'not_valid_before_utc'):
+        return cert.not_valid_before_utc
+    return cert.not_valid_before.replace(tzinfo=datetime.timezone.utc)
+
+def cert_not_after(cert):
+    '''
+        not_valid_after as an aware UTC datetime
+    '''
+    if hasattr(cert, 'not_valid_after_utc'):
+        return cert.not_valid_after_utc
+    return cert.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+
+def _index_time(dt):
+    # fixed width UTC text sorts the same as the datetimes do, so the not_after index works for range queries
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
-def get_or_create_ca(cafile:str, cakeyfile:str, base_dir, cust_name):
+class CertIndex(object):
+    '''
+        Per-CA index of the issued certificates (like OpenSSL's index.txt, but in SQLite) -- {base_dir}\\certindex.db
+
+        serials are stored as hex text (random 128-bit serials don't fit in a SQLite integer), times as UTC text
+        status is V (valid) or R (revoked) -- expired is worked out from not_after
+    '''
+    def __init__(self, base_dir, filename='certindex.db'):
+        self.base_dir = base_dir
+        self.dbfile = f'{base_dir}\\{filename}'
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.dbfile, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS certs (
+                                    serial TEXT PRIMARY KEY,
+                                    cn TEXT,
+                                    subject TEXT,
+                                    not_before TEXT,
+                                    not_after TEXT,
+                                    status TEXT NOT NULL DEFAULT 'V',
+                                    revoked_at TEXT,
+                                    revocation_reason TEXT,
+                                    filename TEXT)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS certs_cn ON certs (cn)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS certs_not_after ON certs (not_after)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS certs_status ON certs (status, not_after)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS certs_revoked_at ON certs (revoked_at)')
+            # crl numbers and publish times
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def serial_key(serial):
+        return f'{serial:x}'
+
+    def _row(self, cert, filename):
+        cns = cert.subject.get_attributes_for_oid(x509.oid.NameOID.COMMON_NAME)
+        return (self.serial_key(cert.serial_number), cns[0].value if cns else None, cert.subject.rfc4514_string(),
+                _index_time(cert_not_before(cert)), _index_time(cert_not_after(cert)), filename)
+
+    def add(self, cert, filename=None):
+        self.add_many([(cert, filename)])
+
+    def add_many(self, certs):
+        '''
+            index a batch of (cert, filename) in one transaction
+        '''
+        rows = [self._row(cert, filename) for (cert, filename) in certs]
+        with self._lock, self.conn:
+            self.conn.executemany('''INSERT INTO certs (serial, cn, subject, not_before, not_after, filename) VALUES (?, ?, ?, ?, ?, ?)
+                                     ON CONFLICT (serial) DO UPDATE SET cn=excluded.cn, subject=excluded.subject, not_before=excluded.not_before,
+                                        not_after=excluded.not_after, filename=excluded.filename''', rows)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['serial'] = int(result['serial'], 16)
+            results.append(result)
+        return results
+
+    def lookup_serial(self, serial):
+        results = self._query('SELECT * FROM certs WHERE serial = ?', (self.serial_key(serial),))
+        return results[0] if results else None
+
+    def find_by_cn(self, cn):
+        return self._query('SELECT * FROM certs WHERE cn = ? ORDER BY not_after', (cn,))
+
+    def expiring(self, days=30, include_revoked=False, include_expired=False):
+        '''
+            certs that expire in the next days days (ordered by expiry)
+        '''
+        now = datetime.datetime.now(datetime.timezone.utc)
+        start = '' if include_expired else _index_time(now)
+        end = _index_time(now + datetime.timedelta(days=days))
+        sql = 'SELECT * FROM certs WHERE not_after >= ? AND not_after <= ?'
+        if not include_revoked:
+            sql += " AND status = 'V'"
+        return self._query(sql + ' ORDER BY not_after', (start, end))
+
+    def all(self):
+        return self._query('SELECT * FROM certs ORDER BY not_after')
+
+    def revoke(self, serial, reason='unspecified', revoked_at=None):
+        '''
+            mark a cert revoked (reason is one of the x509.ReasonFlags values, ie: keyCompromise, superseded, cessationOfOperation)
+            returns False if the serial isn't in the index
+        '''
+        reason = x509.ReasonFlags(reason).value
+        revoked_at = _index_time(revoked_at or datetime.datetime.now(datetime.timezone.utc))
+        with self._lock, self.conn:
+            cursor = self.conn.execute("UPDATE certs SET status = 'R', revoked_at = ?, revocation_reason = ? WHERE serial = ? AND status = 'V'",
+                                       (revoked_at, reason, self.serial_key(serial)))
+        return cursor.rowcount > 0
+
+    def revoked(self, since=None):
+        '''
+            the revoked certs (only the ones revoked at or after since if it's given)
+        '''
+        if since:
+            return self._query("SELECT * FROM certs WHERE status = 'R' AND revoked_at >= ? ORDER BY revoked_at", (since,))
+        return self._query("SELECT * FROM certs WHERE status = 'R' ORDER BY revoked_at")
+
+    def get_meta(self, name, default=None):
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, values: dict):
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT INTO meta (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value=excluded.value',
+                                  [(name, str(value)) for name, value in values.items()])
+
+    def rebuild_from_disk(self, certs_dir=None):
+        '''
+            re-index every .crt in the certs directory (revocation status already in the index is kept)
+        '''
+        certs_dir = certs_dir or f'{self.base_dir}\\certs'
+        certs = []
+        if exists(certs_dir):
+            for name in os.listdir(certs_dir):
+                if name.endswith('.crt'):
+                    try:
+                        certs.append((retrieve_cert_from_file(f'{certs_dir}\\{name}'), f'{certs_dir}\\{name}'))
+                    except Exception as e:
+                        print(f'skipping {name}: {e}')
+
+        serials = [self.serial_key(cert.serial_number) for (cert, filename) in certs]
+        with self._lock, self.conn:
+            # drop the rows for certs that aren't on disk anymore
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS on_disk (serial TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM on_disk')
+            self.conn.executemany('INSERT OR IGNORE INTO on_disk (serial) VALUES (?)', [(serial,) for serial in serials])
+            self.conn.execute('DELETE FROM certs WHERE serial NOT IN (SELECT serial FROM on_disk)')
+        self.add_many(certs)
+        return len(certs)
+
+def _parse_index_time(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+def create_crl(cacert, cakey, revoked_rows, crl_number, next_update, delta_crl_base=None, hash_algorithm=hashes.SHA256()):
     '''
-        Get or create the files necessary to track a CA
+        Build and sign a CRL from cert index rows (a delta CRL when delta_crl_base is the CRL number of the full CRL it builds on)
+    '''
+    now = datetime.datetime.now(datetime.timezone.utc)
+    crl = x509.CertificateRevocationListBuilder().issuer_name(
+            cacert.subject
+        ).last_update(
+            now
+        ).next_update(
+            next_update
+        )
+
+    for row in revoked_rows:
+        revoked = x509.RevokedCertificateBuilder().serial_number(
+                row['serial']
+            ).revocation_date(
+                _parse_index_time(row['revoked_at'])
+            )
+        # RFC 5280 says to leave the reason out rather than use unspecified
+        if row['revocation_reason'] and row['revocation_reason'] != x509.ReasonFlags.unspecified.value:
+            revoked = revoked.add_extension(x509.CRLReason(x509.ReasonFlags(row['revocation_reason'])), critical=False)
+        crl = crl.add_revoked_certificate(revoked.build())
+
+    crl = crl.add_extension(x509.CRLNumber(crl_number), critical=False)
+    crl = crl.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(cacert.public_key()), critical=False)
+    if delta_crl_base is not None:
+        crl = crl.add_extension(x509.DeltaCRLIndicator(delta_crl_base), critical=True)
+
+    return crl.sign(cakey, signing_hash(cakey, hash_algorithm))
+
+def publish_crls(cust_name, ca_cert='ca.crt', ca_key='ca.key', full_every_days=7, delta_every_hours=1, force_full=False, only_if_due=False,
+                 due_margin_minutes=15, cert_index=None):
+    '''
+        Write crl.pem (full) and/or delta-crl.pem (revocations since the last full CRL) for a customer's CA
+
+        A full CRL gets published when there isn't one yet, when it's older than full_every_days or with force_full,
+            otherwise only the (small) delta CRL is regenerated -- that's the one you push to the routers on every revocation.
+        Full and delta CRLs share one increasing CRL number sequence (RFC 5280).  The full CRL's next update is the next scheduled
+            full CRL, the delta's is delta_every_hours from now.
+        only_if_due=True skips publishing until the current CRL is within due_margin_minutes of its next update (for a scheduled task).
+
+        returns the list of files written
+        raises an Exception if the customer has no CA (a CRL is no use from a CA that never issued anything)
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    (cafile, cakeyfile) = (f'{base_dir}\\{ca_cert}', f'{base_dir}\\{ca_key}')
+    if not (exists(cafile) and exists(cakeyfile)):
+        raise Exception(f'no CA for {cust_name} ({cafile} / {cakeyfile} not found)')
+    index = cert_index or CertIndex(base_dir)
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        next_update = index.get_meta('crl_next_update')
+        if only_if_due and next_update and \
+           _parse_index_time(next_update) - datetime.timedelta(minutes=due_margin_minutes) > now:
+            return []
+
+        (cacert, cakey) = (retrieve_cert_from_file(cafile), retrieve_key_from_file(cakeyfile))
+
+        crl_number = int(index.get_meta('crl_number', '0')) + 1
+        base_crl_number = index.get_meta('base_crl_number')
+        base_crl_time = index.get_meta('base_crl_time')
+        full_due = base_crl_time is None or \
+            _parse_index_time(base_crl_time) + datetime.timedelta(days=full_every_days) <= now
+
+        written = []
+        if force_full or full_due or base_crl_number is None:
+            full_next_update = now + datetime.timedelta(days=full_every_days)
+            crl = create_crl(cacert, cakey, index.revoked(), crl_number, full_next_update)
+            written.append(_write_atomic(dump_file_in_mem(crl), f'{base_dir}\\crl.pem'))
+            base_crl_number = crl_number
+            base_crl_time = _index_time(now)
+            crl_number += 1
+            index.set_meta({'base_crl_number': base_crl_number, 'base_crl_time': base_crl_time, 'crl_number': base_crl_number,
+                            'full_crl_next_update': _index_time(full_next_update)})
+
+        # the delta always goes out too (empty right after a full CRL), so the routers never hold a stale one
+        full_next_update = _parse_index_time(index.get_meta('full_crl_next_update'))
+        delta_next_update = min(now + datetime.timedelta(hours=delta_every_hours), full_next_update)
+        delta = create_crl(cacert, cakey, index.revoked(since=base_crl_time), crl_number, delta_next_update,
+                           delta_crl_base=int(base_crl_number))
+        written.append(_write_atomic(dump_file_in_mem(delta), f'{base_dir}\\delta-crl.pem'))
+        index.set_meta({'crl_number': crl_number, 'crl_next_update': _index_time(delta_next_update)})
+
+        return written
+    finally:
+        if cert_index is None:
+            index.close()
+
+def revoke_certificate(cust_name, serial, reason='unspecified', publish=True, cert_index=None):
+    '''
+        Revoke a certificate by serial and (by default) publish a new delta CRL right away
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    index = cert_index or CertIndex(base_dir)
+    try:
+        if not index.revoke(serial, reason):
+            if index.lookup_serial(serial) is None:
+                raise Exception(f'serial {serial} is not in the certificate index for {cust_name} (try: index {cust_name} --rebuild)')
+            # already revoked
+            return False
+        print(f'revoked certificate with serial: {serial} ({reason})')
+        if publish:
+            publish_crls(cust_name, cert_index=index)
+        return True
+    finally:
+        if cert_index is None:
+            index.close()
+
+def _write_atomic(data, filename):
+    '''
+        write bytes to a temp file and swap it in, so nobody ever reads a half written file
+    '''
+    tmpfile = f'{filename}.{os.getpid()}.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(data)
+    os.replace(tmpfile, filename)
+    return filename
+
+def get_or_create_ca(cafile:str, cakeyfile:str, base_dir, cust_name, key_size=2048, key_algorithm='rsa'):
+    '''
+        Get or create the files necessary to track a CA (key_size/key_algorithm only matter when a new CA gets created)
     '''
     if exists(cafile) and exists(cakeyfile):
         cakey  = retrieve_key_from_file(cakeyfile)
         cacert = retrieve_cert_from_file(cafile)
     else:
-        (cacert, cakey) = create_ca(CN=f'{cust_name.capitalize()} CA')
+        (cacert, cakey) = create_ca(CN=f'{cust_name.capitalize()} CA', key_size=key_size, key_algorithm=key_algorithm)
         dump_string_to_file(dump_file_in_mem(cacert).decode('utf-8'), cafile)
         dump_string_to_file(dump_file_in_mem(cakey).decode('utf-8'), cakeyfile)
         if not exists(f'{base_dir}\\certs'):
@@ -309,63 +878,1437 @@ def get_or_create_ca(cafile:str, cakeyfile:str, base_dir, cust_name):
     return (cacert, cakey)
 
 
-def request_certificate_from_ca(cust_name, cert_name, ca_cert='ca.crt', ca_key='ca.key', extendedKeyUsage='server_auth', key_size=2048):
+def request_certificate_from_ca(cust_name, cert_name, ca_cert='ca.crt', ca_key='ca.key', extendedKeyUsage='server_auth', key_size=2048, key_pool=None, cert_index=None,
+                                key_algorithm='rsa', ca=None, valid_days=3650 * 2):
     '''
-        Generate a new certificate from a CA
+        Generate a new certificate from a CA (with a key from key_pool if you pass a KeyPool)
+
+        key_algorithm/key_size are for the new cert's key (and for the CA too, if this ends up creating it)
+        ca is an already loaded (cacert, cakey) -- ie: from a CACache -- so the CA PEMs don't get read and parsed again
     '''
     base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
 
     cafile = f'{base_dir}\\{ca_cert}'
     cakeyfile = f'{base_dir}\\{ca_key}'
 
-    (cacert, cakey) = get_or_create_ca(cafile, cakeyfile, base_dir, cust_name)
+    if ca:
+        (cacert, cakey) = ca
+    else:
+        (cacert, cakey) = get_or_create_ca(cafile, cakeyfile, base_dir, cust_name, key_size=key_size, key_algorithm=key_algorithm)
 
     # Generate a new private key pair for a new certificate.
-    key = make_key(key_size)
+    if key_pool:
+        key = key_pool.take(key_size, key_algorithm)
+    else:
+        key = make_key(key_size, key_algorithm)
 
     # Generate a certificate request
     csr = make_csr(key, cert_name, extendedKeyUsage=extendedKeyUsage)
     serial = get_next_serial(f'{base_dir}\\serials.ini')
 
     # Sign the certificate with the new csr
-    crt = create_certificate_from_csr(csr, cakey, serial, cacert)
+    crt = create_certificate_from_csr(csr, cakey, serial, cacert, valid_days=valid_days)
     print(f'created certificate with serial: {serial} and subject: {cert_name}')
     crtdump = dump_file_in_mem(crt).decode('utf-8')
-    dump_string_to_file(crtdump, f'{base_dir}\\certs\\{serial}-{cert_name}.crt')
+    crtfile = f'{base_dir}\\certs\\{serial}-{cert_name}.crt'
+    dump_string_to_file(crtdump, crtfile)
+
+    # keep the cert index up to date (pass cert_index to reuse an open one)
+    index = cert_index or CertIndex(base_dir)
+    index.add(crt, crtfile)
+    if cert_index is None:
+        index.close()
 
     return cacert, crt, key, serial
 
 
-def make_new_ovpn_file(cust_name, cert_name, ca_cert='ca.crt', ca_key='ca.key', commonoptspath='commonopts.txt', extendedKeyUsage='client_auth', key_size=2048):
+def read_common_options(base_dir, commonoptspath='commonopts.txt'):
     '''
-        build an ovpn file from the key material
+        read the common options file (the extra stuff you want added to your .ovpn file) -- empty if there isn't one
     '''
-    # Read our common options file first
-
-    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
-
-    # commonoptsfile has extra stuff you want added to your .ovpn file
     commonoptsfile = f'{base_dir}\\{commonoptspath}'
     if exists(commonoptsfile):
-        f = open(commonoptsfile, 'r')
-        common = f.read()
-        f.close()
+        with open(commonoptsfile, 'r') as f:
+            common = f.read()
     else:
         common = ""
+    return common
+
+def build_ovpn(common, cacertdump, clientcert, clientkey):
+    '''
+        put the .ovpn file contents together from the common options and the PEMs
+    '''
+    return f"{common}<ca>\n{cacertdump}</ca>\n<cert>\n{clientcert}</cert>\n<key>\n{clientkey}</key>\n"
+
+def _file_stamp(*files):
+    '''
+        (mtime, size) of each file -- None if any of them is missing
+    '''
+    try:
+        return tuple((st.st_mtime_ns, st.st_size) for st in (os.stat(f) for f in files))
+    except OSError:
+        return None
+
+class OvpnRenderer(object):
+    '''
+        .ovpn profile template: the common options and the CA PEM are put together (and compiled into a string.Template) once,
+            so rendering a profile is one substitute() with the client cert and key
+
+        The common options can use ${variables}, ie: "remote ${remote_host} ${port}" and "proto ${proto}" -- they get filled in from
+            variables (the defaults) and whatever gets passed to render() for that profile.  ${customer} and ${cert_name} are always there.
+            Only the placeholders it has a value for get replaced, everything else is left exactly as is -- a stray $ (or $$) in an
+            existing commonopts.txt comes out the way it went in.
+    '''
+    def __init__(self, common, cacertdump, variables: dict=None):
+        # the PEMs go in as variables too, so there's nothing in them for the template to trip over
+        self.template = string.Template(f"{common}<ca>\n${{ca_cert}}</ca>\n<cert>\n${{client_cert}}</cert>\n<key>\n${{client_key}}</key>\n")
+        self.variables = dict(variables or {})
+        self.variables['ca_cert'] = cacertdump
+
+    def with_variables(self, variables: dict):
+        '''
+            a renderer sharing this one's compiled template, with more/different default variables
+        '''
+        renderer = OvpnRenderer.__new__(OvpnRenderer)
+        renderer.template = self.template
+        renderer.variables = dict(self.variables, **variables)
+        return renderer
+
+    def render(self, clientcert, clientkey, **variables):
+        values = dict(self.variables)
+        values.update(variables)
+        values['client_cert'] = clientcert
+        values['client_key'] = clientkey
+
+        # not safe_substitute: that would still turn a literal $$ into $
+        def convert(match):
+            name = match.group('named') or match.group('braced')
+            if name is not None and name in values:
+                return str(values[name])
+            return match.group()
+        return self.template.pattern.sub(convert, self.template.template)
+
+# (cust_name, commonoptspath, ca_cert) -> (file stamps, OvpnRenderer)
+_ovpn_renderers = {}
+_ovpn_renderers_lock = threading.Lock()
+
+def ovpn_renderer(cust_name, commonoptspath='commonopts.txt', ca_cert='ca.crt', variables: dict=None):
+    '''
+        The (cached) OvpnRenderer for a customer -- commonopts.txt and the CA cert are only read again when they change on disk
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    commonoptsfile = f'{base_dir}\\{commonoptspath}'
+    cafile = f'{base_dir}\\{ca_cert}'
+    key = (cust_name, commonoptspath, ca_cert)
+
+    with _ovpn_renderers_lock:
+        stamp = (_file_stamp(commonoptsfile), _file_stamp(cafile))
+        entry = _ovpn_renderers.get(key)
+        if entry is None or entry[0] != stamp:
+            with open(cafile, 'r') as f:
+                cacertdump = f.read()
+            entry = (stamp, OvpnRenderer(read_common_options(base_dir, commonoptspath), cacertdump))
+            _ovpn_renderers[key] = entry
+    return entry[1].with_variables(variables) if variables else entry[1]
+
+def make_new_ovpn_file(cust_name, cert_name, ca_cert='ca.crt', ca_key='ca.key', commonoptspath='commonopts.txt', extendedKeyUsage='client_auth', key_size=2048, key_pool=None,
+                       key_algorithm='rsa', ca=None, cert_index=None, variables: dict=None):
+    '''
+        build an ovpn file from the key material
 
-    (cacert, crt, key, serial) = request_certificate_from_ca(cust_name, cert_name, ca_cert=ca_cert, ca_key=ca_key, key_size=key_size, extendedKeyUsage=extendedKeyUsage)
+        variables fill in the ${...} placeholders in commonopts.txt (see OvpnRenderer)
+        returns (crt, serial, ovpnfile)
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+
+    (cacert, crt, key, serial) = request_certificate_from_ca(cust_name, cert_name, ca_cert=ca_cert, ca_key=ca_key, key_size=key_size, extendedKeyUsage=extendedKeyUsage, key_pool=key_pool,
+                                                                key_algorithm=key_algorithm, ca=ca, cert_index=cert_index)
     # Now we have a successfully signed certificate. We must now
     # create a .ovpn file and then dump it somewhere.
+    # (the common options and CA PEM come from the cached renderer, the CA exists by now)
     clientkey  = dump_file_in_mem(key).decode('utf-8')
     clientcert = dump_file_in_mem(crt).decode('utf-8')
-    cacertdump = dump_file_in_mem(cacert).decode('utf-8')
-    ovpn = f"{common}<ca>\n{cacertdump}</ca>\n<cert>\n{clientcert}</cert>\n<key>\n{clientkey}</key>\n"
+    ovpn = ovpn_renderer(cust_name, commonoptspath, ca_cert).render(clientcert, clientkey, customer=cust_name, cert_name=cert_name,
+                                                                    **(variables or {}))
 
-    dump_string_to_file(ovpn, f'{base_dir}\\{cust_name}-{cert_name}.ovpn', write_mode = 'w')
+    ovpnfile = f'{base_dir}\\{cust_name}-{cert_name}.ovpn'
+    dump_string_to_file(ovpn, ovpnfile, write_mode = 'w')
+    return (crt, serial, ovpnfile)
+
+def read_profiles_from_csv(csvfile):
+    '''
+        profiles from a CSV file: a list of dicts with cert_name plus any other columns (ie: remote_host, port, proto) as template variables
+            -- same column rules as read_cert_names_from_csv, without a header there are no variables
+    '''
+    with open(csvfile, 'r', newline='') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip()]
+
+    if not rows:
+        return []
+    header = [column.strip().lower() for column in rows[0]]
+    if 'cert_name' not in header:
+        return [{'cert_name': row[0].strip()} for row in rows]
+    profiles = []
+    for row in rows[1:]:
+        profile = {name: value.strip() for (name, value) in zip(header, row) if name and value.strip()}
+        if profile.get('cert_name'):
+            profiles.append(profile)
+    return profiles
+
+def read_cert_names_from_csv(csvfile):
+    '''
+        cert names from a CSV file -- the "cert_name" column if there's a header with one, otherwise the first column
+    '''
+    with open(csvfile, 'r', newline='') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip()]
+
+    if not rows:
+        return []
+    header = [column.strip().lower() for column in rows[0]]
+    if 'cert_name' in header:
+        column = header.index('cert_name')
+        return [row[column].strip() for row in rows[1:] if len(row) > column and row[column].strip()]
+    return [row[0].strip() for row in rows]
+
+# set in each bulk issuance worker process by _init_bulk_worker, so the CA is only loaded once per process
+_bulk_worker = {}
+
+def _init_bulk_worker(ca_pem, ca_key_pem, base_dir, cust_name, common, valid_days=3650 * 2, variables=None):
+    _bulk_worker['cacert'] = x509.load_pem_x509_certificate(ca_pem)
+    _bulk_worker['cakey'] = serialization.load_pem_private_key(ca_key_pem, password=None)
+    _bulk_worker['renderer'] = OvpnRenderer(common, ca_pem.decode('utf-8'), variables)
+    _bulk_worker['base_dir'] = base_dir
+    _bulk_worker['cust_name'] = cust_name
+    _bulk_worker['valid_days'] = valid_days
+
+def _bulk_issue_worker(cert_name, serial, extendedKeyUsage, key_size, write_ovpn, key_algorithm='rsa', return_key=False):
+    '''
+        runs in a worker process: make the key and csr, sign it and write the cert (and .ovpn) file
+
+        returns (ovpnfile, crtfile, clientcert, clientkey) -- clientkey is only sent back with return_key
+    '''
+    base_dir = _bulk_worker['base_dir']
+
+    key = make_key(key_size, key_algorithm)
+    csr = make_csr(key, cert_name, extendedKeyUsage=extendedKeyUsage)
+    crt = create_certificate_from_csr(csr, _bulk_worker['cakey'], serial, _bulk_worker['cacert'], valid_days=_bulk_worker['valid_days'])
+
+    clientcert = dump_file_in_mem(crt).decode('utf-8')
+    crtfile = f'{base_dir}\\certs\\{serial}-{cert_name}.crt'
+    dump_string_to_file(clientcert, crtfile)
+
+    ovpnfile = None
+    clientkey = dump_file_in_mem(key).decode('utf-8') if (write_ovpn or return_key) else None
+    if write_ovpn:
+        ovpnfile = f'{base_dir}\\{_bulk_worker["cust_name"]}-{cert_name}.ovpn'
+        ovpn = _bulk_worker['renderer'].render(clientcert, clientkey, customer=_bulk_worker['cust_name'], cert_name=cert_name)
+        dump_string_to_file(ovpn, ovpnfile, write_mode = 'w')
+
+    return (ovpnfile, crtfile, clientcert, clientkey if return_key else None)
+
+def check_unique_cert_names(cert_names):
+    '''
+        Raise ValueError if a cert name is in the batch twice -- both would get issued in parallel and write over the same key and
+            .ovpn file (case insensitive, the files live on Windows)
+    '''
+    seen = set()
+    duplicates = []
+    for cert_name in cert_names:
+        if cert_name.casefold() in seen and cert_name not in duplicates:
+            duplicates.append(cert_name)
+        seen.add(cert_name.casefold())
+    if duplicates:
+        raise ValueError(f'duplicate cert names in the batch: {", ".join(duplicates)}')
+
+def iter_bulk_issue(cust_name, cert_names:list, ca_cert='ca.crt', ca_key='ca.key', commonoptspath='commonopts.txt', extendedKeyUsage='client_auth',
+                    key_size=2048, max_workers=None, write_ovpn=True, key_algorithm='rsa', valid_days=3650 * 2, return_keys=False, variables:dict=None):
+    '''
+        The guts of bulk_make_new_ovpn_files, as a generator: yields the result dict for each cert name (in order) as soon as it's done
+
+        With return_keys the results also carry the PEMs ("certificate" and "key") so the caller can do something with them besides
+            a loose .ovpn file (ie: export_profiles_archive).  The whole batch goes in the cert index when the generator finishes.
+        Duplicate cert names raise ValueError before anything is issued.
+    '''
+    check_unique_cert_names(cert_names)
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+
+    cafile = f'{base_dir}\\{ca_cert}'
+    cakeyfile = f'{base_dir}\\{ca_key}'
+
+    (cacert, cakey) = get_or_create_ca(cafile, cakeyfile, base_dir, cust_name, key_size=key_size, key_algorithm=key_algorithm)
+    common = read_common_options(base_dir, commonoptspath)
+    serials = get_next_serials(f'{base_dir}\\serials.ini', len(cert_names))
+
+    initargs = (dump_file_in_mem(cacert), dump_file_in_mem(cakey), base_dir, cust_name, common, valid_days, variables)
+    issued = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_bulk_worker, initargs=initargs) as executor:
+            futures = [executor.submit(_bulk_issue_worker, cert_name, serial, extendedKeyUsage, key_size, write_ovpn, key_algorithm, return_keys)
+                       for (cert_name, serial) in zip(cert_names, serials)]
+            for (cert_name, serial, future) in zip(cert_names, serials, futures):
+                result = {'cert_name': cert_name, 'serial': serial, 'ok': True, 'error': None, 'ovpn_file': None}
+                try:
+                    (result['ovpn_file'], crtfile, clientcert, clientkey) = future.result()
+                    issued.append((x509.load_pem_x509_certificate(clientcert.encode('utf-8')), crtfile))
+                    if return_keys:
+                        result['certificate'] = clientcert
+                        result['key'] = clientkey
+                except Exception as e:
+                    result['ok'] = False
+                    result['error'] = str(e)
+                yield result
+    finally:
+        # one transaction for the whole batch
+        index = CertIndex(base_dir)
+        index.add_many(issued)
+        index.close()
+
+def bulk_make_new_ovpn_files(cust_name, cert_names:list=None, csvfile=None, ca_cert='ca.crt', ca_key='ca.key', commonoptspath='commonopts.txt',
+                             extendedKeyUsage='client_auth', key_size=2048, max_workers=None, write_ovpn=True, key_algorithm='rsa', valid_days=3650 * 2,
+                             variables:dict=None):
+    '''
+        Issue certificates (and .ovpn files) for a list of cert names and/or a CSV of them in one go
+
+        The key generation (the slow part) and signing run across a process pool, the serials get reserved as one block up front
+            and each worker writes its own cert/.ovpn file.
+
+        returns a list of dicts (one per cert name, in order): cert_name, serial, ok, error, ovpn_file
+        raises ValueError if the same cert name is in the list/CSV twice
+    '''
+    names = list(cert_names or [])
+    if csvfile:
+        names.extend(read_cert_names_from_csv(csvfile))
+    if not names:
+        return []
+    check_unique_cert_names(names)
+
+    results = list(iter_bulk_issue(cust_name, names, ca_cert=ca_cert, ca_key=ca_key, commonoptspath=commonoptspath, extendedKeyUsage=extendedKeyUsage,
+                                   key_size=key_size, max_workers=max_workers, write_ovpn=write_ovpn, key_algorithm=key_algorithm, valid_days=valid_days,
+                                   variables=variables))
+
+    print(f'bulk issued {sum(1 for result in results if result["ok"])} of {len(results)} certificates for {cust_name}')
+    return results
+
+def _archive_mode(archive):
+    if archive.lower().endswith('.zip'):
+        return 'zip'
+    if archive.lower().endswith(('.tar.gz', '.tgz')):
+        return 'w:gz'
+    if archive.lower().endswith('.tar'):
+        return 'w'
+    raise Exception(f"Don't know what kind of archive to make from the name: {archive} (use .zip, .tar, .tar.gz or .tgz)")
+
+def export_profiles_archive(cust_name, archive, profiles:list=None, cert_names:list=None, csvfile=None, variables:dict=None, commonoptspath='commonopts.txt',
+                            extendedKeyUsage='client_auth', key_size=2048, key_algorithm='rsa', max_workers=None, valid_days=3650 * 2):
+    '''
+        Issue certs for a batch of users and stream their .ovpn profiles straight into one .zip or .tar(.gz) archive for handing out
+
+        profiles is a list of dicts with cert_name and any per profile template variables (remote_host, port, proto, ...),
+            cert_names/csvfile add more (a CSV with a header can have variable columns too -- see read_profiles_from_csv).
+        variables are the defaults for every profile.  The keys and certs come straight from the bulk issuance workers and each
+            profile is rendered with the customer's cached template and written into the archive as it finishes -- no loose
+            .ovpn files.  The archive is built under a temp name and renamed when it's complete.
+        The archive has every user's private key in it, so treat it like one.
+
+        returns the bulk results (without the PEMs), with the archive member name in "member"
+    '''
+    profiles = [dict(profile) for profile in (profiles or [])]
+    profiles.extend({'cert_name': cert_name} for cert_name in (cert_names or []))
+    if csvfile:
+        profiles.extend(read_profiles_from_csv(csvfile))
+    if not profiles:
+        return []
+    check_unique_cert_names([profile['cert_name'] for profile in profiles])
+
+    mode = _archive_mode(archive)
+    tmpfile = f'{archive}.{os.getpid()}.tmp'
+    results = []
+    renderer = None
+    with (zipfile.ZipFile(tmpfile, 'w', compression=zipfile.ZIP_DEFLATED) if mode == 'zip' else tarfile.open(tmpfile, mode)) as out:
+        for (profile, result) in zip(profiles, iter_bulk_issue(cust_name, [profile['cert_name'] for profile in profiles], commonoptspath=commonoptspath,
+                                                               extendedKeyUsage=extendedKeyUsage, key_size=key_size, max_workers=max_workers,
+                                                               write_ovpn=False, key_algorithm=key_algorithm, valid_days=valid_days,
+                                                               return_keys=True)):
+            (clientcert, clientkey) = (result.pop('certificate', None), result.pop('key', None))
+            results.append(result)
+            if not result['ok']:
+                continue
+            if renderer is None:
+                # the CA exists by now
+                renderer = ovpn_renderer(cust_name, commonoptspath, variables=variables)
+            extra = {name: value for (name, value) in profile.items() if name != 'cert_name'}
+            data = renderer.render(clientcert, clientkey, customer=cust_name, cert_name=result['cert_name'], **extra).encode('utf-8')
+            result['member'] = f"{cust_name}-{result['cert_name']}.ovpn"
+            if mode == 'zip':
+                out.writestr(result['member'], data)
+            else:
+                info = tarfile.TarInfo(result['member'])
+                info.size = len(data)
+                info.mtime = time.time()
+                info.mode = 0o600
+                out.addfile(info, io.BytesIO(data))
+    os.replace(tmpfile, archive)
+
+    print(f"exported {sum(1 for result in results if result['ok'])} of {len(results)} profiles for {cust_name} to {archive}")
+    return results
+
+# ExtendedKeyUsage OID -> our EKU name
+EKU_NAMES = {oid: name for (name, oid) in EKU.items()}
+
+def cert_eku(cert):
+    '''
+        the EKU name (server_auth, client_auth, code_signing) of a cert, None if it doesn't have one we know
+    '''
+    try:
+        usages = cert.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+    except x509.ExtensionNotFound:
+        return None
+    for oid in usages:
+        if oid in EKU_NAMES:
+            return EKU_NAMES[oid]
+    return None
+
+def cert_key_params(cert):
+    '''
+        (key_size, key_algorithm) of a cert's public key -- what make_key needs to make a key like it
+    '''
+    public_key = cert.public_key()
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return (public_key.curve.key_size, 'ec')
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return (2048, 'ed25519')
+    return (public_key.key_size, 'rsa')
+
+def scan_customer_expiry(cust_name, days=30, include_expired=False, ca_cert='ca.crt'):
+    '''
+        The CA and certs of one customer that expire in the next days days
+
+        Uses the cert index when there is one (only the expiring rows get read), otherwise parses everything in the certs directory.
+        Only the newest cert per common name counts -- a CN that already has a valid cert past the window was renewed already.
+        The CA is always reported when it's in the window, even if it already expired.
+
+        returns a list of dicts: customer, kind (ca or cert), serial, cn, not_after (UTC text), filename
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    now = datetime.datetime.now(datetime.timezone.utc)
+    start = '' if include_expired else _index_time(now)
+    end = _index_time(now + datetime.timedelta(days=days))
+
+    found = []
+    cafile = f'{base_dir}\\{ca_cert}'
+    if exists(cafile):
+        cacert = retrieve_cert_from_file(cafile)
+        if _index_time(cert_not_after(cacert)) <= end:
+            found.append({'customer': cust_name, 'kind': 'ca', 'serial': cacert.serial_number, 'cn': cacert.subject.rfc4514_string(),
+                          'not_after': _index_time(cert_not_after(cacert)), 'filename': cafile})
+
+    newest = {}
+    if exists(f'{base_dir}\\certindex.db'):
+        index = CertIndex(base_dir)
+        try:
+            for row in index.expiring(days, include_expired=include_expired):
+                if row['cn'] not in newest:
+                    newest[row['cn']] = max((other for other in index.find_by_cn(row['cn']) if other['status'] == 'V'),
+                                            key=lambda other: other['not_after'], default=row)
+        finally:
+            index.close()
+    elif exists(f'{base_dir}\\certs'):
+        for name in os.listdir(f'{base_dir}\\certs'):
+            if not name.endswith('.crt'):
+                continue
+            cert = retrieve_cert_from_file(f'{base_dir}\\certs\\{name}')
+            cns = cert.subject.get_attributes_for_oid(x509.oid.NameOID.COMMON_NAME)
+            row = {'serial': cert.serial_number, 'cn': cns[0].value if cns else None, 'not_after': _index_time(cert_not_after(cert)),
+                   'filename': f'{base_dir}\\certs\\{name}'}
+            if row['cn'] not in newest or row['not_after'] > newest[row['cn']]['not_after']:
+                newest[row['cn']] = row
+
+    for (cn, row) in sorted(newest.items(), key=lambda item: item[1]['not_after']):
+        if start <= row['not_after'] <= end:
+            found.append({'customer': cust_name, 'kind': 'cert', 'serial': row['serial'], 'cn': cn, 'not_after': row['not_after'],
+                          'filename': row['filename']})
+    return found
+
+def scan_expiring(days=30, customers:list=None, include_expired=False, max_workers=8):
+    '''
+        scan_customer_expiry for every customer under BASE_PATH (or just customers) in parallel
+
+        a customer that can't be scanned shows up as kind "error" (with an error message) instead of stopping the scan
+    '''
+    if customers is None:
+        customers = sorted(name for name in os.listdir(BASE_PATH) if exists(f'{BASE_PATH}\\{name}\\openvpn'))
+
+    def scan(cust_name):
+        try:
+            return scan_customer_expiry(cust_name, days=days, include_expired=include_expired)
+        except Exception as e:
+            return [{'customer': cust_name, 'kind': 'error', 'error': str(e)}]
+
+    found = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for items in executor.map(scan, customers):
+            found.extend(items)
+    return found
+
+def _replace_ovpn_ca(ovpnfile, cacertdump):
+    with open(ovpnfile, 'r') as f:
+        ovpn = f.read()
+    updated = re.sub(r'<ca>\n.*?</ca>', lambda match: f'<ca>\n{cacertdump}</ca>', ovpn, count=1, flags=re.DOTALL)
+    if updated != ovpn:
+        _write_atomic(updated.encode('utf-8'), ovpnfile)
+        return True
+    return False
+
+def renew_ca(cust_name, ca_cert='ca.crt', ca_key='ca.key', valid_days=3650 * 2):
+    '''
+        Renew a customer's CA by re-signing it with the same key (same subject and extensions, new serial and validity)
+
+        Everything it already issued still chains to it, so the only thing that has to change is the <ca> block in the .ovpn files --
+            those get updated in place.  The old CA cert is kept as ca.crt.<date>.bak.
+
+        returns (new CA cert, list of updated .ovpn files)
+    '''
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    cafile = f'{base_dir}\\{ca_cert}'
+    (cacert, cakey) = (retrieve_cert_from_file(cafile), retrieve_key_from_file(f'{base_dir}\\{ca_key}'))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    renewed = x509.CertificateBuilder().subject_name(
+            cacert.subject
+        ).issuer_name(
+            cacert.subject
+        ).public_key(
+            cacert.public_key()
+        ).serial_number(
+            get_next_serial(f'{base_dir}\\serials.ini')
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + datetime.timedelta(days=valid_days)
+        )
+    for ext in cacert.extensions:
+        renewed = renewed.add_extension(ext.value, ext.critical)
+    renewed = renewed.sign(cakey, signing_hash(cakey))
+
+    _write_atomic(dump_file_in_mem(cacert), f'{cafile}.{now:%Y%m%d%H%M%S}.bak')
+    _write_atomic(dump_file_in_mem(renewed), cafile)
+    print(f'renewed the CA for {cust_name} (serial: {renewed.serial_number}, valid until {cert_not_after(renewed):%Y-%m-%d})')
+
+    cacertdump = dump_file_in_mem(renewed).decode('utf-8')
+    updated = [f'{base_dir}\\{name}' for name in sorted(os.listdir(base_dir))
+               if name.endswith('.ovpn') and _replace_ovpn_ca(f'{base_dir}\\{name}', cacertdump)]
+    return (renewed, updated)
+
+def renew_expiring(days=30, customers:list=None, dry_run=True, max_workers=4, valid_days=None, include_expired=False, revoke_old=False,
+                   ca_valid_days=3650 * 2, batch_size=500):
+    '''
+        Find everything expiring in the next days days (scan_expiring) and renew it
+
+        CAs get re-signed with the same key (renew_ca), certs get a new key and cert for the same CN, EKU and key type,
+            issued in batches of batch_size through bulk_make_new_ovpn_files (max_workers processes at a time), with the
+            .ovpn file regenerated for client_auth certs.
+        valid_days=None keeps each cert's current lifetime, otherwise renewed certs get valid_days (ie: for moving to short lived certs).
+        revoke_old=True revokes the replaced certs as superseded (and publishes the CRLs) once their renewal worked.
+        dry_run=True (the default) only reports what it would do.
+
+        returns a report: a list of dicts with customer, kind, cn, serial, not_after, action, ok, error (and new_serial for certs)
+    '''
+    report = []
+    by_customer = {}
+    for item in scan_expiring(days=days, customers=customers, include_expired=include_expired, max_workers=max_workers):
+        if item['kind'] == 'error':
+            report.append(dict(item, action='scan', ok=False))
+        else:
+            by_customer.setdefault(item['customer'], []).append(item)
+
+    for (cust_name, items) in by_customer.items():
+        for item in [item for item in items if item['kind'] == 'ca']:
+            entry = dict(item, action='renew ca', ok=True, error=None)
+            if not dry_run:
+                try:
+                    renew_ca(cust_name, valid_days=ca_valid_days)
+                except Exception as e:
+                    entry.update(ok=False, error=str(e))
+            report.append(entry)
+
+        # group the certs by what bulk issuance needs to be the same for a whole batch
+        groups = {}
+        for item in [item for item in items if item['kind'] == 'cert']:
+            entry = dict(item, action='renew', ok=True, error=None, new_serial=None)
+            report.append(entry)
+            try:
+                cert = retrieve_cert_from_file(item['filename'])
+                (key_size, key_algorithm) = cert_key_params(cert)
+                lifetime = valid_days or max((cert_not_after(cert) - cert_not_before(cert)).days, 1)
+                groups.setdefault((cert_eku(cert) or 'client_auth', key_size, key_algorithm, lifetime), []).append(entry)
+            except Exception as e:
+                entry.update(ok=False, error=str(e))
+
+        if dry_run:
+            continue
+
+        superseded = []
+        for ((eku, key_size, key_algorithm, lifetime), entries) in groups.items():
+            for first in range(0, len(entries), batch_size):
+                batch = entries[first:first + batch_size]
+                results = bulk_make_new_ovpn_files(cust_name, cert_names=[entry['cn'] for entry in batch], extendedKeyUsage=eku,
+                                                   key_size=key_size, key_algorithm=key_algorithm, max_workers=max_workers,
+                                                   write_ovpn=(eku == 'client_auth'), valid_days=lifetime)
+                for (entry, result) in zip(batch, results):
+                    entry.update(ok=result['ok'], error=result['error'], new_serial=result['serial'] if result['ok'] else None)
+                    if revoke_old and result['ok']:
+                        superseded.append(entry)
+
+        if superseded:
+            index = CertIndex(f'{BASE_PATH}\\{cust_name}\\openvpn')
+            try:
+                # the scan may not have used the index, so make sure the old certs are in it before revoking them
+                index.add_many([(retrieve_cert_from_file(entry['filename']), entry['filename']) for entry in superseded])
+                for entry in superseded:
+                    revoke_certificate(cust_name, entry['serial'], reason='superseded', publish=False, cert_index=index)
+                publish_crls(cust_name, cert_index=index)
+            finally:
+                index.close()
+
+    return report
+
+class CSRPolicy(object):
+    '''
+        What the csr inbox will sign
+
+        check() returns the list of reasons a CSR gets rejected (empty means sign it):
+            the CSR signature has to verify, there has to be exactly one CN matching cn_pattern, RSA keys need min_rsa_bits,
+            EC keys one of ec_curves, ed25519 only if allow_ed25519, and the only extensions it can ask for are
+            BasicConstraints (not a CA), ExtendedKeyUsage (from allowed_ekus) and DNS SubjectAlternativeNames (if allow_sans)
+        The cert only gets the extensions the policy builds (signing_profile), never a copy of whatever the CSR asked for.
+    '''
+    def __init__(self, allowed_ekus=('client_auth', 'server_auth'), default_eku='client_auth', min_rsa_bits=2048, ec_curves=(256, 384, 521),
+                 allow_ed25519=True, allow_sans=True, cn_pattern=r'^[A-Za-z0-9][A-Za-z0-9_.@-]*$', valid_days=3650 * 2):
+        self.allowed_ekus = tuple(allowed_ekus)
+        self.default_eku = default_eku
+        self.min_rsa_bits = min_rsa_bits
+        self.ec_curves = tuple(ec_curves)
+        self.allow_ed25519 = allow_ed25519
+        self.allow_sans = allow_sans
+        self.cn_pattern = re.compile(cn_pattern)
+        self.valid_days = valid_days
+
+    def check(self, csr):
+        problems = []
+        if not csr.is_signature_valid:
+            problems.append('the CSR signature does not verify')
+
+        cns = csr.subject.get_attributes_for_oid(x509.oid.NameOID.COMMON_NAME)
+        if len(cns) != 1 or not self.cn_pattern.match(cns[0].value):
+            problems.append(f'needs exactly one CN matching {self.cn_pattern.pattern}')
+
+        public_key = csr.public_key()
+        if isinstance(public_key, rsa.RSAPublicKey):
+            if public_key.key_size < self.min_rsa_bits:
+                problems.append(f'RSA key is {public_key.key_size} bits (the minimum is {self.min_rsa_bits})')
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            if public_key.curve.key_size not in self.ec_curves:
+                problems.append(f'EC curve {public_key.curve.name} is not allowed')
+        elif isinstance(public_key, ed25519.Ed25519PublicKey):
+            if not self.allow_ed25519:
+                problems.append('ed25519 keys are not allowed')
+        else:
+            problems.append(f'unsupported key type: {type(public_key).__name__}')
+
+        for ext in csr.extensions:
+            value = ext.value
+            if isinstance(value, x509.BasicConstraints):
+                if value.ca:
+                    problems.append('asks to be a CA')
+            elif isinstance(value, x509.ExtendedKeyUsage):
+                names = [EKU_NAMES.get(oid, oid.dotted_string) for oid in value]
+                if not names or any(name not in self.allowed_ekus for name in names):
+                    problems.append(f"extended key usage not allowed: {', '.join(names)}")
+            elif isinstance(value, x509.SubjectAlternativeName):
+                if not self.allow_sans:
+                    problems.append('subject alternative names are not allowed')
+                elif any(not isinstance(name, x509.DNSName) for name in value):
+                    problems.append('only DNS subject alternative names are allowed')
+            else:
+                problems.append(f'extension not allowed: {ext.oid._name} ({ext.oid.dotted_string})')
+        return problems
+
+    def signing_profile(self, csr):
+        '''
+            (eku names, DNS SANs) to sign a checked CSR with -- plain lists, so they can go to a worker process
+        '''
+        ekus = [self.default_eku]
+        sans = []
+        for ext in csr.extensions:
+            if isinstance(ext.value, x509.ExtendedKeyUsage):
+                ekus = [EKU_NAMES[oid] for oid in ext.value]
+            elif isinstance(ext.value, x509.SubjectAlternativeName):
+                sans = ext.value.get_values_for_type(x509.DNSName)
+        return (ekus, sans)
+
+def _sign_csr_worker(csr_pem, serial, ekus, sans):
+    '''
+        runs in a worker process (set up by _init_bulk_worker): sign one checked CSR with the policy's extensions
+    '''
+    csr = x509.load_pem_x509_csr(csr_pem)
+    extensions = [(x509.BasicConstraints(ca=False, path_length=None), True),
+                  (x509.ExtendedKeyUsage([EKU[eku] for eku in ekus]), True)]
+    if sans:
+        extensions.append((x509.SubjectAlternativeName([x509.DNSName(san) for san in sans]), False))
+    crt = create_certificate_from_csr(csr, _bulk_worker['cakey'], serial, _bulk_worker['cacert'], valid_days=_bulk_worker['valid_days'],
+                                      extensions=extensions)
+    return dump_file_in_mem(crt)
+
+# what counts as a CSR in the inbox
+CSR_SUFFIXES = ('.csr', '.req', '.pem')
+
+def _load_csr(csrfile):
+    with open(csrfile, 'rb') as f:
+        data = f.read()
+    if b'-----BEGIN' in data:
+        return x509.load_pem_x509_csr(data)
+    return x509.load_der_x509_csr(data)
+
+def process_csr_inbox(cust_name, policy:CSRPolicy=None, ca_cert='ca.crt', ca_key='ca.key', batch_size=100, max_workers=None, settle_seconds=2):
+    '''
+        Sign the new CSRs devices dropped into {BASE_PATH}\\<customer>\\openvpn\\csr-inbox
+
+        Every CSR file still sitting in the inbox gets handled (whatever its mtime, so ones copied in with their original dates
+            aren't missed), and once its result is in the outbox it's moved to csr-inbox\\processed (signed) or csr-inbox\\failed
+            (rejected or the signing failed).  Files modified in the last settle_seconds are left for the next run (they may still
+            be getting written).
+        Each CSR is checked against the policy, then the good ones are signed in batches of batch_size across a process pool.
+        Results go to csr-outbox, named after the whole inbox file name: alice.csr -> alice.csr.crt for signed ones,
+            alice.csr.rejected (the reasons) for the rest (so alice.csr and alice.pem don't overwrite each other's results) -- each
+            written to a temp file and renamed into place, so whatever picks them up never sees a partial file.  Signed certs also
+            go in the certs directory and the cert index like every other cert.
+
+        returns a list of dicts: file, ok, serial, cn, error
+    '''
+    policy = policy or CSRPolicy()
+    base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+    inbox = f'{base_dir}\\csr-inbox'
+    outbox = f'{base_dir}\\csr-outbox'
+    processed = f'{inbox}\\processed'
+    failed = f'{inbox}\\failed'
+    for directory in (inbox, outbox, processed, failed, f'{base_dir}\\certs'):
+        os.makedirs(directory, exist_ok=True)
+
+    settled_before = time.time_ns() - int(settle_seconds * 1e9)
+    pending = []
+    with os.scandir(inbox) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(CSR_SUFFIXES) and entry.stat().st_mtime_ns <= settled_before:
+                pending.append(entry.name)
+    pending.sort()
+    if not pending:
+        return []
+
+    (cacert, cakey) = get_or_create_ca(f'{base_dir}\\{ca_cert}', f'{base_dir}\\{ca_key}', base_dir, cust_name)
+    initargs = (dump_file_in_mem(cacert), dump_file_in_mem(cakey), base_dir, cust_name, '', policy.valid_days)
+    index = CertIndex(base_dir)
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_bulk_worker, initargs=initargs) as executor:
+            for first in range(0, len(pending), batch_size):
+                batch = pending[first:first + batch_size]
+                to_sign = []
+                for name in batch:
+                    result = {'file': name, 'ok': False, 'serial': None, 'cn': None, 'error': None}
+                    results.append(result)
+                    try:
+                        csr = _load_csr(f'{inbox}\\{name}')
+                        problems = policy.check(csr)
+                    except Exception as e:
+                        problems = [f'could not read the CSR: {e}']
+                    if problems:
+                        result['error'] = '; '.join(problems)
+                        _write_atomic(('\n'.join(problems) + '\n').encode('utf-8'), f'{outbox}\\{name}.rejected')
+                        os.replace(f'{inbox}\\{name}', f'{failed}\\{name}')
+                        continue
+                    result['cn'] = csr.subject.get_attributes_for_oid(x509.oid.NameOID.COMMON_NAME)[0].value
+                    to_sign.append((result, name, csr))
+
+                serials = get_next_serials(f'{base_dir}\\serials.ini', len(to_sign))
+                futures = [executor.submit(_sign_csr_worker, csr.public_bytes(serialization.Encoding.PEM), serial, *policy.signing_profile(csr))
+                           for ((result, name, csr), serial) in zip(to_sign, serials)]
+                issued = []
+                handled = []
+                for ((result, name, csr), serial, future) in zip(to_sign, serials, futures):
+                    try:
+                        crtdump = future.result()
+                    except Exception as e:
+                        result['error'] = f'signing failed: {e}'
+                        _write_atomic(f"{result['error']}\n".encode('utf-8'), f'{outbox}\\{name}.rejected')
+                        handled.append((name, failed))
+                        continue
+                    crtfile = f"{base_dir}\\certs\\{serial}-{result['cn']}.crt"
+                    _write_atomic(crtdump, crtfile)
+                    _write_atomic(crtdump, f'{outbox}\\{name}.crt')
+                    issued.append((x509.load_pem_x509_certificate(crtdump), crtfile))
+                    result.update(ok=True, serial=serial)
+                    handled.append((name, processed))
+                index.add_many(issued)
+
+                # the results are in the outbox and the certs are indexed, take the CSRs out of the inbox
+                for (name, directory) in handled:
+                    os.replace(f'{inbox}\\{name}', f'{directory}\\{name}')
+    finally:
+        index.close()
+
+    print(f"csr inbox for {cust_name}: signed {sum(1 for result in results if result['ok'])} of {len(results)}")
+    return results
+
+def watch_csr_inbox(cust_name, interval=5, **kwargs):
+    '''
+        run process_csr_inbox every interval seconds (until Ctrl-C)
+    '''
+    try:
+        while True:
+            for result in process_csr_inbox(cust_name, **kwargs):
+                print(f"{'SIGNED' if result['ok'] else 'REJECTED'} {result['file']} {result['serial'] or ''} {result['error'] or ''}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+class CACache(object):
+    '''
+        In-memory cache of each customer's CA cert and key, so a long running process only reads and parses the CA PEMs once
+
+        An entry is reloaded when the mtime or size of the CA cert or key file changes (ie: after a CA renewal), which costs
+            two os.stat() calls per get() instead of two PEM loads
+    '''
+    def __init__(self):
+        self._cas = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, cust_name, ca_cert='ca.crt', ca_key='ca.key', key_size=2048, key_algorithm='rsa'):
+        '''
+            (cacert, cakey) for a customer, creating the CA (with key_size/key_algorithm) if it doesn't exist yet
+        '''
+        base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+        cafile = f'{base_dir}\\{ca_cert}'
+        cakeyfile = f'{base_dir}\\{ca_key}'
+
+        with self._lock:
+            stamp = _file_stamp(cafile, cakeyfile)
+            entry = self._cas.get((cafile, cakeyfile))
+            if entry and stamp and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+
+            ca = get_or_create_ca(cafile, cakeyfile, base_dir, cust_name, key_size=key_size, key_algorithm=key_algorithm)
+            self._cas[(cafile, cakeyfile)] = (_file_stamp(cafile, cakeyfile), ca)
+            self.loads += 1
+            return ca
+
+    def invalidate(self, cust_name=None):
+        with self._lock:
+            if cust_name is None:
+                self._cas.clear()
+            else:
+                base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+                for key in [key for key in self._cas if key[0].startswith(f'{base_dir}\\')]:
+                    del self._cas[key]
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._cas), 'hits': self.hits, 'loads': self.loads}
+
+# customer names end up in paths, so keep them to something boring
+CUSTOMER_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+class IssuanceDaemon(object):
+    '''
+        Long running issuer: a local HTTP JSON API in front of a queue and a pool of worker threads
+
+        The workers share one CACache and one CertIndex per customer, so an issuance costs a key (or a key pool hit) and a signature
+            instead of a python/cryptography start up plus parsing the CA PEMs.
+
+        POST /issue  {"customer": "acme", "cert_name": "bob", "eku": "client_auth", "key_size": 2048, "key_algorithm": "rsa", "ovpn": true}
+                     -> {"serial": ..., "cert_name": ..., "ovpn_file": ..., "certificate": "<PEM>"}
+                     key_size has to be a number: 2048, 3072 or 4096 for rsa, the curve (256, 384 or 521) for ec, ed25519 ignores it
+        GET /stats   -> queue depth, issued/failed counts and the CA cache stats
+
+        The customer's {BASE_PATH}\\<customer>\\openvpn directory has to exist already (the daemon won't make new customers).
+        key_pool_target > 0 keeps a background refilled KeyPool per customer and key type (needs KEY_POOL_PASSPHRASE).
+        There's no authentication -- it binds to localhost by default, keep it that way.
+    '''
+    def __init__(self, host='127.0.0.1', port=8750, workers=4, max_queue=1000, request_timeout=300, key_pool_target=0):
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self.key_pool_target = key_pool_target
+        self.ca_cache = CACache()
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.issued = 0
+        self.failed = 0
+
+        self._cert_indexes = {}
+        self._key_pools = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._http_thread = None
+
+        handler = type('IssuanceRequestHandler', (_IssuanceRequestHandler,), {'issuer': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._http_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._http_thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self._threads:
+            self.jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for key_pool in self._key_pools.values():
+            key_pool.stop()
+        for cert_index in self._cert_indexes.values():
+            cert_index.close()
+        self._key_pools = {}
+        self._cert_indexes = {}
+
+    def submit(self, request: dict):
+        '''
+            queue an issuance request, returns the job (wait on job['done'], then look at job['result'] / job['error'])
+            raises queue.Full if the queue is full
+        '''
+        job = {'request': request, 'done': threading.Event(), 'result': None, 'error': None}
+        self.jobs.put_nowait(job)
+        return job
+
+    def issue(self, customer, cert_name, eku='client_auth', key_size=2048, key_algorithm='rsa', ovpn=True):
+        '''
+            issue one cert (and .ovpn file) with the cached CA -- this is what the workers run
+        '''
+        if not CUSTOMER_NAME.match(str(customer)) or not CUSTOMER_NAME.match(str(cert_name)):
+            raise ValueError('customer and cert_name can only have letters, numbers, "_", "." and "-"')
+        if eku not in EKU:
+            raise ValueError(f"unknown eku: {eku} (use one of: {', '.join(EKU)})")
+        if key_algorithm not in KEY_ALGORITHMS:
+            raise ValueError(f"unknown key_algorithm: {key_algorithm} (use one of: {', '.join(KEY_ALGORITHMS)})")
+        base_dir = f'{BASE_PATH}\\{customer}\\openvpn'
+        if not exists(base_dir):
+            raise LookupError(f'no such customer: {customer}')
+
+        ca = self.ca_cache.get(customer, key_size=key_size, key_algorithm=key_algorithm)
+        (cert_index, key_pool) = self._customer_state(customer, base_dir, key_size, key_algorithm)
+        ovpnfile = None
+        if ovpn:
+            (crt, serial, ovpnfile) = make_new_ovpn_file(customer, cert_name, extendedKeyUsage=eku, key_size=key_size, key_algorithm=key_algorithm,
+                                                         key_pool=key_pool, ca=ca, cert_index=cert_index)
+        else:
+            (cacert, crt, key, serial) = request_certificate_from_ca(customer, cert_name, extendedKeyUsage=eku, key_size=key_size,
+                                                                     key_algorithm=key_algorithm, key_pool=key_pool, ca=ca, cert_index=cert_index)
+        return {'serial': serial, 'cert_name': cert_name, 'ovpn_file': ovpnfile, 'certificate': dump_file_in_mem(crt).decode('utf-8')}
+
+    def stats(self):
+        return {'queued': self.jobs.qsize(), 'workers': self.workers, 'issued': self.issued, 'failed': self.failed,
+                'ca_cache': self.ca_cache.stats()}
+
+    def _customer_state(self, customer, base_dir, key_size, key_algorithm):
+        with self._lock:
+            if customer not in self._cert_indexes:
+                self._cert_indexes[customer] = CertIndex(base_dir)
+            key_pool = None
+            if self.key_pool_target > 0:
+                pool_key = (customer, key_type(key_size, key_algorithm))
+                if pool_key not in self._key_pools:
+                    self._key_pools[pool_key] = KeyPool(customer, sizes=(key_size,), target=self.key_pool_target,
+                                                        key_algorithm=key_algorithm).start()
+                key_pool = self._key_pools[pool_key]
+            return (self._cert_indexes[customer], key_pool)
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                job['result'] = self.issue(**job['request'])
+                with self._lock:
+                    self.issued += 1
+            except Exception as e:
+                job['error'] = e
+                with self._lock:
+                    self.failed += 1
+            finally:
+                job['done'].set()
+
+class _IssuanceRequestHandler(BaseHTTPRequestHandler):
+    issuer = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, self.issuer.stats())
+        else:
+            self._respond(404, {'error': f'not found: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/issue':
+            self._respond(404, {'error': f'not found: {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', '0'))) or b'{}')
+            if not isinstance(request, dict) or 'customer' not in request or 'cert_name' not in request:
+                raise ValueError('need a JSON object with at least customer and cert_name')
+            # only pass along what issue() knows about
+            request = {name: request[name] for name in ('customer', 'cert_name', 'eku', 'key_size', 'key_algorithm', 'ovpn') if name in request}
+            self._check_key_request(request)
+            job = self.issuer.submit(request)
+        except queue.Full:
+            self._respond(503, {'error': 'the issuance queue is full, try again later'})
+            return
+        except ValueError as e:
+            self._respond(400, {'error': str(e)})
+            return
+
+        if not job['done'].wait(self.issuer.request_timeout):
+            self._respond(504, {'error': 'timed out waiting for the certificate (it may still get issued)'})
+        elif job['error'] is not None:
+            status = 400 if isinstance(job['error'], (ValueError, TypeError)) else 404 if isinstance(job['error'], LookupError) else 500
+            self._respond(status, {'error': str(job['error'])})
+        else:
+            self._respond(200, job['result'])
+
+    @staticmethod
+    def _check_key_request(request):
+        '''
+            key_size/key_algorithm straight out of the JSON body, checked before they get anywhere near make_key
+            (ed25519 ignores key_size, so whatever's in it gets dropped instead of checked)
+        '''
+        key_algorithm = request.get('key_algorithm', 'rsa')
+        if not isinstance(key_algorithm, str) or key_algorithm not in KEY_ALGORITHMS:
+            raise ValueError(f"key_algorithm must be one of: {', '.join(KEY_ALGORITHMS)}")
+        if key_algorithm == 'ed25519':
+            request.pop('key_size', None)
+        if 'key_size' not in request:
+            return
+        key_size = request['key_size']
+        # bool is an int too, but "key_size": true isn't a key size
+        if not isinstance(key_size, int) or isinstance(key_size, bool):
+            raise ValueError(f'key_size must be a number, not {json.dumps(key_size)}')
+        if key_algorithm == 'rsa' and key_size not in RSA_KEY_SIZES:
+            raise ValueError(f"key_size for rsa must be one of: {', '.join(str(size) for size in RSA_KEY_SIZES)}")
+        if key_algorithm == 'ec' and key_size not in EC_CURVES:
+            raise ValueError(f"key_size for ec (the curve) must be one of: {', '.join(str(size) for size in EC_CURVES)}")
+
+    def _respond(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class OCSPResponder(object):
+    '''
+        Local OCSP responder for a customer's CA, backed by the cert index
+
+        Responses are signed ahead of time: refresh() signs a response for every serial in the index and keeps the DER bytes in a dict
+            keyed by the OCSP cert ID (issuer name hash, issuer key hash, serial, hash algorithm), so answering a request is a dict
+            lookup.  A background thread re-signs everything every refresh_hours (responses are good for validity_hours) and every
+            poll_seconds picks up revocations made by other processes (ie: the revoke command) and re-signs just those entries.
+            revoke() does the same thing right away for revocations made through the responder.
+        SHA1 cert IDs (what OpenSSL and most clients send) are signed up front, SHA256 ones get signed and cached on first use.
+        Certs issued after the last refresh get signed on their first request, serials that aren't in the index get a
+            (signed on the fly, not cached) "unknown".
+        Pre-signed responses can't echo a nonce, so nonces are ignored (the RFC 5019 lightweight profile allows that).
+
+        GET /<base64 request> and POST / (application/ocsp-request) on host:port -- needs cryptography 43+ (add_response_by_hash)
+    '''
+    def __init__(self, cust_name, host='127.0.0.1', port=8751, ca_cert='ca.crt', ca_key='ca.key', refresh_hours=12, validity_hours=24,
+                 poll_seconds=5):
+        self.cust_name = cust_name
+        self.base_dir = f'{BASE_PATH}\\{cust_name}\\openvpn'
+        self.cacert = retrieve_cert_from_file(f'{self.base_dir}\\{ca_cert}')
+        self.cakey = retrieve_key_from_file(f'{self.base_dir}\\{ca_key}')
+        self.refresh_hours = refresh_hours
+        self.validity_hours = validity_hours
+        self.poll_seconds = poll_seconds
+        self.index = CertIndex(self.base_dir)
+
+        self.issuer_hashes = {}
+        for algorithm in (hashes.SHA1(), hashes.SHA256()):
+            # the easiest way to get the issuer name/key hashes exactly the way clients compute them is to build a request
+            request = ocsp.OCSPRequestBuilder().add_certificate(self.cacert, self.cacert, algorithm).build()
+            self.issuer_hashes[algorithm.name] = (request.issuer_name_hash, request.issuer_key_hash)
+
+        self._responses = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_refresh = 0
+        self._last_poll = None
+        # serials already re-signed as revoked (the revoked_at times only have 1 second resolution, so polls overlap)
+        self._revoked = set()
+        self.hits = 0
+        self.misses = 0
+        self.signed = 0
+
+        handler = type('OCSPRequestHandler', (_OCSPRequestHandler,), {'responder': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def _cert_id(self, serial, algorithm_name='sha1'):
+        (name_hash, key_hash) = self.issuer_hashes[algorithm_name]
+        return (name_hash, key_hash, serial, algorithm_name)
+
+    def _sign(self, serial, row, algorithm):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        (name_hash, key_hash) = self.issuer_hashes[algorithm.name]
+        if row is None:
+            (status, revoked_at, reason) = (ocsp.OCSPCertStatus.UNKNOWN, None, None)
+        elif row['status'] == 'R':
+            (status, revoked_at) = (ocsp.OCSPCertStatus.REVOKED, _parse_index_time(row['revoked_at']))
+            reason = x509.ReasonFlags(row['revocation_reason']) if row['revocation_reason'] else None
+        else:
+            (status, revoked_at, reason) = (ocsp.OCSPCertStatus.GOOD, None, None)
+
+        response = ocsp.OCSPResponseBuilder().add_response_by_hash(
+                issuer_name_hash=name_hash, issuer_key_hash=key_hash, serial_number=serial, algorithm=algorithm,
+                cert_status=status, this_update=now, next_update=now + datetime.timedelta(hours=self.validity_hours),
+                revocation_time=revoked_at, revocation_reason=reason
+            ).responder_id(
+                ocsp.OCSPResponderEncoding.HASH, self.cacert
+            ).sign(self.cakey, signing_hash(self.cakey))
+        with self._lock:
+            self.signed += 1
+        return response.public_bytes(serialization.Encoding.DER)
+
+    def refresh(self):
+        '''
+            re-sign a (SHA1 cert ID) response for every serial in the index and swap the whole cache in at once
+        '''
+        self._last_poll = _index_time(datetime.datetime.now(datetime.timezone.utc))
+        responses = {}
+        revoked = set()
+        for row in self.index.all():
+            responses[self._cert_id(row['serial'])] = self._sign(row['serial'], row, hashes.SHA1())
+            if row['status'] == 'R':
+                revoked.add(row['serial'])
+        with self._lock:
+            self._responses = responses
+            self._revoked = revoked
+        self._last_refresh = time.monotonic()
+        return len(responses)
+
+    def refresh_serial(self, serial):
+        '''
+            re-sign just the entries for one serial (after it was revoked)
+        '''
+        row = self.index.lookup_serial(serial)
+        with self._lock:
+            if row is not None and row['status'] == 'R':
+                self._revoked.add(serial)
+            algorithm_names = [cert_id[3] for cert_id in self._responses if cert_id[2] == serial] or ['sha1']
+        for algorithm_name in algorithm_names:
+            response = self._sign(serial, row, hashes.SHA1() if algorithm_name == 'sha1' else hashes.SHA256())
+            with self._lock:
+                self._responses[self._cert_id(serial, algorithm_name)] = response
+
+    def revoke(self, serial, reason='unspecified', publish_crl=True):
+        '''
+            revoke a cert (see revoke_certificate) and re-sign its OCSP response right away
+        '''
+        revoked = revoke_certificate(self.cust_name, serial, reason=reason, publish=publish_crl, cert_index=self.index)
+        self.refresh_serial(serial)
+        return revoked
+
+    def respond(self, request_der):
+        '''
+            DER OCSP response for a DER OCSP request
+        '''
+        try:
+            request = ocsp.load_der_ocsp_request(request_der)
+        except Exception:
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(ocsp.OCSPResponseStatus.MALFORMED_REQUEST).public_bytes(serialization.Encoding.DER)
+
+        algorithm_name = request.hash_algorithm.name
+        if algorithm_name not in self.issuer_hashes or \
+           (request.issuer_name_hash, request.issuer_key_hash) != self.issuer_hashes[algorithm_name]:
+            # not our CA (or a hash we don't do)
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(ocsp.OCSPResponseStatus.UNAUTHORIZED).public_bytes(serialization.Encoding.DER)
+
+        cert_id = self._cert_id(request.serial_number, algorithm_name)
+        with self._lock:
+            response = self._responses.get(cert_id)
+            if response is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if response is not None:
+            return response
+
+        row = self.index.lookup_serial(request.serial_number)
+        response = self._sign(request.serial_number, row, request.hash_algorithm)
+        if row is not None:
+            with self._lock:
+                self._responses[cert_id] = response
+        return response
+
+    def _poll_revocations(self):
+        now = _index_time(datetime.datetime.now(datetime.timezone.utc))
+        for row in self.index.revoked(since=self._last_poll):
+            with self._lock:
+                seen = row['serial'] in self._revoked
+            if not seen:
+                self.refresh_serial(row['serial'])
+        self._last_poll = now
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                if time.monotonic() - self._last_refresh >= self.refresh_hours * 3600:
+                    self.refresh()
+                else:
+                    self._poll_revocations()
+            except Exception as e:
+                print(f'OCSP refresh failed for {self.cust_name}: {e}')
+
+    def start(self):
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+        self._http_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._http_thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+        self.index.close()
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._responses)
+        return {'cached': cached, 'hits': self.hits, 'misses': self.misses, 'signed': self.signed}
+
+class _OCSPRequestHandler(BaseHTTPRequestHandler):
+    responder = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        # RFC 6960 appendix A: GET {url}/{url-encoding of base64 encoding of the DER request}
+        try:
+            request_der = base64.b64decode(urllib.parse.unquote(self.path.lstrip('/')))
+        except ValueError:
+            request_der = b''
+        self._respond(self.responder.respond(request_der))
+
+    def do_POST(self):
+        self._respond(self.responder.respond(self.rfile.read(int(self.headers.get('Content-Length', '0')))))
+
+    def _respond(self, data):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/ocsp-response')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
 
 if __name__ == "__main__":
-     # this will create a server certificate (and the CA if needed, or use the existing CA cert and key)
-    request_certificate_from_ca("somecustomer", cert_name='server')
-    # and create the .ovpn file and request the client cert from the same CA
-    make_new_ovpn_file("somecustomer", cert_name='client')
-    print("Done")
+    parser = argparse.ArgumentParser(description='OpenVPN CA / certificate / .ovpn creator')
+    subparsers = parser.add_subparsers(dest='command')
+
+    bulk_parser = subparsers.add_parser('bulk', help='issue client certs and .ovpn files for many users at once')
+    bulk_parser.add_argument('customer')
+    bulk_parser.add_argument('cert_names', nargs='*', help='cert names (users) to issue')
+    bulk_parser.add_argument('--csv', help='CSV file of cert names ("cert_name" column, or the first column)')
+    bulk_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    bulk_parser.add_argument('--key-size', type=int, default=2048, help='RSA bits, or the curve for ec (256, 384, 521)')
+    bulk_parser.add_argument('--key-algorithm', default='rsa', choices=KEY_ALGORITHMS)
+    bulk_parser.add_argument('--eku', default='client_auth', choices=list(EKU))
+
+    export_parser = subparsers.add_parser('export', help='issue client certs and put their .ovpn profiles in one .zip/.tar(.gz) archive')
+    export_parser.add_argument('customer')
+    export_parser.add_argument('archive', help='archive file to write (.zip, .tar, .tar.gz or .tgz)')
+    export_parser.add_argument('cert_names', nargs='*', help='cert names (users) to issue')
+    export_parser.add_argument('--csv', help='CSV file of profiles ("cert_name" column plus optional template variable columns)')
+    export_parser.add_argument('--remote-host', help='default ${remote_host} for the template')
+    export_parser.add_argument('--port', help='default ${port} for the template')
+    export_parser.add_argument('--proto', help='default ${proto} for the template')
+    export_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    export_parser.add_argument('--key-size', type=int, default=2048)
+    export_parser.add_argument('--key-algorithm', default='rsa', choices=KEY_ALGORITHMS)
+
+    keypool_parser = subparsers.add_parser('keypool', help='fill the pre-generated key pool for a customer')
+    keypool_parser.add_argument('customer')
+    keypool_parser.add_argument('--sizes', type=int, nargs='+', default=[2048])
+    keypool_parser.add_argument('--target', type=int, default=10, help='keys to keep per size')
+    keypool_parser.add_argument('--key-algorithm', default='rsa', choices=KEY_ALGORITHMS)
+    keypool_parser.add_argument('--watch', action='store_true', help='keep running and refill the pool as keys get taken')
+
+    index_parser = subparsers.add_parser('index', help='query or rebuild the issued certificate index for a customer')
+    index_parser.add_argument('customer')
+    index_parser.add_argument('--rebuild', action='store_true', help='rebuild the index from the certs directory')
+    index_parser.add_argument('--serial', type=lambda value: int(value, 0), help='look up a serial (prefix hex with 0x)')
+    index_parser.add_argument('--cn', help='look up the certs for a common name')
+    index_parser.add_argument('--expiring', type=int, metavar='DAYS', help='list the certs expiring in the next DAYS days')
+
+    revoke_parser = subparsers.add_parser('revoke', help='revoke a certificate and publish a new delta CRL')
+    revoke_parser.add_argument('customer')
+    revoke_parser.add_argument('serial', type=lambda value: int(value, 0))
+    revoke_parser.add_argument('--reason', default='unspecified', choices=[flag.value for flag in x509.ReasonFlags])
+    revoke_parser.add_argument('--no-publish', action='store_true', help="don't publish the CRLs right away")
+
+    crl_parser = subparsers.add_parser('crl', help='publish the full and/or delta CRL for a customer')
+    crl_parser.add_argument('customer')
+    crl_parser.add_argument('--full', action='store_true', help='force a new full CRL')
+    crl_parser.add_argument('--if-due', action='store_true', help='only publish if the current CRL is close to its next update')
+    crl_parser.add_argument('--full-every-days', type=int, default=7)
+    crl_parser.add_argument('--delta-every-hours', type=int, default=1)
+
+    expiry_parser = subparsers.add_parser('expiry', help='report (and renew) the CAs and certs expiring soon, for every customer')
+    expiry_parser.add_argument('--days', type=int, default=30, help='expiring in the next DAYS days')
+    expiry_parser.add_argument('--customers', nargs='+', help='only these customers (default: everyone under BASE_PATH)')
+    expiry_parser.add_argument('--include-expired', action='store_true', help='include certs that already expired')
+    expiry_parser.add_argument('--renew', action='store_true', help='renew what was found')
+    expiry_parser.add_argument('--dry-run', action='store_true', help='with --renew: only report what would be renewed')
+    expiry_parser.add_argument('--workers', type=int, default=4, help='scan threads / issuance processes')
+    expiry_parser.add_argument('--valid-days', type=int, default=None, help='lifetime of the renewed certs (default: same as the old cert)')
+    expiry_parser.add_argument('--revoke-old', action='store_true', help='revoke the replaced certs as superseded')
+
+    inbox_parser = subparsers.add_parser('csr-inbox', help="sign the CSRs in a customer's csr-inbox directory")
+    inbox_parser.add_argument('customer')
+    inbox_parser.add_argument('--watch', action='store_true', help='keep watching the inbox')
+    inbox_parser.add_argument('--interval', type=float, default=5, help='seconds between inbox checks with --watch')
+    inbox_parser.add_argument('--workers', type=int, default=None, help='signing processes (default: one per CPU)')
+    inbox_parser.add_argument('--batch-size', type=int, default=100)
+    inbox_parser.add_argument('--eku', nargs='+', default=['client_auth', 'server_auth'], choices=list(EKU), help='extended key usages CSRs may ask for')
+    inbox_parser.add_argument('--valid-days', type=int, default=3650 * 2)
+
+    daemon_parser = subparsers.add_parser('daemon', help='run the issuance daemon (local HTTP JSON API)')
+    daemon_parser.add_argument('--host', default='127.0.0.1')
+    daemon_parser.add_argument('--port', type=int, default=8750)
+    daemon_parser.add_argument('--workers', type=int, default=4, help='issuance worker threads')
+    daemon_parser.add_argument('--max-queue', type=int, default=1000, help='queued requests before answering 503')
+    daemon_parser.add_argument('--key-pool-target', type=int, default=0, help='keep a key pool of this many keys per customer/key type')
+
+    ocsp_parser = subparsers.add_parser('ocsp', help='run an OCSP responder for a customer')
+    ocsp_parser.add_argument('customer')
+    ocsp_parser.add_argument('--host', default='127.0.0.1')
+    ocsp_parser.add_argument('--port', type=int, default=8751)
+    ocsp_parser.add_argument('--refresh-hours', type=float, default=12, help='re-sign every response this often')
+    ocsp_parser.add_argument('--validity-hours', type=float, default=24, help='how long each response is good for')
+
+    args = parser.parse_args()
+
+    if args.command == 'bulk':
+        for result in bulk_make_new_ovpn_files(args.customer, cert_names=args.cert_names, csvfile=args.csv, max_workers=args.workers,
+                                               key_size=args.key_size, extendedKeyUsage=args.eku, key_algorithm=args.key_algorithm):
+            print(f"{'OK' if result['ok'] else 'FAILED'} {result['serial']} {result['cert_name']} {result['error'] or ''}")
+    elif args.command == 'export':
+        variables = {name: value for (name, value) in (('remote_host', args.remote_host), ('port', args.port), ('proto', args.proto)) if value}
+        for result in export_profiles_archive(args.customer, args.archive, cert_names=args.cert_names, csvfile=args.csv, variables=variables,
+                                              max_workers=args.workers, key_size=args.key_size, key_algorithm=args.key_algorithm):
+            print(f"{'OK' if result['ok'] else 'FAILED'} {result['serial']} {result['cert_name']} {result['error'] or ''}")
+    elif args.command == 'index':
+        cert_index = CertIndex(f'{BASE_PATH}\\{args.customer}\\openvpn')
+        if args.rebuild:
+            print(f'indexed {cert_index.rebuild_from_disk()} certificates')
+        rows = []
+        if args.serial is not None:
+            rows.extend(row for row in [cert_index.lookup_serial(args.serial)] if row)
+        if args.cn:
+            rows.extend(cert_index.find_by_cn(args.cn))
+        if args.expiring is not None:
+            rows.extend(cert_index.expiring(args.expiring))
+        for row in rows:
+            print(f"{row['serial']} {row['status']} {row['not_after']} {row['cn']} {row['filename']}")
+        cert_index.close()
+    elif args.command == 'revoke':
+        revoke_certificate(args.customer, args.serial, reason=args.reason, publish=not args.no_publish)
+    elif args.command == 'crl':
+        for crlfile in publish_crls(args.customer, force_full=args.full, only_if_due=args.if_due, full_every_days=args.full_every_days,
+                                    delta_every_hours=args.delta_every_hours):
+            print(f'wrote {crlfile}')
+    elif args.command == 'expiry':
+        if args.renew:
+            items = renew_expiring(days=args.days, customers=args.customers, dry_run=args.dry_run, max_workers=args.workers,
+                                   valid_days=args.valid_days, include_expired=args.include_expired, revoke_old=args.revoke_old)
+        else:
+            items = scan_expiring(days=args.days, customers=args.customers, include_expired=args.include_expired, max_workers=args.workers)
+        for item in items:
+            if item['kind'] == 'error':
+                print(f"{item['customer']}: scan failed: {item['error']}")
+                continue
+            status = ''
+            if args.renew:
+                status = 'would renew' if args.dry_run else ('renewed' if item['ok'] else f"FAILED: {item['error']}")
+            print(f"{item['customer']} {item['kind']} {item['serial']} {item['not_after']} {item['cn']} {status}")
+    elif args.command == 'csr-inbox':
+        policy = CSRPolicy(allowed_ekus=args.eku, default_eku=args.eku[0], valid_days=args.valid_days)
+        if args.watch:
+            watch_csr_inbox(args.customer, interval=args.interval, policy=policy, max_workers=args.workers, batch_size=args.batch_size)
+        else:
+            for result in process_csr_inbox(args.customer, policy=policy, max_workers=args.workers, batch_size=args.batch_size):
+                print(f"{'SIGNED' if result['ok'] else 'REJECTED'} {result['file']} {result['serial'] or ''} {result['error'] or ''}")
+    elif args.command == 'daemon':
+        issuer = IssuanceDaemon(host=args.host, port=args.port, workers=args.workers, max_queue=args.max_queue,
+                                key_pool_target=args.key_pool_target)
+        print(f'issuing certificates on http://{args.host}:{issuer.port}/issue')
+        issuer.serve_forever()
+    elif args.command == 'ocsp':
+        responder = OCSPResponder(args.customer, host=args.host, port=args.port, refresh_hours=args.refresh_hours,
+                                  validity_hours=args.validity_hours)
+        print(f'OCSP responder for {args.customer} on http://{args.host}:{responder.port}/')
+        responder.serve_forever()
+    elif args.command == 'keypool':
+        key_pool = KeyPool(args.customer, sizes=args.sizes, target=args.target, key_algorithm=args.key_algorithm)
+        key_pool.fill()
+        print(', '.join(f'{key_type(size, args.key_algorithm)}: {key_pool.count(size)} keys' for size in args.sizes))
+        if args.watch:
+            key_pool.start()
+            try:
+                while True:
+                    time.sleep(60)
+            except KeyboardInterrupt:
+                key_pool.stop()
+    else:
+        # this will create a server certificate (and the CA if needed, or use the existing CA cert and key)
+        request_certificate_from_ca("somecustomer", cert_name='server')
+        # and create the .ovpn file and request the client cert from the same CA
+        make_new_ovpn_file("somecustomer", cert_name='client')
+        print("Done")
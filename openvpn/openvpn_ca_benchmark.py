@@ -0,0 +1,210 @@
+'''
+    Benchmark the CA operations in openvpn_ca-creator.py across key types/sizes and worker counts
+
+    For every key type (rsa-2048, rsa-3072, rsa-4096, ec-256, ec-384, ed25519, ...) and every worker count it measures:
+        make_key                      generate a key
+        make_csr                      build and sign a CSR with an existing key
+        create_certificate_from_csr   sign a cert with the CA (a CA of the same key type)
+        dump_file_in_mem              PEM dump of a cert and its key
+        make_new_ovpn_file            the whole thing: key, csr, serial, cert, cert index and the .ovpn file on disk
+
+    Each worker is its own process (the crypto is CPU bound, threads would just fight over the GIL), and every worker runs the operation
+        for --seconds.  ops/sec is the total across the workers, the latency percentiles are per operation.
+
+    Everything runs against a temporary BASE_PATH that's removed afterwards, so none of your customers get touched.
+        openvpn_ca-creator.py builds its paths with \\ (Windows), so on other systems its "directories" end up as files with
+        backslashes in their names -- BASE_PATH is inside the temporary directory, so those get removed along with it either way.
+
+    --script works with any openvpn_ca-creator.py from the original (RSA only) version on, as long as it imports with the installed
+        cryptography.  Scripts from before EC/Ed25519 support (no key_algorithm argument) can only run the rsa-<bits> key types,
+        and their CA is always rsa-2048 (get_or_create_ca had no key_size then).
+
+    examples:
+        python openvpn_ca_benchmark.py
+        python openvpn_ca_benchmark.py --key-types rsa-2048 rsa-3072 rsa-4096 ec-256 --workers 1 2 4 8 --seconds 5
+        python openvpn_ca_benchmark.py --json > before.json
+        python openvpn_ca_benchmark.py --script C:\\old-checkout\\openvpn\\openvpn_ca-creator.py --json > old.json
+'''
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import inspect
+import tempfile
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+OPERATIONS = ('make_key', 'make_csr', 'create_certificate_from_csr', 'dump_file_in_mem', 'make_new_ovpn_file')
+
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openvpn_ca-creator.py')
+
+def load_ca_module(script, base_path):
+    '''
+        import openvpn_ca-creator.py (the hyphen means a plain import won't do it) and point it at base_path
+    '''
+    spec = importlib.util.spec_from_file_location('openvpn_ca_creator', script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.BASE_PATH = base_path
+    return module
+
+def supported(function, **kwargs):
+    '''
+        the kwargs function takes (older openvpn_ca-creator.py versions don't have key_algorithm, or key_size on get_or_create_ca)
+    '''
+    parameters = inspect.signature(function).parameters
+    return {name: value for (name, value) in kwargs.items() if name in parameters}
+
+def ca_path(base_path, *parts):
+    #joined the way openvpn_ca-creator.py does it, so the benchmark and the script agree on where things are
+    return '\\'.join((base_path,) + parts)
+
+def parse_key_type(key_type):
+    '''
+        rsa-2048 -> (2048, 'rsa'), ec-256 -> (256, 'ec'), ed25519 -> (2048, 'ed25519')
+    '''
+    (algorithm, _, size) = key_type.partition('-')
+    return (int(size) if size else 2048, algorithm)
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+# per worker process: the loaded module and the key/csr/CA/cert to work with, set up once by _init_worker
+_worker = {}
+
+def _init_worker(script, base_path, cust_name, key_type):
+    ca = load_ca_module(script, base_path)
+    (key_size, key_algorithm) = parse_key_type(key_type)
+    base_dir = ca_path(base_path, cust_name, 'openvpn')
+
+    _worker['ca'] = ca
+    _worker['cust_name'] = cust_name
+    _worker['key_args'] = supported(ca.make_key, key_size=key_size, key_algorithm=key_algorithm)
+    _worker['ovpn_args'] = supported(ca.make_new_ovpn_file, key_size=key_size, key_algorithm=key_algorithm)
+    _worker['key'] = ca.make_key(**_worker['key_args'])
+    _worker['csr'] = ca.make_csr(_worker['key'], 'benchmark', extendedKeyUsage='client_auth')
+    _worker['cacert'] = ca.retrieve_cert_from_file(ca_path(base_dir, 'ca.crt'))
+    _worker['cakey'] = ca.retrieve_key_from_file(ca_path(base_dir, 'ca.key'))
+    _worker['cert'] = ca.create_certificate_from_csr(_worker['csr'], _worker['cakey'], 2, _worker['cacert'])
+
+def _operation(name):
+    ca = _worker['ca']
+    if name == 'make_key':
+        return lambda: ca.make_key(**_worker['key_args'])
+    if name == 'make_csr':
+        return lambda: ca.make_csr(_worker['key'], 'benchmark', extendedKeyUsage='client_auth')
+    if name == 'create_certificate_from_csr':
+        return lambda: ca.create_certificate_from_csr(_worker['csr'], _worker['cakey'], 2, _worker['cacert'])
+    if name == 'dump_file_in_mem':
+        return lambda: (ca.dump_file_in_mem(_worker['cert']), ca.dump_file_in_mem(_worker['key']))
+    if name == 'make_new_ovpn_file':
+        return lambda: ca.make_new_ovpn_file(_worker['cust_name'], f'bench-{uuid.uuid4().hex[:12]}', **_worker['ovpn_args'])
+    raise ValueError(f'unknown operation: {name}')
+
+def _ready(delay):
+    # makes sure every worker process is started (and set up) before anything gets timed
+    time.sleep(delay)
+    return os.getpid()
+
+def _run(name, seconds):
+    '''
+        runs in a worker: the operation over and over for seconds (at least once), returns the latency of each call
+    '''
+    operation = _operation(name)
+    latencies = []
+    # make_new_ovpn_file prints a line per cert
+    with contextlib.redirect_stdout(io.StringIO()):
+        deadline = time.perf_counter() + seconds
+        while not latencies or time.perf_counter() < deadline:
+            start = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run(key_types, workers=(1, 2, 4), operations=OPERATIONS, seconds=2.0, script=DEFAULT_SCRIPT):
+    '''
+        returns a list of dicts: key_type, operation, workers, ops, ops_per_sec, mean_ms, p50_ms, p90_ms, p99_ms, max_ms
+    '''
+    temp_dir = tempfile.mkdtemp(prefix='openvpn-ca-bench-')
+    # everything the script writes ends up under temp_dir, whatever it does with the \\ in its paths
+    base_path = os.path.join(temp_dir, 'customers')
+    results = []
+    try:
+        ca = load_ca_module(script, base_path)
+        if 'key_algorithm' not in inspect.signature(ca.make_key).parameters:
+            unsupported = [key_type for key_type in key_types if parse_key_type(key_type)[1] != 'rsa']
+            if unsupported:
+                raise ValueError(f"{script} only makes RSA keys, it can't benchmark {', '.join(unsupported)}")
+        if 'key_size' not in inspect.signature(ca.get_or_create_ca).parameters:
+            print(f'{script} always makes an rsa-2048 CA, the signing numbers are for an rsa-2048 CA', file=sys.stderr)
+
+        for key_type in key_types:
+            (key_size, key_algorithm) = parse_key_type(key_type)
+            cust_name = f'bench-{key_type}'
+            base_dir = ca_path(base_path, cust_name, 'openvpn')
+            os.makedirs(base_dir)
+            # the CA has the same key type as the certs, so the signing numbers are for that key type too
+            with contextlib.redirect_stdout(io.StringIO()):
+                ca.get_or_create_ca(ca_path(base_dir, 'ca.crt'), ca_path(base_dir, 'ca.key'), base_dir, cust_name,
+                                    **supported(ca.get_or_create_ca, key_size=key_size, key_algorithm=key_algorithm))
+
+            for worker_count in workers:
+                initargs = (script, base_path, cust_name, key_type)
+                with ProcessPoolExecutor(max_workers=worker_count, initializer=_init_worker, initargs=initargs) as executor:
+                    list(executor.map(_ready, [0.2] * worker_count))
+                    for name in operations:
+                        start = time.perf_counter()
+                        futures = [executor.submit(_run, name, seconds) for _ in range(worker_count)]
+                        latencies = [latency for future in futures for latency in future.result()]
+                        elapsed = time.perf_counter() - start
+
+                        results.append({
+                            'key_type': key_type,
+                            'operation': name,
+                            'workers': worker_count,
+                            'ops': len(latencies),
+                            'ops_per_sec': round(len(latencies) / elapsed, 2),
+                            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+                            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                            'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+                            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                            'max_ms': round(max(latencies) * 1000, 3),
+                        })
+                        print(f"{key_type} {name} x{worker_count}: {results[-1]['ops_per_sec']} ops/sec", file=sys.stderr)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return results
+
+def print_table(results):
+    print(f"{'key type':<10} {'operation':<28} {'workers':>7} {'ops':>7} {'ops/sec':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for result in results:
+        print(f"{result['key_type']:<10} {result['operation']:<28} {result['workers']:>7} {result['ops']:>7} {result['ops_per_sec']:>10.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p90_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['max_ms']:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark the openvpn_ca-creator.py CA operations')
+    parser.add_argument('--key-types', nargs='+', default=['rsa-2048', 'rsa-3072', 'ec-256', 'ed25519'],
+                        help='rsa-<bits>, ec-<curve bits> (256, 384, 521) or ed25519')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker process counts to measure')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), choices=OPERATIONS)
+    parser.add_argument('--seconds', type=float, default=2.0, help='seconds each worker runs each operation')
+    parser.add_argument('--script', default=DEFAULT_SCRIPT, help='the openvpn_ca-creator.py to benchmark (ie: from another checkout)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON (for comparing runs)')
+    args = parser.parse_args()
+
+    try:
+        results = run(args.key_types, workers=args.workers, operations=args.operations, seconds=args.seconds, script=args.script)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
@@ -42,14 +42,344 @@
 
 
 '''
+import re
+import csv
+import copy
+import sys
+import time
+import weakref
+import queue
+import atexit
+import asyncio
+import itertools
 import pprint
+import threading
+import contextlib
+import datetime
+import collections
+from decimal import Decimal
+from concurrent.futures import Future
 import pypyodbc
 
+try:
+    import numpy as np
+except ImportError:
+    #only needed for query_sql_columnar
+    np = None
+
 
 QUERY_TIMEOUT = 10
 CONNECTION_TIMEOUT = 5
 SERVER = 'sqlservername,1433'
 
+#connection pool defaults (see ConnectionPool)
+POOL_MIN_SIZE = 0
+POOL_MAX_SIZE = 10
+POOL_IDLE_TIMEOUT = 300     #seconds an idle connection is kept (beyond min_size)
+POOL_ACQUIRE_TIMEOUT = 30   #seconds to wait for a free connection when the pool is at max_size
+POOL_PING_AFTER = 30        #seconds idle before a connection gets pinged on checkout (0 = ping every time)
+STATEMENT_CACHE_SIZE = 32   #prepared statements (cursors) kept per pooled connection (0 = no cache)
+QUERY_WORKERS = 8           #threads (and connections) per QueryExecutor
+
+#result cache defaults (see ResultCache)
+RESULT_CACHE_TTL = 30                       #seconds a cached result is good for
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024   #estimated (sys.getsizeof) size of all the cached results
+
+FETCH_BATCH_SIZE = 1000     #rows per fetchmany in iter_query_sql
+ROW_TYPES = ('tuple', 'namedtuple', 'dict')
+
+#bulk_load
+SQL_SERVER_MAX_PARAMS = 2100        #parameters SQL Server takes per statement
+SQL_SERVER_MAX_VALUES_ROWS = 1000   #rows SQL Server takes in one VALUES (...), (...) list
+BULK_BATCH_SIZE = 10000             #rows per transaction
+DAILY_CLOSE_COLUMNS = ('ticker', 'close_date', 'close')
+DAILY_CLOSE_KEY = ('ticker', 'close_date')
+
+
+def _close_quietly(obj):
+    #connection or cursor that may already be closed/broken
+    try:
+        obj.close()
+    except Exception:
+        pass
+
+
+class StatementCache(object):
+    '''
+        LRU of cursors for one connection, keyed by SQL text
+
+        pypyodbc's cursor.execute only prepares (SQLPrepare + SQLDescribeParam for every parameter) when the SQL is different from the
+            last SQL that cursor ran, and only re-binds the parameter buffers when the parameter types change.  So running the same
+            query on the same cursor again skips the prepare and the parameter type work, it just fills in the values and executes
+    '''
+    def __init__(self, conn, size=STATEMENT_CACHE_SIZE):
+        self.conn = conn
+        self.size = size
+        self._cursors = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cursor(self, sql):
+        '''
+            the cached cursor for sql (or a new one), hand it back with release()
+        '''
+        cursor = self._cursors.pop(sql, None)
+        if cursor is not None:
+            self.hits += 1
+            return cursor
+        self.misses += 1
+        return self.conn.cursor()
+
+    def release(self, sql, cursor, reusable=True):
+        '''
+            put the cursor back as the most recently used, or close it if it can't be reused (ie: its result set wasn't read to the end)
+        '''
+        if not reusable or self.size <= 0:
+            _close_quietly(cursor)
+            return
+        self._cursors[sql] = cursor
+        while len(self._cursors) > self.size:
+            (old_sql, old) = self._cursors.popitem(last=False)
+            self.evictions += 1
+            _close_quietly(old)
+
+    def close(self):
+        for cursor in self._cursors.values():
+            _close_quietly(cursor)
+        self._cursors.clear()
+
+    def stats(self):
+        return {'statements': len(self._cursors), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class ConnectionPool(object):
+    '''
+        Thread safe pool of pypyodbc connections for one connection string
+
+        Logging in (especially with Trusted_Connection) costs a lot more than a small query, so connections are kept and reused:
+            min_size connections are opened up front and never evicted, up to max_size can be open at once
+                (acquire() waits up to acquire_timeout for one to come back after that)
+            connections idle for more than idle_timeout get closed (down to min_size)
+            a connection that sat idle for ping_after seconds gets a "SELECT 1" before it's handed out, if that fails it's
+                thrown away and a new one is opened (so a dropped connection or a restarted server doesn't fail the query)
+            on release the connection is rolled back (so nothing the last borrower left open leaks to the next one) and reset_query
+                runs if you give it one (ie: to drop temp tables or put SET options back)
+            every connection keeps up to statement_cache_size prepared statements (see StatementCache and statement())
+    '''
+    def __init__(self, conn_string, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 acquire_timeout=POOL_ACQUIRE_TIMEOUT, ping_after=POOL_PING_AFTER, conn_timeout=CONNECTION_TIMEOUT, reset_query=None,
+                 statement_cache_size=STATEMENT_CACHE_SIZE):
+        self.conn_string = conn_string
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+        self.conn_timeout = conn_timeout
+        self.reset_query = reset_query
+        self.statement_cache_size = statement_cache_size
+
+        #(connection, time it was returned), most recently returned at the end
+        self._idle = collections.deque()
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+        #connection -> StatementCache, and the counters of the caches of connections that have been closed since
+        self._statements = {}
+        self._closed_statement_stats = collections.Counter()
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        pypyodbc.connection_timeout = self.conn_timeout #connect timeout
+        conn = pypyodbc.connect(self.conn_string)
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def _close_connection(self, conn):
+        with self._cond:
+            statements = self._statements.pop(conn, None)
+            if statements:
+                self._closed_statement_stats.update(statements.stats())
+        if statements:
+            statements.close()
+        if conn.connected:
+            _close_quietly(conn)
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self):
+        '''
+            take the connections that have been idle too long out of the pool (call with the lock held, close them without it)
+        '''
+        evicted = []
+        now = time.monotonic()
+        #oldest first, and never below min_size
+        while self._idle and len(self._idle) + self._checked_out > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            evicted.append(self._idle.popleft()[0])
+        return evicted
+
+    def acquire(self):
+        '''
+            borrow a connection (give it back with release(), or use the connection() context manager)
+        '''
+        deadline = time.monotonic() + self.acquire_timeout
+        conn = None
+        with self._cond:
+            evicted = self._evict_idle()
+            while True:
+                if self._idle:
+                    (conn, last_used) = self._idle.pop()
+                    self._checked_out += 1
+                    break
+                if self._checked_out < self.max_size:
+                    #room for a new one, it gets opened below (outside the lock)
+                    self._checked_out += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'timed out waiting for a connection ({self.max_size} in use)')
+                self._cond.wait(remaining)
+
+        for old in evicted:
+            self._close_connection(old)
+
+        if conn is not None:
+            if time.monotonic() - last_used >= self.ping_after and not self._ping(conn):
+                self._close_connection(conn)
+                with self._cond:
+                    self.discarded += 1
+                conn = None
+            else:
+                with self._cond:
+                    self.reused += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._checked_out -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, discard=False):
+        '''
+            give a connection back (discard=True closes it instead, ie: when you know it's broken)
+        '''
+        if not discard:
+            try:
+                #reset the session state: roll back whatever the borrower left open
+                conn.rollback()
+                if self.reset_query:
+                    cursor = conn.cursor()
+                    cursor.execute(self.reset_query)
+                    cursor.commit()
+                    cursor.close()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._checked_out -= 1
+            if discard or not conn.connected:
+                self.discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close_connection(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextlib.contextmanager
+    def statement(self, conn, sql):
+        '''
+            a cursor for sql from conn's statement cache (conn has to be checked out to you)
+                it goes back in the cache when the block is done, if the block raises (or a generator using it gets closed early)
+                it's closed instead, so a half read result set never gets reused
+        '''
+        with self._cond:
+            statements = self._statements.get(conn)
+            if statements is None:
+                statements = self._statements[conn] = StatementCache(conn, self.statement_cache_size)
+        cursor = statements.cursor(sql)
+        try:
+            yield cursor
+        except BaseException:
+            statements.release(sql, cursor, reusable=False)
+            raise
+        statements.release(sql, cursor)
+
+    def close_all(self):
+        '''
+            close the idle connections (the checked out ones get closed when they come back)
+        '''
+        with self._cond:
+            idle = [conn for (conn, last_used) in self._idle]
+            self._idle.clear()
+            self.min_size = 0
+            self.idle_timeout = -1
+        for conn in idle:
+            self._close_connection(conn)
+
+    def stats(self):
+        with self._cond:
+            statements = collections.Counter(self._closed_statement_stats)
+            for cache in self._statements.values():
+                statements.update(cache.stats())
+            del statements['statements']
+            lookups = statements['hits'] + statements['misses']
+            return {'idle': len(self._idle), 'in_use': self._checked_out, 'created': self.created, 'reused': self.reused,
+                    'discarded': self.discarded, 'statement_hits': statements['hits'], 'statement_misses': statements['misses'],
+                    'statement_evictions': statements['evictions'],
+                    'statement_hit_rate': round(statements['hits'] / lookups, 4) if lookups else 0.0}
+
+
+#one pool per connection string
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(conn_string, **pool_options):
+    '''
+        the shared pool for a connection string (pool_options only matter the first time, when the pool gets created)
+    '''
+    with _POOLS_LOCK:
+        if conn_string not in _POOLS:
+            _POOLS[conn_string] = ConnectionPool(conn_string, **pool_options)
+        return _POOLS[conn_string]
+
+def close_pools():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close_all()
+
+atexit.register(close_pools)
+
 def run(server=None, database=None, user_and_pw=None, query=None, query_params=None):
     '''
         run sample query against database
@@ -72,15 +402,38 @@ def run(server=None, database=None, user_and_pw=None, query=None, query_params=N
         print(query, '0 results')
 
 def query_sql(conn_string=None, query=None, query_params=None,
-              query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT):
+              query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT, pool=None, cache=None, cache_tags=None):
     '''
         Call MS SQL - Tested with MS SQL 2014, and Trusted Connections
+
+        The connection is borrowed from the shared pool for conn_string (or from pool if you pass one)
+
+        cache=True (RESULT_CACHE) or cache=a ResultCache caches the results of reads, tagged with the tables in the query (or cache_tags)
+            writes always drop the cached results for the tables they touch, cache or not (see ResultCache)
     '''
+    pool = pool or get_pool(conn_string, conn_timeout=conn_timeout)
+    if cache is True:
+        cache = RESULT_CACHE
+    write = is_write_query(query)
+
+    if cache and not write:
+        key = (pool.conn_string, query, tuple(query_params or ()))
+        (found, query_results) = cache.get(key)
+        if found:
+            return query_results
+        tags = set(cache_tags or ()) | query_tables(query)
+        snapshot = cache.snapshot(pool.conn_string, tags)
 
-    pypyodbc.connection_timeout = conn_timeout #connect timeout
+    with pool.connection() as conn, pool.statement(conn, query) as cursor:
+        query_results = _query_sql(cursor, query, query_params, query_timeout)
 
-    conn = pypyodbc.connect(conn_string)
-    cursor = conn.cursor()
+    if write:
+        invalidate_tables(pool.conn_string, query, cache_tags)
+    elif cache:
+        cache.put(key, query_results, tags, snapshot)
+    return query_results
+
+def _query_sql(cursor, query, query_params, query_timeout):
     cursor.set_timeout(query_timeout)  #query timeout
 
     #cursor.autocommit = True  #dont make me run a commit after exery execute - doesnt work
@@ -94,21 +447,655 @@ def query_sql(conn_string=None, query=None, query_params=None,
         #some queries return no results, .description will be empty if this is the case
         # we are not talking about select * from this where that = 0 and nothing matches
         #  instead, "exec spDoSomething" updates some data, deletes some other data and returns
-        query_results = [dict(zip([column[0] for column in cursor.description], row)) \
-            for row in cursor.fetchall()]
+        columns = column_names(cursor)
+        query_results = [dict(zip(columns, row)) for row in cursor.fetchall()]
         #from a performance standpoint, fetchall might not be the most ideal solution
         #  in every case, however, for testing purposes, we'll let it slide
+        #  (for big result sets use iter_query_sql)
     else:
         query_results = []
     
     cursor.commit()
 
-    cursor.close()
+    return query_results
 
-    if conn.connected:
-        conn.close()
+#anything that can change data, when it's run through the helpers the cached results for the tables it names get dropped
+WRITE_STATEMENT = re.compile(r'\b(insert|update|delete|merge|truncate|drop|alter|create|exec|execute)\b', re.IGNORECASE)
+TABLE_NAME = re.compile(r'\b(?:from|join|into|update|merge|table|apply)\s+([\w.\[\]#]+)', re.IGNORECASE)
 
-    return query_results
+def is_write_query(query):
+    return bool(WRITE_STATEMENT.search(query))
+
+def table_tag(name):
+    #[dbo].[Daily_Close_Prices] -> daily_close_prices
+    return name.replace('[', '').replace(']', '').split('.')[-1].lower()
+
+def query_tables(query):
+    '''
+        the tables a query names, as table_tag()s
+    '''
+    return {table_tag(name) for name in TABLE_NAME.findall(query)} - {''}
+
+def _result_size(rows):
+    #rough size of a query_sql result, the column name strings are shared between the rows so they aren't counted
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values()) for row in rows)
+
+
+#column values that are safe to share between the cache and the caller, anything else (ie: the bytearrays pypyodbc returns
+#  for binary columns) gets copied
+IMMUTABLE_VALUES = (type(None), str, bytes, int, float, bool, Decimal, datetime.datetime, datetime.date, datetime.time)
+
+#every ResultCache, so writes can invalidate all of them
+_RESULT_CACHES = weakref.WeakSet()
+
+
+class ResultCache(object):
+    '''
+        Read through cache of query_sql results, keyed by (connection string, SQL, parameters)
+
+            results are good for ttl seconds, the least recently used ones go once there are more than max_entries
+                or they add up to more than max_bytes (estimated)
+            every result is tagged with the tables it read (query_tables, or cache_tags if you pass them to query_sql)
+            a write through the helpers (query_sql/iter_query_sql/query_sql_columnar/QueryExecutor with insert/update/delete/merge/...,
+                bulk_load) drops the results tagged with the tables it names, writes that don't name tables (ie: exec spDoSomething)
+                drop everything for that connection string
+                (writes made some other way aren't seen, the ttl is the limit on how stale those can get)
+            a result that was being read while one of its tables got written isn't stored
+            results are copied going in and coming out (mutable column values too), so changing what you get back doesn't change the cache
+    '''
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        #key -> (rows, expires, tags, size), least recently used first
+        self._entries = collections.OrderedDict()
+        #(target, table) -> keys tagged with it
+        self._tagged = collections.defaultdict(set)
+        #bumped by every invalidation of (target, table), (target, None) is bumped when everything for target goes
+        self._generations = collections.Counter()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stores = 0
+
+        _RESULT_CACHES.add(self)
+
+    @staticmethod
+    def _copy(rows):
+        return [{column: value if isinstance(value, IMMUTABLE_VALUES) else copy.deepcopy(value) for (column, value) in row.items()}
+                for row in rows]
+
+    def _remove(self, key):
+        (rows, expires, tags, size) = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._tagged.get((key[0], tag))
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[(key[0], tag)]
+
+    def get(self, key):
+        '''
+            returns (found, a copy of the rows)
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return (False, None)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            rows = entry[0]
+        return (True, self._copy(rows))
+
+    def snapshot(self, target, tags):
+        '''
+            take this before running the query, put() only stores the result if none of its tables got written since
+        '''
+        with self._lock:
+            return tuple(self._generations[(target, tag)] for tag in (None,) + tuple(tags))
+
+    def put(self, key, rows, tags, snapshot):
+        tags = tuple(tags)
+        rows = self._copy(rows)
+        size = _result_size(rows)
+        with self._lock:
+            if snapshot != tuple(self._generations[(key[0], tag)] for tag in (None,) + tags):
+                return False
+            if size > self.max_bytes:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (rows, time.monotonic() + self.ttl, tags, size)
+            self.bytes += size
+            for tag in tags:
+                self._tagged[(key[0], tag)].add(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def invalidate(self, target, tags=None):
+        '''
+            drop the results for target tagged with any of tags (tags=None drops all of target's results)
+        '''
+        with self._lock:
+            if tags is None:
+                self._generations[(target, None)] += 1
+                keys = [key for key in self._entries if key[0] == target]
+            else:
+                keys = set()
+                for tag in tags:
+                    self._generations[(target, tag)] += 1
+                    keys.update(self._tagged.get((target, tag), ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            for target in {key[0] for key in self._entries}:
+                self._generations[(target, None)] += 1
+            self._entries.clear()
+            self._tagged.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0, 'expired': self.expired,
+                    'evictions': self.evictions, 'invalidations': self.invalidations, 'stores': self.stores}
+
+
+#the cache query_sql uses with cache=True
+RESULT_CACHE = ResultCache()
+
+def invalidate_tables(target, query=None, tags=None):
+    '''
+        a write went to target: drop the cached results for the tables in query (and tags) from every ResultCache
+    '''
+    tables = set(tags or ())
+    if query:
+        tables.update(query_tables(query))
+    for cache in list(_RESULT_CACHES):
+        cache.invalidate(target, tables or None)
+
+def cancel_statement(cursor):
+    '''
+        ask the server to stop the statement running on cursor (ODBC SQLCancel is meant to be called from another thread)
+            the execute/fetch running on the cursor then fails with an "operation canceled" error
+    '''
+    try:
+        return pypyodbc.ODBC_API.SQLCancel(cursor.stmt_h) == 0
+    except Exception:
+        return False
+
+
+class QueryFuture(Future):
+    '''
+        concurrent.futures.Future for a QueryExecutor query
+            cancel() works like it does for any Future while the query is waiting for a worker, once it's running
+            it also cancels the statement on the server (the future then finishes with the driver's error instead of CancelledError)
+    '''
+    _cursor = None
+
+    def cancel(self):
+        if super().cancel():
+            return True
+        cursor = self._cursor
+        if cursor is not None and self.running():
+            cancel_statement(cursor)
+        return False
+
+
+class QueryExecutor(object):
+    '''
+        Runs query_sql style queries on a bounded pool of worker threads, every worker keeps its own connection for as long as it lives
+            pypyodbc blocks while it waits on the server, but it lets go of the GIL in the ODBC calls, so the workers' round trips overlap
+
+        futures:
+            with QueryExecutor(dsn, workers=8) as db:
+                futures = {ticker: db.submit('select top 1 close from daily_close_prices where ticker = ? order by close_date desc', [ticker])
+                           for ticker in tickers}
+                closes = {ticker: future.result() for (ticker, future) in futures.items()}
+
+        asyncio:
+            async with QueryExecutor(dsn) as db:
+                rows = await db.query('select top 1 ticker from daily_close_prices where ticker = ?', ['INTC'])
+                everything = await db.gather('select ... where ticker = ?', [[ticker] for ticker in tickers])
+
+        query_timeout (QUERY_TIMEOUT unless you say otherwise, per executor or per query) is set on the statement, so the server stops the query
+        cancelling a future (or the asyncio task awaiting it) drops a queued query, or cancels a running one on the server (see QueryFuture)
+
+        the workers get their connections from pool (its max_size needs to be at least workers), or from a pool of their own
+    '''
+    def __init__(self, conn_string=None, workers=QUERY_WORKERS, query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT, pool=None):
+        self.query_timeout = query_timeout
+        self._own_pool = pool is None
+        self.pool = pool or ConnectionPool(conn_string, max_size=workers, conn_timeout=conn_timeout)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+        self._workers = [threading.Thread(target=self._worker, name=f'query-worker-{i}', daemon=True) for i in range(workers)]
+        self._running = len(self._workers)
+        for worker in self._workers:
+            worker.start()
+
+    def _worker(self):
+        conn = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            (future, query, query_params, query_timeout) = item
+            if not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self.cancelled += 1
+                continue
+
+            try:
+                if conn is None:
+                    #the connection is opened by the first query, so a login failure goes to that query's future
+                    conn = self.pool.acquire()
+                with self.pool.statement(conn, query) as cursor:
+                    future._cursor = cursor
+                    try:
+                        result = _query_sql(cursor, query, query_params, query_timeout)
+                    finally:
+                        future._cursor = None
+                if is_write_query(query):
+                    invalidate_tables(self.pool.conn_string, query)
+            except BaseException as e:
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        #the connection is gone, the next query gets a new one
+                        self.pool.release(conn, discard=True)
+                        conn = None
+                with self._lock:
+                    self.failed += 1
+                future.set_exception(e)
+            else:
+                with self._lock:
+                    self.completed += 1
+                future.set_result(result)
+
+        if conn is not None:
+            self.pool.release(conn)
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        #the last worker out closes the executor's own pool, so it gets closed with shutdown(wait=False) too
+        if last and self._own_pool:
+            self.pool.close_all()
+
+    def submit(self, query, query_params=None, query_timeout=None):
+        '''
+            queue a query, returns a QueryFuture of the query_sql result (a list of dicts)
+        '''
+        future = QueryFuture()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit a query after shutdown')
+            self.submitted += 1
+            self._queue.put((future, query, query_params, self.query_timeout if query_timeout is None else query_timeout))
+        return future
+
+    def map(self, query, params_list, query_timeout=None):
+        '''
+            the same query for every set of parameters, results come back in params_list order
+            everything is queued right away (like Executor.map), the results are a generator you can start on whenever
+        '''
+        futures = [self.submit(query, query_params, query_timeout) for query_params in params_list]
+
+        def results():
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                #the caller stopped early (or a query failed), don't leave the rest running
+                for future in futures:
+                    future.cancel()
+        return results()
+
+    async def query(self, query, query_params=None, query_timeout=None):
+        '''
+            await db.query(...) - cancelling the awaiting task cancels the query
+        '''
+        return await asyncio.wrap_future(self.submit(query, query_params, query_timeout))
+
+    async def gather(self, query, params_list, query_timeout=None):
+        return await asyncio.gather(*[self.query(query, query_params, query_timeout) for query_params in params_list])
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        '''
+            stop taking queries, cancel_futures=True drops the ones that haven't started yet
+            the workers give their connections back once they're done, and the last one closes the executor's own pool
+            wait=False returns right away, that still happens in the background once the queued queries are done
+        '''
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and item[0].cancel():
+                    with self._lock:
+                        self.cancelled += 1
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def stats(self):
+        with self._lock:
+            return {'workers': len(self._workers), 'queued': self._queue.qsize(), 'submitted': self.submitted,
+                    'completed': self.completed, 'failed': self.failed, 'cancelled': self.cancelled}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+
+def column_names(cursor):
+    return [column[0] for column in cursor.description]
+
+def row_factory(columns, row_type='tuple'):
+    '''
+        returns a function that turns a row from the cursor into a row_type
+            tuple       plain tuple (smallest, no column names)
+            namedtuple  tuple with the column names as attributes (same size as a tuple, the names live on the class)
+            dict        {column: value} like query_sql returns (a dict per row costs several times the data it holds)
+    '''
+    if row_type == 'tuple':
+        return tuple
+    if row_type == 'namedtuple':
+        #rename=True turns column names that aren't identifiers (ie: count(*) or duplicates) into _0, _1, ...
+        return collections.namedtuple('Row', columns, rename=True)._make
+    if row_type == 'dict':
+        return lambda row: dict(zip(columns, row))
+    raise ValueError(f'row_type must be one of {ROW_TYPES}, not {row_type!r}')
+
+def iter_query_sql(conn_string=None, query=None, query_params=None, row_type='tuple', batch_size=FETCH_BATCH_SIZE,
+                   query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT, pool=None):
+    '''
+        Streaming query_sql: yields the rows one at a time, fetching batch_size rows at a time with fetchmany
+            so only one batch sits in memory, no matter how big the result set is
+
+        The column header is read once and every row is made with row_factory (row_type: tuple, namedtuple or dict)
+
+        The connection goes back to the pool as soon as you stop consuming: the rows run out, you break out of the loop
+            (the generator gets closed when it's garbage collected) or you call .close() on it
+            use contextlib.closing() if you want that to happen at a set point:
+
+            with contextlib.closing(iter_query_sql(dsn, 'select * from daily_close_prices')) as rows:
+                for row in rows:
+                    ...
+    '''
+    pool = pool or get_pool(conn_string, conn_timeout=conn_timeout)
+    #stopping early closes the generator (GeneratorExit at the yield), which gets the cursor thrown away and the connection released
+    with pool.connection() as conn, pool.statement(conn, query) as cursor:
+        cursor.set_timeout(query_timeout)  #query timeout
+
+        if not query_params:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, query_params)
+
+        if cursor.description:
+            make_row = row_factory(column_names(cursor), row_type)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield make_row(row)
+
+        cursor.commit()
+        #stopping early never gets here, the connection gets rolled back when it goes back to the pool so there's nothing to invalidate
+        if is_write_query(query):
+            invalidate_tables(pool.conn_string, query)
+
+def column_dtype(column, decimals='float', strings='object'):
+    '''
+        numpy dtype for a cursor.description column (pypyodbc puts the python type in column[1] and the column size in column[3])
+            numeric/decimal  float64 (decimals='float') or object holding the Decimals (decimals='decimal', no rounding)
+            int/bigint       int64 (float64 if the column has NULLs, they become nan)
+            float/real       float64
+            datetime         datetime64[us], date datetime64[D] (NULL -> NaT)
+            varchar          object (strings='object') or fixed width unicode of the column size (strings='fixed', NULL -> '')
+            anything else    object
+    '''
+    (type_code, size) = (column[1], column[3])
+    if type_code is Decimal:
+        return np.dtype('float64') if decimals == 'float' else np.dtype(object)
+    if type_code is float:
+        return np.dtype('float64')
+    if type_code is bool:
+        return np.dtype(bool)
+    if isinstance(type_code, type) and issubclass(type_code, int):
+        return np.dtype('int64')
+    if type_code is datetime.datetime:
+        return np.dtype('datetime64[us]')
+    if type_code is datetime.date:
+        return np.dtype('datetime64[D]')
+    if type_code is str and strings == 'fixed' and size:
+        return np.dtype(f'U{size}')
+    return np.dtype(object)
+
+def query_sql_columnar(conn_string=None, query=None, query_params=None, output='dict', decimals='float', strings='object',
+                       batch_size=FETCH_BATCH_SIZE, query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT, pool=None):
+    '''
+        query_sql for analytics: fills one typed numpy array per column straight from fetchmany batches
+            (no dict per row, and no list of python objects for the numeric/datetime columns)
+
+        output='dict' returns {column: array}, output='recarray' returns a numpy record array
+        see column_dtype for the decimals/strings options and how the SQL types map to numpy dtypes
+
+        queries that don't return a result set return None
+
+        ie: prices = query_sql_columnar(dsn, 'select close_date, close from daily_close_prices where ticker = ? order by close_date', ['INTC'])
+            prices['close'].mean()
+    '''
+    if np is None:
+        raise ImportError('query_sql_columnar needs numpy (pip install numpy)')
+    if output not in ('dict', 'recarray'):
+        raise ValueError(f"output must be 'dict' or 'recarray', not {output!r}")
+
+    pool = pool or get_pool(conn_string, conn_timeout=conn_timeout)
+    with pool.connection() as conn, pool.statement(conn, query) as cursor:
+        cursor.set_timeout(query_timeout)  #query timeout
+
+        if not query_params:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, query_params)
+
+        if not cursor.description:
+            cursor.commit()
+            if is_write_query(query):
+                invalidate_tables(pool.conn_string, query)
+            return None
+
+        columns = column_names(cursor)
+        buffers = [np.empty(batch_size, dtype=column_dtype(column, decimals, strings)) for column in cursor.description]
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            end = count + len(rows)
+            if end > len(buffers[0]):
+                #double the buffers (amortized, like list.append)
+                capacity = max(end, 2 * len(buffers[0]))
+                for (i, buf) in enumerate(buffers):
+                    buffers[i] = np.empty(capacity, dtype=buf.dtype)
+                    buffers[i][:count] = buf[:count]
+
+            for (i, values) in enumerate(zip(*rows)):
+                buf = buffers[i]
+                if buf.dtype.kind in 'ib' and None in values:
+                    #NULLs in an int/bit column, switch the column to float64 so they can be nan
+                    buffers[i] = buf = buf.astype('float64')
+                elif buf.dtype.kind == 'U' and None in values:
+                    values = ['' if value is None else value for value in values]
+                buf[count:end] = values
+            count = end
+
+        cursor.commit()
+        if is_write_query(query):
+            invalidate_tables(pool.conn_string, query)
+
+    #trim to the rows we got (copy, so the spare capacity isn't kept alive by a view)
+    arrays = [buf[:count].copy() if count < len(buf) else buf for buf in buffers]
+    if output == 'recarray':
+        return np.rec.fromarrays(arrays, names=columns)
+    return dict(zip(columns, arrays))
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _insert_sql(table, columns, row_count):
+    values = ', '.join(['(' + ', '.join(['?'] * len(columns)) + ')'] * row_count)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values}"
+
+def _merge_sql(table, columns, key_columns, row_count):
+    '''
+        MERGE of row_count rows of parameters into table on key_columns: matching rows get the other columns updated, the rest get inserted
+            (HOLDLOCK so two loaders upserting the same keys at once can't both decide to insert)
+    '''
+    values = ', '.join(['(' + ', '.join(['?'] * len(columns)) + ')'] * row_count)
+    on = ' AND '.join(f'target.{column} = source.{column}' for column in key_columns)
+    update = ', '.join(f'target.{column} = source.{column}' for column in columns if column not in key_columns)
+    return (f"MERGE INTO {table} WITH (HOLDLOCK) AS target "
+            f"USING (VALUES {values}) AS source ({', '.join(columns)}) "
+            f"ON {on} "
+            + (f"WHEN MATCHED THEN UPDATE SET {update} " if update else '')
+            + f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join('source.' + column for column in columns)});")
+
+def bulk_load(conn_string=None, rows=None, table='daily_close_prices', columns=DAILY_CLOSE_COLUMNS, key_columns=DAILY_CLOSE_KEY,
+              upsert=False, method='values', batch_size=BULK_BATCH_SIZE, progress=None,
+              query_timeout=QUERY_TIMEOUT, conn_timeout=CONNECTION_TIMEOUT, pool=None):
+    '''
+        Insert (or upsert) lots of rows: rows is any iterable of sequences in columns order (a list, a generator, read_csv_rows(...))
+            and is consumed batch_size rows at a time, so it never has to fit in memory
+
+        method='values'      each statement carries as many rows as fit under SQL Server's 2100 parameter / 1000 row limits
+                                (INSERT ... VALUES (...), (...), ... or MERGE ... USING (VALUES ...)), one round trip per statement
+        method='executemany' one parameter set per row through cursor.executemany (pypyodbc prepares once, but still executes each row)
+
+        upsert=True MERGEs on key_columns (the primary key) instead of inserting: existing rows get the other columns updated
+            if the same key shows up more than once in a batch, the last one wins (MERGE won't take the same target row twice)
+
+        Each batch is its own transaction: if a batch fails it gets rolled back and the exception is raised, the batches before it stay committed
+            progress(rows_committed) gets called after every commit if you want to know where to pick up from
+
+        returns the number of rows loaded
+
+        ie: bulk_load(dsn, [('INTC', datetime.datetime(2018, 6, 8), Decimal('53.22')), ...], upsert=True)
+    '''
+    if method not in ('values', 'executemany'):
+        raise ValueError(f"method must be 'values' or 'executemany', not {method!r}")
+
+    width = len(columns)
+    key_positions = [columns.index(column) for column in key_columns]
+    rows_per_statement = max(1, min(SQL_SERVER_MAX_VALUES_ROWS, (SQL_SERVER_MAX_PARAMS - 1) // width))
+    if method == 'executemany':
+        rows_per_statement = 1
+
+    def statement(row_count):
+        if upsert:
+            return _merge_sql(table, columns, key_columns, row_count)
+        return _insert_sql(table, columns, row_count)
+
+    loaded = 0
+    pool = pool or get_pool(conn_string, conn_timeout=conn_timeout)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.set_timeout(query_timeout)  #query timeout (per statement)
+        try:
+            for batch in _chunks(rows, batch_size):
+                if upsert:
+                    batch = list({tuple(row[i] for i in key_positions): row for row in batch}.values())
+
+                if method == 'executemany':
+                    cursor.executemany(statement(1), [list(row) for row in batch])
+                else:
+                    #every full chunk has the same SQL text, so pypyodbc only prepares it once
+                    for chunk in _chunks(batch, rows_per_statement):
+                        cursor.execute(statement(len(chunk)), [value for row in chunk for value in row])
+
+                conn.commit()
+                invalidate_tables(pool.conn_string, tags=[table_tag(table)])
+                loaded += len(batch)
+                if progress:
+                    progress(loaded)
+        finally:
+            #the pool rolls back an uncommitted (failed) batch when the connection goes back
+            cursor.close()
+
+    return loaded
+
+def parse_datetime(value):
+    #2018-06-08, 2018-06-08 00:00:00 or 2018-06-08T00:00:00.000
+    return datetime.datetime.fromisoformat(value)
+
+DAILY_CLOSE_CONVERTERS = (str, parse_datetime, Decimal)
+
+def read_csv_rows(path, converters=DAILY_CLOSE_CONVERTERS, header=True, delimiter=','):
+    '''
+        stream the rows of a CSV file as tuples for bulk_load, one line at a time (empty fields become NULL)
+            converters turn the text of each column into the parameter type (defaults to ticker, close_date, close)
+    '''
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file, delimiter=delimiter)
+        if header:
+            next(reader, None)
+        for row in reader:
+            if row:
+                yield tuple(None if value == '' else convert(value) for (convert, value) in zip(converters, row))
+
+def bulk_load_csv(conn_string=None, path=None, converters=DAILY_CLOSE_CONVERTERS, header=True, **bulk_options):
+    '''
+        bulk_load a CSV file (ie: a day of quotes: ticker,close_date,close) without reading it all into memory
+    '''
+    return bulk_load(conn_string, read_csv_rows(path, converters, header), **bulk_options)
 
 if __name__ == '__main__':
     '''
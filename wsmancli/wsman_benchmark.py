@@ -0,0 +1,169 @@
+"""
+    Benchmark wsmancli.WSManClient against the local WS-Man stand-in server (wsman_standin_server.py)
+
+    For every result set size it measures:
+        get ops/sec (one listener per response)
+        enumerate ops/sec (result set size listeners per enumerate, paged with MaxElements)
+        peak memory (tracemalloc) for one get, one enumerate and one streamed iter_enumerate, per response size
+
+    examples:
+        python wsman_benchmark.py
+        python wsman_benchmark.py --sizes 10 100 1000 10000 --seconds 5 --threads 4 --latency 0.002
+        python wsman_benchmark.py --json > before.json
+
+    With --fault-rate, the warm-up and the memory probes retry injected faults (and count them in the errors column),
+        the throughput numbers count them as errors and carry on
+
+    Note: tracemalloc only sees python allocations, and the server runs in the same process
+        (so the memory numbers include building the response on the server side -- compare runs with each other, not with a real host)
+"""
+
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+
+from pypsrp.exceptions import WSManFaultError
+
+from wsman_standin_server import WSManStandinServer
+from wsmancli import WSManClient, WSManSessionPool
+
+# tries per warm-up / memory probe before a run of injected faults is treated as a real failure
+FAULT_RETRIES = 50
+
+
+def make_client(port, pool):
+    return WSManClient("127.0.0.1", port=port, ssl=False, auth="basic", encryption="never", username="bench", password="bench",
+                       session_pool=pool)
+
+
+def ops_per_second(operation, seconds, threads=1):
+    """
+        run operation() on threads threads for (about) seconds, returns (ops/sec, errors)
+    """
+    counts = [0] * threads
+    errors = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            try:
+                operation()
+                counts[index] += 1
+            except Exception:
+                errors[index] += 1
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return (sum(counts) / elapsed, sum(errors))
+
+
+def retry_faults(operation, attempts=FAULT_RETRIES):
+    """
+        operation() until it gets through without a WSManFault, returns (result, faults)
+    """
+    for attempt in range(attempts):
+        try:
+            return (operation(), attempt)
+        except WSManFaultError:
+            if attempt == attempts - 1:
+                raise
+
+
+def peak_memory(operation, attempts=FAULT_RETRIES):
+    """
+        peak traced memory (bytes) for one successful call of operation(), returns (peak, faults)
+            faults are retried, the peak is the one of the call that worked
+    """
+    tracemalloc.start()
+    try:
+        for attempt in range(attempts):
+            tracemalloc.reset_peak()
+            try:
+                operation()
+            except WSManFaultError:
+                if attempt == attempts - 1:
+                    raise
+                continue
+            (current, peak) = tracemalloc.get_traced_memory()
+            return (peak, attempt)
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes, seconds=2.0, threads=1, latency=0.0, max_elements="2000", fault_rate=0.0):
+    server = WSManStandinServer(port=0, latency=latency, fault_rate=fault_rate).start()
+    pool = WSManSessionPool(max_sessions_per_host=max(threads, 1))
+    client = make_client(server.port, pool)
+
+    results = []
+    try:
+        for size in sizes:
+            server.set_listener_count(size)
+            # warm up the session (and the imports) before measuring
+            (_, warmup_faults) = retry_faults(lambda: client.enumerate(max_elements=max_elements))
+
+            (get_ops, get_errors) = ops_per_second(lambda: client.get("HTTP", "*"), seconds, threads)
+            (enum_ops, enum_errors) = ops_per_second(lambda: client.enumerate(max_elements=max_elements), seconds, threads)
+
+            (get_peak, get_faults) = peak_memory(lambda: client.get("HTTP", "*"))
+            (enum_peak, enum_faults) = peak_memory(lambda: client.enumerate(max_elements=max_elements))
+            (iter_peak, iter_faults) = peak_memory(lambda: sum(1 for _ in client.iter_enumerate(max_elements=max_elements)))
+
+            results.append({
+                "listeners": size,
+                "threads": threads,
+                "latency": latency,
+                "get_ops_per_sec": round(get_ops, 2),
+                "get_errors": get_errors,
+                "get_peak_bytes": get_peak,
+                "enumerate_ops_per_sec": round(enum_ops, 2),
+                "enumerate_items_per_sec": round(enum_ops * size, 2),
+                "enumerate_errors": enum_errors,
+                "enumerate_peak_bytes": enum_peak,
+                "iter_enumerate_peak_bytes": iter_peak,
+                # faults retried by the warm-up and the memory probes
+                "probe_faults": warmup_faults + get_faults + enum_faults + iter_faults,
+            })
+    finally:
+        pool.close_all()
+        server.stop()
+
+    return results
+
+
+def print_table(results):
+    print(f"{'listeners':>10} {'threads':>7} {'get/s':>10} {'get peak KiB':>13} {'enum/s':>10} {'items/s':>12} {'enum peak KiB':>14} {'stream peak KiB':>16} {'errors':>7}")
+    for result in results:
+        print(f"{result['listeners']:>10} {result['threads']:>7} {result['get_ops_per_sec']:>10.1f} "
+              f"{result['get_peak_bytes'] / 1024:>13.1f} {result['enumerate_ops_per_sec']:>10.1f} "
+              f"{result['enumerate_items_per_sec']:>12.1f} {result['enumerate_peak_bytes'] / 1024:>14.1f} "
+              f"{result['iter_enumerate_peak_bytes'] / 1024:>16.1f} "
+              f"{result['get_errors'] + result['enumerate_errors'] + result['probe_faults']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark wsmancli against the local WS-Man stand-in server")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000], help="enumerate result set sizes to measure")
+    parser.add_argument("--seconds", type=float, default=2.0, help="seconds to run each throughput measurement")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent callers (sessions come from one pool)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of server latency per request")
+    parser.add_argument("--max-elements", default="2000", help="MaxElements per Enumerate/Pull")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="0.0 - 1.0 chance of a WSManFault on any request")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON (for comparing runs)")
+    args = parser.parse_args()
+
+    results = run(args.sizes, seconds=args.seconds, threads=args.threads, latency=args.latency, max_elements=args.max_elements,
+                  fault_rate=args.fault_rate)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
@@ -0,0 +1,365 @@
+"""
+    A small local stand-in for a Windows WinRM endpoint, so wsmancli.py can be exercised (and benchmarked) without a Windows host
+
+    It speaks just enough WS-Management SOAP to back WSManClient for the listener resource:
+        Get, Enumerate (with OptimizeEnumeration/MaxElements) + Pull, Create, Put and Delete on
+        http://schemas.microsoft.com/wbem/wsman/1/config/listener
+
+    There's no real authentication (any Authorization header is accepted) and no message encryption, so point the client at it with:
+        WSManClient("127.0.0.1", port=5985, ssl=False, auth="basic", encryption="never", username="user", password="pass")
+
+    Knobs for testing/benchmarking:
+        latency: (float) seconds to sleep before answering every request
+        listeners: (int) how many synthetic listeners the enumerate result set has
+        fault_rate: (float) 0.0 - 1.0 chance that any request gets a WSManFault back
+        fault_actions: (list) action names (Get, Enumerate, Pull, Create, Put, Delete) that always get a WSManFault back
+
+    run it standalone:
+        python wsman_standin_server.py --port 5985 --listeners 500 --latency 0.005 --fault-rate 0.01
+
+    or in process (see wsman_benchmark.py):
+        server = WSManStandinServer(port=0, listeners=100)
+        server.start()
+        ... WSManClient("127.0.0.1", port=server.port, ...)
+        server.stop()
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import random
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+
+NAMESPACES = {
+    "s": "http://www.w3.org/2003/05/soap-envelope",
+    "wsa": "http://schemas.xmlsoap.org/ws/2004/08/addressing",
+    "wsman": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
+    "wsen": "http://schemas.xmlsoap.org/ws/2004/09/enumeration",
+    "wst": "http://schemas.xmlsoap.org/ws/2004/09/transfer",
+    "wsmanfault": "http://schemas.microsoft.com/wbem/wsman/1/wsmanfault",
+    "cfg": "http://schemas.microsoft.com/wbem/wsman/1/config/listener",
+}
+
+LISTENER_URI = "http://schemas.microsoft.com/wbem/wsman/1/config/listener"
+
+ACTIONS = {
+    "http://schemas.xmlsoap.org/ws/2004/09/transfer/Get": "Get",
+    "http://schemas.xmlsoap.org/ws/2004/09/transfer/Put": "Put",
+    "http://schemas.xmlsoap.org/ws/2004/09/transfer/Create": "Create",
+    "http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete": "Delete",
+    "http://schemas.xmlsoap.org/ws/2004/09/enumeration/Enumerate": "Enumerate",
+    "http://schemas.xmlsoap.org/ws/2004/09/enumeration/Pull": "Pull",
+}
+
+# the listener fields in the order Windows returns them
+LISTENER_FIELDS = ["Address", "Transport", "Port", "Hostname", "Enabled", "URLPrefix", "CertificateThumbprint"]
+
+for _prefix, _uri in NAMESPACES.items():
+    if _prefix != "cfg":
+        ET.register_namespace(_prefix, _uri)
+
+
+def make_listener(transport="HTTPS", address="*", hostname="", certificate_thumbprint="", listening_on=None):
+    return {
+        "Address": address,
+        "Transport": transport,
+        "Port": "5986" if transport == "HTTPS" else "5985",
+        "Hostname": hostname,
+        "Enabled": "true",
+        "URLPrefix": "wsman",
+        "CertificateThumbprint": certificate_thumbprint if transport == "HTTPS" else "",
+        "ListeningOn": listening_on or ["127.0.0.1", "::1"],
+    }
+
+
+def make_listeners(count):
+    """
+        an HTTP listener on * plus (count - 1) synthetic HTTPS listeners on their own IP address
+    """
+    listeners = {}
+    if count > 0:
+        listeners[("HTTP", "*")] = make_listener("HTTP", "*")
+    for i in range(1, count):
+        address = f"IP:10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        listeners[("HTTPS", address)] = make_listener("HTTPS", address, hostname=f"host{i}.somedomain.local",
+                                                      certificate_thumbprint=f"{i:040X}", listening_on=[address[3:]])
+    return listeners
+
+
+class WSManFault(Exception):
+    def __init__(self, code, reason, subcode="wsman:InternalError"):
+        super(WSManFault, self).__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.subcode = subcode
+
+
+class WSManStandinServer(object):
+    def __init__(self, host="127.0.0.1", port=5985, listeners=2, latency=0.0, fault_rate=0.0, fault_actions=None, seed=None):
+        self.host = host
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.fault_actions = set(fault_actions or [])
+        self.listeners = make_listeners(listeners)
+        self.requests = 0
+        self.faults = 0
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        # enumeration context id -> list of the listeners left to hand out
+        self._enumerations = {}
+        self._thread = None
+
+        handler = type("WSManStandinHandler", (_WSManStandinHandler,), {"standin": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def set_listener_count(self, count):
+        with self._lock:
+            self.listeners = make_listeners(count)
+            self._enumerations = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def handle(self, request_xml):
+        """
+            returns (http status, response envelope bytes) for a request envelope
+        """
+        with self._lock:
+            self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        envelope = ET.fromstring(request_xml)
+        header = envelope.find("s:Header", NAMESPACES)
+        body = envelope.find("s:Body", NAMESPACES)
+
+        action_uri = header.findtext("wsa:Action", default="", namespaces=NAMESPACES)
+        message_id = header.findtext("wsa:MessageID", default="", namespaces=NAMESPACES)
+        resource_uri = header.findtext("wsman:ResourceURI", default="", namespaces=NAMESPACES)
+        selectors = {}
+        for selector in header.findall("wsman:SelectorSet/wsman:Selector", NAMESPACES):
+            selectors[selector.get("Name")] = selector.text
+
+        action = ACTIONS.get(action_uri)
+        try:
+            if action is None:
+                raise WSManFault(2150858817, f"The action {action_uri} is not supported by the stand-in server", "wsa:ActionNotSupported")
+            if action in self.fault_actions or (self.fault_rate and self._random.random() < self.fault_rate):
+                raise WSManFault(2150858752, f"Injected fault for {action}")
+            if resource_uri != LISTENER_URI:
+                raise WSManFault(2150858778, f"The resource URI {resource_uri} is not supported by the stand-in server",
+                                 "wsman:DestinationUnreachable")
+
+            response_body = getattr(self, f"_{action.lower()}")(selectors, body)
+        except WSManFault as fault:
+            with self._lock:
+                self.faults += 1
+            return 500, self._envelope(f"{NAMESPACES['wsa']}/fault", message_id, self._fault(fault))
+
+        return 200, self._envelope(action_uri + "Response", message_id, response_body)
+
+    def _get(self, selectors, body):
+        key = self._listener_key(selectors)
+        with self._lock:
+            listener = self.listeners.get(key)
+        if listener is None:
+            raise WSManFault(2150858843, "The WS-Management service cannot find the resource identified by the resource URI and selectors.",
+                             "wsman:InvalidSelectors")
+        return [self._listener_element(listener)]
+
+    def _enumerate(self, selectors, body):
+        enum = body.find("wsen:Enumerate", NAMESPACES)
+        optimize = enum is not None and enum.find("wsman:OptimizeEnumeration", NAMESPACES) is not None
+        max_elements = int(enum.findtext("wsman:MaxElements", default="1", namespaces=NAMESPACES)) if optimize else 0
+
+        with self._lock:
+            remaining = list(self.listeners.values())
+            context_id = f"uuid:{str(uuid.uuid4()).upper()}"
+
+        response = ET.Element(f"{{{NAMESPACES['wsen']}}}EnumerateResponse")
+        batch, remaining = remaining[:max_elements], remaining[max_elements:]
+        if remaining:
+            with self._lock:
+                self._enumerations[context_id] = remaining
+        ET.SubElement(response, f"{{{NAMESPACES['wsen']}}}EnumerationContext").text = context_id if remaining else None
+        if optimize:
+            items = ET.SubElement(response, f"{{{NAMESPACES['wsman']}}}Items")
+            for listener in batch:
+                items.append(self._listener_element(listener))
+            if not remaining:
+                ET.SubElement(response, f"{{{NAMESPACES['wsman']}}}EndOfSequence")
+        return [response]
+
+    def _pull(self, selectors, body):
+        pull = body.find("wsen:Pull", NAMESPACES)
+        context_id = pull.findtext("wsen:EnumerationContext", default="", namespaces=NAMESPACES)
+        max_elements = int(pull.findtext("wsen:MaxElements", default="1", namespaces=NAMESPACES))
+
+        with self._lock:
+            remaining = self._enumerations.pop(context_id, None)
+            if remaining is None:
+                raise WSManFault(2150858776, "The enumeration context supplied in the message is not valid.", "wsen:InvalidEnumerationContext")
+            batch, remaining = remaining[:max_elements], remaining[max_elements:]
+            if remaining:
+                self._enumerations[context_id] = remaining
+
+        response = ET.Element(f"{{{NAMESPACES['wsen']}}}PullResponse")
+        if remaining:
+            ET.SubElement(response, f"{{{NAMESPACES['wsen']}}}EnumerationContext").text = context_id
+        items = ET.SubElement(response, f"{{{NAMESPACES['wsen']}}}Items")
+        for listener in batch:
+            items.append(self._listener_element(listener))
+        if not remaining:
+            ET.SubElement(response, f"{{{NAMESPACES['wsen']}}}EndOfSequence")
+        return [response]
+
+    def _create(self, selectors, body):
+        key = self._listener_key(selectors)
+        values = self._resource_values(body)
+        with self._lock:
+            if key in self.listeners:
+                raise WSManFault(2150858793, "The WS-Management service cannot create the resource because it already exists.",
+                                 "wsman:AlreadyExists")
+            self.listeners[key] = make_listener(key[0], key[1], hostname=values.get("HostName", ""),
+                                                certificate_thumbprint=values.get("CertificateThumbprint", ""))
+
+        created = ET.Element(f"{{{NAMESPACES['wst']}}}ResourceCreated")
+        ET.SubElement(created, f"{{{NAMESPACES['wsa']}}}Address").text = "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous"
+        return [created]
+
+    def _put(self, selectors, body):
+        key = self._listener_key(selectors)
+        values = self._resource_values(body)
+        with self._lock:
+            listener = self.listeners.get(key)
+            if listener is None:
+                raise WSManFault(2150858843, "The WS-Management service cannot find the resource identified by the resource URI and selectors.",
+                                 "wsman:InvalidSelectors")
+            if "HostName" in values:
+                listener["Hostname"] = values["HostName"]
+            if "CertificateThumbprint" in values:
+                listener["CertificateThumbprint"] = values["CertificateThumbprint"]
+        return [self._listener_element(listener)]
+
+    def _delete(self, selectors, body):
+        key = self._listener_key(selectors)
+        with self._lock:
+            if self.listeners.pop(key, None) is None:
+                raise WSManFault(2150858843, "The WS-Management service cannot find the resource identified by the resource URI and selectors.",
+                                 "wsman:InvalidSelectors")
+        return []
+
+    def _listener_key(self, selectors):
+        return (str(selectors.get("Transport", "")).upper(), selectors.get("Address", "*"))
+
+    def _resource_values(self, body):
+        # the client sends <Listener><HostName/><CertificateThumbprint/></Listener> -- only the local names matter
+        values = {}
+        for resource in body:
+            for child in resource:
+                values[child.tag.split("}")[-1]] = child.text or ""
+        return values
+
+    def _listener_element(self, listener):
+        cfg = NAMESPACES["cfg"]
+        element = ET.Element(f"{{{cfg}}}Listener")
+        for field in LISTENER_FIELDS:
+            ET.SubElement(element, f"{{{cfg}}}{field}").text = listener[field] or None
+        for address in listener["ListeningOn"]:
+            ET.SubElement(element, f"{{{cfg}}}ListeningOn").text = address
+        return element
+
+    def _fault(self, fault):
+        s = NAMESPACES["s"]
+        element = ET.Element(f"{{{s}}}Fault")
+        code = ET.SubElement(element, f"{{{s}}}Code")
+        ET.SubElement(code, f"{{{s}}}Value").text = "s:Receiver"
+        subcode = ET.SubElement(code, f"{{{s}}}Subcode")
+        ET.SubElement(subcode, f"{{{s}}}Value").text = fault.subcode
+        reason = ET.SubElement(element, f"{{{s}}}Reason")
+        ET.SubElement(reason, f"{{{s}}}Text").text = fault.reason
+        detail = ET.SubElement(element, f"{{{s}}}Detail")
+        wsman_fault = ET.SubElement(detail, f"{{{NAMESPACES['wsmanfault']}}}WSManFault", Code=str(fault.code), Machine=self.host)
+        ET.SubElement(wsman_fault, f"{{{NAMESPACES['wsmanfault']}}}Message").text = fault.reason
+        return [element]
+
+    def _envelope(self, action_uri, message_id, body_children):
+        s = NAMESPACES["s"]
+        wsa = NAMESPACES["wsa"]
+        envelope = ET.Element(f"{{{s}}}Envelope")
+        header = ET.SubElement(envelope, f"{{{s}}}Header")
+        ET.SubElement(header, f"{{{wsa}}}Action").text = action_uri
+        ET.SubElement(header, f"{{{wsa}}}MessageID").text = f"uuid:{str(uuid.uuid4()).upper()}"
+        ET.SubElement(header, f"{{{wsa}}}To").text = "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous"
+        ET.SubElement(header, f"{{{wsa}}}RelatesTo").text = message_id
+        body = ET.SubElement(envelope, f"{{{s}}}Body")
+        for child in body_children:
+            body.append(child)
+        return ET.tostring(envelope, encoding="utf-8")
+
+
+class _WSManStandinHandler(BaseHTTPRequestHandler):
+    standin = None
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, without this the client's delayed ACK adds ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        request_xml = self.rfile.read(length)
+
+        if not request_xml:
+            # pypsrp sends a blank message to set up the security context when encrypting -- there's nothing to set up here
+            self._respond(200, b"")
+            return
+
+        (status, response_xml) = self.standin.handle(request_xml)
+        self._respond(status, response_xml)
+
+    def _respond(self, status, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # keep the console quiet, benchmarks make a lot of requests
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="local WS-Management stand-in server for wsmancli")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5985)
+    parser.add_argument("--listeners", type=int, default=2, help="number of listeners in the enumerate result set")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency added to every response")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="0.0 - 1.0 chance of a WSManFault on any request")
+    parser.add_argument("--fault-action", action="append", default=[], help="always fault this action (Get, Enumerate, Pull, Create, Put, Delete)")
+    args = parser.parse_args()
+
+    server = WSManStandinServer(host=args.host, port=args.port, listeners=args.listeners, latency=args.latency,
+                                fault_rate=args.fault_rate, fault_actions=args.fault_action)
+    print(f"WS-Man stand-in server listening on http://{args.host}:{server.port}/wsman with {args.listeners} listeners")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
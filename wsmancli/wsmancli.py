@@ -9,40 +9,643 @@
 
     prerequisites:
         pip install pypsrp
-        pip install xmltodict
+
+    Session pooling:
+        every WSManClient normally builds its own WSMan object, so each new client pays for the TCP connect, TLS handshake and the
+        NTLM/Negotiate exchange again.  Pass session_pool=SESSION_POOL (or your own WSManSessionPool) and the client will borrow an
+        already authenticated session for the same (hostname, port, auth, username, password, ssl, encryption, cert_validation) instead.
+
+    Large enumerations:
+        iter_enumerate() / iter_enumerate_resource() parse the response incrementally and yield each object as soon as its element closes.
+
+    Caching:
+        pass cache=WSManResultCache(...) (one cache can be shared by the clients for all your hosts) and get/enumerate results are served
+        from memory until their TTL runs out.  A successful create/set/delete through the client drops everything cached for that host.
+
+    Other resources:
+        each resource (listener, service config, WMI classes, ...) is declared once as a WSManResource (selector keys, item element, field
+        types) and registered in RESOURCES, so the generic get_resource/enumerate_resource/create_resource/set_resource/delete_resource
+        work for any of them and hand back typed __slots__ records:
+            client.get_resource("Win32_Service", Name="WinRM").State
+            client.enumerate_resource("listener")
+        the listener shortcuts (get/enumerate/iter_enumerate) still hand back plain {name: text} dicts of strings, same as they always have
 """
 
-from pypsrp.wsman import WSMan, NAMESPACES, SelectorSet
-import xmltodict
-import json
+from pypsrp.wsman import WSMan, WSManAction, NAMESPACES, SelectorSet
+from pypsrp.exceptions import WinRMError, WinRMTransportError, WSManFaultError
+from contextlib import contextmanager
+from collections import OrderedDict
+import atexit
+import copy
+import hashlib
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 
-class WSManClient(object):
-    def __init__(self, hostname, username=None, password=None, ssl=True, auth="negotiate", encryption="always", cert_validation=True):
-        self.wsman = WSMan(server=hostname, username=username, password=password, ssl=ssl, auth=auth, encryption=encryption, cert_validation=cert_validation)
+class WSManSessionPool(object):
+    """
+        Process-wide pool of live, authenticated WSMan sessions
+
+        Sessions are keyed by (hostname, port, auth, username, ssl, encryption, cert_validation, a hash of the password), so a client only
+        ever gets a session that was built with its own settings and authenticated with its own password.  A borrowed session is used by one caller at a time (pypsrp's
+        WSMan object isn't thread safe) and goes back to the idle list when the caller is done with it.
+
+        idle_timeout: (int) seconds an idle session is kept before it gets closed
+        health_check_interval: (int) seconds a session can sit idle before it gets probed (get_server_config) before reuse
+        max_sessions_per_host: (int) cap on open sessions per hostname (across all credentials) -- callers wait for one to free up
+        acquire_timeout: (int) seconds to wait for a free session before giving up with a TimeoutError
+    """
+    def __init__(self, idle_timeout=300, health_check_interval=60, max_sessions_per_host=2, acquire_timeout=30):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.max_sessions_per_host = max_sessions_per_host
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        # key -> list of (wsman, last_used) with the most recently used at the end
+        self._idle = {}
+        # key -> number of sessions currently handed out (or being built)
+        self._in_use = {}
+
+    @staticmethod
+    def make_key(hostname, port=None, auth="negotiate", username=None, ssl=True, password=None, encryption="always", cert_validation=True):
+        if port is None:
+            # same defaults pypsrp uses, so port=None and port=5986 share sessions
+            port = 5986 if ssl else 5985
+        # only a digest of the password goes in the key (the keys show up in tracebacks and debuggers)
+        password_hash = hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+        return (hostname.lower(), int(port), auth.lower(), (username or "").lower(), bool(ssl), str(encryption).lower(), cert_validation,
+                password_hash)
+
+    def acquire(self, key, factory):
+        """
+            Hand out an idle session for key, or build one with factory() if the host is under its cap
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                self._evict_expired()
+
+                idle = self._idle.get(key)
+                if idle:
+                    (wsman, last_used) = idle.pop()
+                    break
+
+                if self._host_count(key[0]) >= self.max_sessions_per_host:
+                    # make room by dropping an idle session that belongs to other credentials on the same host
+                    self._evict_one_idle(key[0])
+
+                if self._host_count(key[0]) < self.max_sessions_per_host:
+                    (wsman, last_used) = (None, None)
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"timed out waiting for a free WSMan session to {key[0]}:{key[1]}")
+                self._cond.wait(remaining)
+
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+
+        # build / probe outside of the lock so a slow host doesn't hold up the other hosts
+        try:
+            if wsman is not None and time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(wsman):
+                self._close(wsman)
+                wsman = None
+            if wsman is None:
+                wsman = factory()
+        except Exception:
+            with self._cond:
+                self._in_use[key] -= 1
+                self._cond.notify_all()
+            raise
+
+        return wsman
+
+    def release(self, key, wsman, discard=False):
+        """
+            Give a session back to the pool (discard=True closes it instead, ie: after a transport error)
+        """
+        with self._cond:
+            self._in_use[key] -= 1
+            if discard:
+                self._close(wsman)
+            else:
+                self._idle.setdefault(key, []).append((wsman, time.monotonic()))
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, key, factory):
+        wsman = self.acquire(key, factory)
+        discard = False
+        try:
+            yield wsman
+        except WSManFaultError:
+            # the server answered with a fault, so the transport itself is still good
+            raise
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.release(key, wsman, discard=discard)
+
+    def close_all(self):
+        """
+            Close every idle session (sessions that are handed out are closed when they get released with discard=True)
+        """
+        with self._cond:
+            for sessions in self._idle.values():
+                for (wsman, last_used) in sessions:
+                    self._close(wsman)
+            self._idle = {}
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "idle": sum(len(sessions) for sessions in self._idle.values()),
+                "in_use": sum(self._in_use.values()),
+            }
+
+    def _host_count(self, hostname):
+        count = 0
+        for key, sessions in self._idle.items():
+            if key[0] == hostname:
+                count += len(sessions)
+        for key, in_use in self._in_use.items():
+            if key[0] == hostname:
+                count += in_use
+        return count
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in list(self._idle):
+            keep = []
+            for (wsman, last_used) in self._idle[key]:
+                if now - last_used > self.idle_timeout:
+                    self._close(wsman)
+                else:
+                    keep.append((wsman, last_used))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def _evict_one_idle(self, hostname):
+        # oldest idle session for the host goes first
+        oldest_key = None
+        for key, sessions in self._idle.items():
+            if key[0] == hostname and sessions:
+                if oldest_key is None or sessions[0][1] < self._idle[oldest_key][0][1]:
+                    oldest_key = key
+        if oldest_key is not None:
+            (wsman, last_used) = self._idle[oldest_key].pop(0)
+            if not self._idle[oldest_key]:
+                del self._idle[oldest_key]
+            self._close(wsman)
+
+    def _is_healthy(self, wsman):
+        try:
+            wsman.get_server_config()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, wsman):
+        try:
+            wsman.close()
+        except Exception:
+            pass
+
+
+# the default process-wide pool (opt in with WSManClient(..., session_pool=SESSION_POOL))
+SESSION_POOL = WSManSessionPool()
+atexit.register(SESSION_POOL.close_all)
+
+
+def _to_bool(text):
+    return text.strip().lower() == "true"
+
+
+def _element_to_dict(element):
+    """
+        flatten an element into {local name: text} (repeated elements become a list, nested elements a dict)
+    """
+    obj = {}
+    for child in element:
+        key = child.tag.split("}")[-1]
+        value = _element_to_dict(child) if len(child) else child.text
+        if key in obj:
+            if not isinstance(obj[key], list):
+                obj[key] = [obj[key]]
+            obj[key].append(value)
+        else:
+            obj[key] = value
+    return obj
+
+
+class WSManRecord(object):
+    """
+        Base class for the per-resource record classes WSManResource builds (one __slots__ entry per declared field)
+
+        fields that come back but aren't declared in the resource end up in .extra ({local name: text}, or None if there weren't any)
+    """
+    __slots__ = ("extra",)
+    fields = ()
+
+    def __init__(self, *values, extra=None):
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+        self.extra = extra
+
+    def as_dict(self):
+        obj = {}
+        for field in self.fields:
+            value = getattr(self, field)
+            # list fields get copied, so changing a returned dict doesn't change a cached record
+            obj[field] = list(value) if isinstance(value, list) else value
+        if self.extra:
+            obj.update(self.extra)
+        return obj
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.as_dict().items())})"
+
+
+class WSManResource(object):
+    """
+        Declares a WS-Man resource once, so WSManClient doesn't need hand-written path lookups for it
+
+        name: (str) short name for the registry (ie: "listener")
+        resource_uri: (str) the wsman:ResourceURI
+        item_element: (str) local name of the element each object comes back in (None takes whatever element is there)
+        selector_keys: (tuple) the selectors that identify one object, in the order they are sent
+        fields: (dict) {field name: converter} -- str, int, _to_bool (or bool), or dict for nested elements
+        list_fields: (tuple) fields that can repeat (always come back as a list)
+        namespace: (str) namespace of the objects, defaults to the resource URI
+        body_namespace: (str) namespace used for the elements sent in create/set bodies, defaults to namespace
+
+        the tag -> (slot, converter) lookups and the __slots__ record class are built here once, so parsing an object is one dict lookup
+        per child element
+    """
+    def __init__(self, name, resource_uri, item_element=None, selector_keys=(), fields=None, list_fields=(), namespace=None,
+                 body_namespace=None):
+        self.name = name
+        self.resource_uri = resource_uri
+        self.item_element = item_element
+        self.selector_keys = tuple(selector_keys)
+        self.namespace = namespace or resource_uri
+        self.body_namespace = body_namespace or self.namespace
+        self.item_tag = "{%s}%s" % (self.namespace, item_element) if item_element else None
+
+        self.fields = dict(fields or {})
+        self.list_fields = set(list_fields)
+        self.record_class = type(f"{name.title().replace('_', '')}Record", (WSManRecord,),
+                                 {"__slots__": tuple(self.fields), "fields": tuple(self.fields)})
+
+        self._tags = {}
+        for index, (field, converter) in enumerate(self.fields.items()):
+            if converter is bool:
+                converter = _to_bool
+            self._tags["{%s}%s" % (self.namespace, field)] = (index, converter, field in self.list_fields)
+
+    def parse(self, element):
+        """
+            turn one object element into a record
+        """
+        values = [None] * len(self.fields)
+        extra = None
+        for child in element:
+            spec = self._tags.get(child.tag)
+            if spec is None:
+                if extra is None:
+                    extra = {}
+                extra[child.tag.split("}")[-1]] = _element_to_dict(child) if len(child) else child.text
+                continue
+
+            (index, converter, is_list) = spec
+            if converter is dict:
+                value = _element_to_dict(child)
+            else:
+                # an empty / xsi:nil element stays None
+                value = converter(child.text) if child.text is not None else None
+            if is_list:
+                if values[index] is None:
+                    values[index] = []
+                values[index].append(value)
+            else:
+                values[index] = value
+        return self.record_class(*values, extra=extra)
+
+    def selector_set(self, selectors: dict):
+        unknown = [key for key in selectors if key not in self.selector_keys]
+        if unknown:
+            raise ValueError(f"{self.name} doesn't have the selector(s): {', '.join(unknown)} (expected: {', '.join(self.selector_keys)})")
 
-    def get(self, transport="HTTPS", address="*"):
         selector_set = SelectorSet()
-        selector_set.add_option("Transport", transport)
-        selector_set.add_option("Address", address)
+        for key in self.selector_keys:
+            if key in selectors:
+                selector_set.add_option(key, selectors[key])
+        return selector_set
 
-        element = self.wsman.get(resource_uri="http://schemas.microsoft.com/wbem/wsman/1/config/listener", resource=None, selector_set=selector_set)
+    def build_body(self, values: dict):
+        """
+            the <item_element> element for a create/set with one child per value (in the order given)
+        """
+        resource = ET.Element("{%s}%s" % (self.body_namespace, self.item_element))
+        for key, value in values.items():
+            child = ET.SubElement(resource, "{%s}%s" % (self.body_namespace, key))
+            if isinstance(value, bool):
+                child.text = "true" if value else "false"
+            elif value is not None:
+                child.text = str(value)
+        return resource
 
-        myjson = self._create_json_from_xml(element)
 
-        results = self._parse_objects(myjson["s:Body"]["ns1:Listener"])
+# name / resource URI -> WSManResource
+RESOURCES = {}
 
-        return results
 
-    # enumerate
-    def enumerate(self, max_elements: str = "2000"):
+def register_resource(resource: WSManResource):
+    RESOURCES[resource.name] = resource
+    RESOURCES[resource.resource_uri] = resource
+    return resource
+
+
+def wmi_resource(class_name, wmi_namespace="root/cimv2", selector_keys=(), fields=None, list_fields=()):
+    """
+        WSManResource for a WMI class (ie: wmi_resource("Win32_Service", selector_keys=("Name",)))
+    """
+    resource_uri = f"http://schemas.microsoft.com/wbem/wsman/1/wmi/{wmi_namespace.strip('/')}/{class_name}"
+    return WSManResource(class_name, resource_uri, item_element=class_name, selector_keys=selector_keys, fields=fields, list_fields=list_fields)
+
+
+LISTENER = register_resource(WSManResource(
+    "listener",
+    "http://schemas.microsoft.com/wbem/wsman/1/config/listener",
+    item_element="Listener",
+    selector_keys=("Transport", "Address"),
+    fields={"Address": str, "Transport": str, "Port": int, "Hostname": str, "Enabled": bool, "URLPrefix": str,
+            "CertificateThumbprint": str, "ListeningOn": str},
+    list_fields=("ListeningOn",),
+    # create/delete were tested sending the listener properties in the wsman namespace
+    body_namespace=NAMESPACES["wsman"]))
+
+SERVICE_CONFIG = register_resource(WSManResource(
+    "service",
+    "http://schemas.microsoft.com/wbem/wsman/1/config/service",
+    item_element="Service",
+    fields={"RootSDDL": str, "MaxConcurrentOperations": int, "MaxConcurrentOperationsPerUser": int, "EnumerationTimeoutms": int,
+            "MaxConnections": int, "MaxPacketRetrievalTimeSeconds": int, "AllowUnencrypted": bool, "Auth": dict, "DefaultPorts": dict,
+            "IPv4Filter": str, "IPv6Filter": str, "EnableCompatibilityHttpListener": bool, "EnableCompatibilityHttpsListener": bool,
+            "CertificateThumbprint": str, "AllowRemoteAccess": bool}))
+
+WIN32_SERVICE = register_resource(wmi_resource(
+    "Win32_Service",
+    selector_keys=("Name",),
+    fields={"Name": str, "DisplayName": str, "State": str, "StartMode": str, "Started": bool, "ProcessId": int, "PathName": str,
+            "StartName": str}))
+
+WIN32_OPERATINGSYSTEM = register_resource(wmi_resource(
+    "Win32_OperatingSystem",
+    fields={"Caption": str, "Version": str, "BuildNumber": str, "CSName": str, "OSArchitecture": str, "LastBootUpTime": dict,
+            "FreePhysicalMemory": int, "TotalVisibleMemorySize": int}))
+
+
+def _resolve_resource(resource):
+    if isinstance(resource, WSManResource):
+        return resource
+    if resource in RESOURCES:
+        return RESOURCES[resource]
+    if "://" in resource:
+        # an unregistered URI still works, the objects just come back with everything in .extra
+        return WSManResource(resource.rstrip("/").split("/")[-1], resource)
+    raise KeyError(f"unknown WS-Man resource: {resource}")
+
+
+def _approximate_size(obj):
+    """
+        rough size in bytes of a cached result (records, dicts, lists and strings)
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, WSManRecord):
+        for field in obj.fields:
+            size += _approximate_size(getattr(obj, field))
+        if obj.extra:
+            size += _approximate_size(obj.extra)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _approximate_size(key) + _approximate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += _approximate_size(value)
+    return size
+
+
+class WSManResultCache(object):
+    """
+        Read-through cache for WSManClient get/enumerate results, keyed by (host, resource URI, selector set)
+
+        default_ttl: (int) seconds a result stays valid
+        ttls: (dict) {resource name or URI: ttl} to override the default per resource (ie: {"listener": 300, "Win32_Service": 10})
+        max_bytes: (int) approximate memory cap, least recently used entries get evicted past it
+        max_entries: (int) cap on the number of cached results
+
+        The cached records are shared between callers, treat them as read-only (the listener dicts from get/enumerate are fresh copies)
+    """
+    def __init__(self, default_ttl=60, ttls=None, max_bytes=16 * 1024 * 1024, max_entries=10000):
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._lock = threading.Lock()
+        # key -> (expires, size, value) with the most recently used at the end
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def make_key(hostname, resource, operation, selectors=None):
+        return (hostname.lower(), resource.resource_uri, operation, tuple(sorted((selectors or {}).items())))
+
+    def ttl_for(self, resource):
+        return self.ttls.get(resource.name, self.ttls.get(resource.resource_uri, self.default_ttl))
+
+    def get(self, key):
+        """
+            returns (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return (True, entry[2])
+
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return (False, None)
+
+    def put(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        size = _approximate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, hostname, resource_uri=None):
+        """
+            drop everything cached for a host (or just one resource on it)
+        """
+        hostname = hostname.lower()
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == hostname and (resource_uri is None or key[1] == resource_uri)]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+    def _remove(self, key):
+        (expires, size, value) = self._entries.pop(key)
+        self._bytes -= size
+
+
+class WSManClient(object):
+    def __init__(self, hostname, username=None, password=None, ssl=True, auth="negotiate", encryption="always", cert_validation=True, port=None,
+                 session_pool=None, cache=None):
+        self.hostname = hostname
+        self.session_pool = session_pool
+        self.cache = cache
+        self._wsman_kwargs = dict(server=hostname, port=port, username=username, password=password, ssl=ssl, auth=auth, encryption=encryption,
+                                  cert_validation=cert_validation)
+
+        if session_pool is None:
+            self.wsman = WSMan(**self._wsman_kwargs)
+        else:
+            # sessions are borrowed from the pool per operation
+            self.wsman = None
+            self._pool_key = session_pool.make_key(hostname, port=port, auth=auth, username=username, ssl=ssl, password=password,
+                                                   encryption=encryption, cert_validation=cert_validation)
+
+    @contextmanager
+    def _session(self):
+        """
+            the WSMan session to run an operation on (borrowed from the session pool if the client has one)
+        """
+        if self.session_pool is None:
+            yield self.wsman
+        else:
+            with self.session_pool.session(self._pool_key, lambda: WSMan(**self._wsman_kwargs)) as wsman:
+                yield wsman
+
+    def close(self):
+        if self.wsman is not None:
+            self.wsman.close()
+
+    # generic resource operations -- resource is a WSManResource, a registered name ("listener", "service", "Win32_Service") or a URI
+
+    def get_resource(self, resource, **selectors):
+        """
+            winrm get <resource>?key=value+key=value -- returns one record
+        """
+        return self._get(_resolve_resource(resource), selectors)
+
+    def enumerate_resource(self, resource, max_elements: str = "2000"):
+        """
+            winrm enum <resource> -- returns a list of records
+        """
+        return self._enumerate(_resolve_resource(resource), max_elements)
+
+    def iter_enumerate_resource(self, resource, max_elements: str = "2000", chunk_size=65536, use_cache=True):
+        """
+            Streaming enumerate -- yields one record at a time
+
+            The response body is fed to an incremental parser (ET.XMLPullParser) chunk_size bytes at a time, each object is yielded as
+            soon as its element closes and is then cleared, so the parsed objects never pile up in memory.  pypsrp still hands back the
+            raw response bytes in one piece, so only the tree/record side of the memory is bounded (by the size of one object).
+
+            The session is held until the generator is exhausted or closed.  A cached enumerate result is used when there is one, but
+            streamed results aren't added to the cache (that would keep the whole result set in memory again).
+        """
+        return self._iter_enumerate(_resolve_resource(resource), max_elements, chunk_size, use_cache)
+
+    # raw=True below parses each object into the {local name: text} dict the listener shortcuts have always returned instead of a record
+    #   (cached separately from the records, and copied on the way out since dicts aren't read-only)
+
+    def _get(self, resource, selectors, raw=False):
+        operation = "get:raw" if raw else "get"
+        if self.cache is not None:
+            key = self.cache.make_key(self.hostname, resource, operation, selectors)
+            (hit, record) = self.cache.get(key)
+            if hit:
+                return copy.deepcopy(record) if raw else record
+
+        with self._session() as wsman:
+            element = wsman.get(resource_uri=resource.resource_uri, resource=None, selector_set=resource.selector_set(selectors))
+
+        item = element.find(resource.item_tag) if resource.item_tag else (element[0] if len(element) else None)
+        if item is None:
+            raise WinRMError(f"no {resource.name} element in the Get response for {self.hostname}")
+        record = _element_to_dict(item) if raw else resource.parse(item)
+
+        if self.cache is not None:
+            self.cache.put(key, record, self.cache.ttl_for(resource))
+            if raw:
+                return copy.deepcopy(record)
+        return record
+
+    def _enumerate(self, resource, max_elements, raw=False):
+        if self.cache is None:
+            return list(self._iter_enumerate(resource, max_elements, raw=raw))
+
+        key = self.cache.make_key(self.hostname, resource, "enumerate:raw" if raw else "enumerate")
+        (hit, records) = self.cache.get(key)
+        if not hit:
+            records = list(self._iter_enumerate(resource, max_elements, use_cache=False, raw=raw))
+            self.cache.put(key, records, self.cache.ttl_for(resource))
+        return copy.deepcopy(records) if raw else list(records)
+
+    def _iter_enumerate(self, resource, max_elements, chunk_size=65536, use_cache=True, raw=False):
+        if use_cache and self.cache is not None:
+            (hit, records) = self.cache.get(self.cache.make_key(self.hostname, resource, "enumerate:raw" if raw else "enumerate"))
+            if hit:
+                for record in records:
+                    yield copy.deepcopy(record) if raw else record
+                return
+
+        parse = _element_to_dict if raw else resource.parse
+
         # generates additional XML to the payload in the body in order to get the enumerate to work:
         #   '<s:Body><wsen:Enumerate><wsman:OptimizeEnumeration/><wsman:MaxElements>2000</wsman:MaxElements> </wsen:Enumerate></s:Body>'
-
         enum = self._create_element(NAMESPACES["wsen"], "Enumerate")
         optimize = self._create_element(NAMESPACES["wsman"], "OptimizeEnumeration")
-
         max_elem = self._create_element(NAMESPACES["wsman"], "MaxElements")
         max_elem.text = max_elements
 
@@ -50,118 +653,382 @@ class WSManClient(object):
         enum.append(optimize)
         enum.append(max_elem)
 
-        element = self.wsman.enumerate(resource_uri="http://schemas.microsoft.com/wbem/wsman/1/config/listener", resource=enum)
+        with self._session() as wsman:
+            state = {}
+            yield from self._iter_items(wsman, WSManAction.ENUMERATE, resource, enum, state, chunk_size, parse)
 
-        myjson = self._create_json_from_xml(element)
-        results = self._parse_objects(myjson["s:Body"]["wsen:EnumerateResponse"]["wsman:Items"]["ns3:Listener"])
+            # if there are more than max_elements results, the server hands back an EnumerationContext to pull the rest with
+            while not state.get("end_of_sequence") and state.get("context"):
+                pull = self._create_element(NAMESPACES["wsen"], "Pull")
+                context = self._create_element(NAMESPACES["wsen"], "EnumerationContext")
+                context.text = state["context"]
+                pull_max_elem = self._create_element(NAMESPACES["wsen"], "MaxElements")
+                pull_max_elem.text = max_elements
+                pull.append(context)
+                pull.append(pull_max_elem)
 
-        return results
+                state = {}
+                yield from self._iter_items(wsman, WSManAction.PULL, resource, pull, state, chunk_size, parse)
 
-    def create(self, hostname, certificate_thumbprint, transport="HTTPS", address="*"):
-        # really only tested this on HTTPS
-        https_selector_set = SelectorSet()
-        https_selector_set.add_option("Transport", transport)
-        https_selector_set.add_option("Address", address)
+    def create_resource(self, resource, selectors: dict, values: dict):
+        """
+            winrm create <resource>?selectors @{values}
+        """
+        resource = _resolve_resource(resource)
 
-        resource = self._create_element(NAMESPACES["wsman"], "Listener")
+        with self._session() as wsman:
+            element = wsman.create(resource_uri=resource.resource_uri, resource=resource.build_body(values),
+                                   selector_set=resource.selector_set(selectors))
 
-        host_name = self._create_element(NAMESPACES["wsman"], "HostName")
-        host_name.text = hostname
+        # as long as there's no exception, the create worked
+        if self.cache is not None:
+            self.cache.invalidate(self.hostname)
+        return element
 
-        resource.append(host_name)
+    def set_resource(self, resource, selectors: dict, values: dict):
+        """
+            winrm set <resource>?selectors @{values}
+        """
+        resource = _resolve_resource(resource)
 
-        if transport == "HTTPS":
-            # if it's for http, then tere would be no thumbprint
-            cert_thumbprint = self._create_element(NAMESPACES["wsman"], "CertificateThumbprint")
-            cert_thumbprint.text = certificate_thumbprint
-            resource.append(cert_thumbprint)
+        with self._session() as wsman:
+            element = wsman.put(resource_uri=resource.resource_uri, resource=resource.build_body(values),
+                                selector_set=resource.selector_set(selectors))
 
-        element = self.wsman.create(resource_uri="http://schemas.microsoft.com/wbem/wsman/1/config/listener", resource=resource, selector_set=https_selector_set)
+        # as long as there's no exception, the set worked
+        if self.cache is not None:
+            self.cache.invalidate(self.hostname)
+        return element
 
-        # as long as there's no exception, the create worked
+    def delete_resource(self, resource, selectors: dict, values: dict = None):
+        """
+            winrm delete <resource>?selectors
+        """
+        resource = _resolve_resource(resource)
+
+        with self._session() as wsman:
+            element = wsman.delete(resource_uri=resource.resource_uri, resource=resource.build_body(values) if values else None,
+                                   selector_set=resource.selector_set(selectors))
+
+        # as long as there's no exception, the delete worked
+        if self.cache is not None:
+            self.cache.invalidate(self.hostname)
         return element
 
-    def delete(self, transport, hostname, certificate_thumbprint, address="*"):
-        # really only tested this on HTTPS
-        https_selector_set = SelectorSet()
-        https_selector_set.add_option("Transport", transport)
-        https_selector_set.add_option("Address", address)
+    # listener shortcuts (the winrm get/enum/create/delete/set winrm/config/listener commands)
 
-        resource = self._create_element(NAMESPACES["wsman"], "Listener")
+    # these return the listener as strings ({"Port": "5986", "Enabled": "true", ...}), use get_resource/enumerate_resource("listener")
+    #   for typed records
 
-        host_name = self._create_element(NAMESPACES["wsman"], "HostName")
-        host_name.text = hostname
+    def get(self, transport="HTTPS", address="*"):
+        return [self._get(LISTENER, {"Transport": transport, "Address": address}, raw=True)]
 
-        cert_thumbprint = self._create_element(NAMESPACES["wsman"], "CertificateThumbprint")
-        cert_thumbprint.text = certificate_thumbprint
+    # enumerate
+    def enumerate(self, max_elements: str = "2000"):
+        return self._enumerate(LISTENER, max_elements, raw=True)
 
-        resource.append(host_name)
-        resource.append(cert_thumbprint)
+    def iter_enumerate(self, max_elements: str = "2000", chunk_size=65536):
+        """
+            Streaming version of enumerate() -- yields one listener dict at a time (see iter_enumerate_resource)
+        """
+        return self._iter_enumerate(LISTENER, max_elements, chunk_size, raw=True)
 
-        element = self.wsman.delete(resource_uri="http://schemas.microsoft.com/wbem/wsman/1/config/listener", resource=resource, selector_set=https_selector_set)
+    def create(self, hostname, certificate_thumbprint, transport="HTTPS", address="*"):
+        # really only tested this on HTTPS
+        values = {"HostName": hostname}
+        if transport == "HTTPS":
+            # if it's for http, then tere would be no thumbprint
+            values["CertificateThumbprint"] = certificate_thumbprint
 
-        # as long as there's no exception, the delete worked
+        return self.create_resource(LISTENER, {"Transport": transport, "Address": address}, values)
 
-        return element
+    def delete(self, transport, hostname, certificate_thumbprint, address="*"):
+        # really only tested this on HTTPS
+        return self.delete_resource(LISTENER, {"Transport": transport, "Address": address},
+                                    {"HostName": hostname, "CertificateThumbprint": certificate_thumbprint})
 
-    # this is left over for sets/puts -- havent debugged this yet
-    """
     def set(self, transport, hostname, certificate_thumbprint, address="*"):
-        https_selector_set = SelectorSet()
-        https_selector_set.add_option("Transport", transport)
-        https_selector_set.add_option("Address", address)
+        """
+            change the HostName/CertificateThumbprint of an existing listener (winrm set winrm/config/listener?Address=*+Transport=HTTPS @{...})
+        """
+        values = {"HostName": hostname}
+        if transport == "HTTPS":
+            values["CertificateThumbprint"] = certificate_thumbprint
 
-        resource = ET.Element("{%s}%s" % (NAMESPACES["wsman"], "Listener"))
+        return self.set_resource(LISTENER, {"Transport": transport, "Address": address}, values)
 
-        host_name = ET.Element("{%s}%s" % (NAMESPACES["wsman"], "HostName"))
-        host_name.text = hostname
+    def _send_raw(self, wsman, action, resource_uri, resource, selector_set=None):
+        """
+            like WSMan.invoke(), but hands back the raw response bytes instead of a parsed ElementTree
+        """
+        (message_id, header) = wsman._create_header(action, resource_uri, None, selector_set, None)
+        envelope = self._create_element(NAMESPACES["s"], "Envelope")
+        envelope.append(header)
+        body = ET.SubElement(envelope, "{%s}Body" % NAMESPACES["s"])
+        if resource is not None:
+            body.append(resource)
 
-        cert_thumbprint = ET.Element("{%s}%s" % (NAMESPACES["wsman"], "CertificateThumbprint"))
-        cert_thumbprint.text = certificate_thumbprint
+        try:
+            response = wsman.transport.send(ET.tostring(envelope, encoding="utf-8", method="xml"))
+        except WinRMTransportError as err:
+            try:
+                # same as pypsrp, turn the error into a WSManFaultError if the server sent one back
+                raise wsman._parse_wsman_fault(err.response_text)
+            except ET.ParseError:
+                raise err
 
-        resource.append(host_name)
-        resource.append(cert_thumbprint)
+        return f"uuid:{message_id}", response
 
-        # not sure about this
-        element = wsman._invoke(WSManAction.PUT, resource_uri="http://schemas.microsoft.com/wbem/wsman/1/config/listener", resource=resource, selector_set= https_selector_set)
-    """
-
-    def _parse_objects(self, objects: list, debug=False):
+    def _iter_items(self, wsman, action, resource, request, state, chunk_size=65536, parse=None):
         """
-            get rid of the xml node names and leave it with the valuable parts of the names in the data
+            send the request and yield the objects under wsman:Items / wsen:Items as records (or whatever parse makes of each object
+            element) as they are parsed
+
+            state gets filled in with the EnumerationContext ("context") and whether EndOfSequence was seen ("end_of_sequence")
 
-            gotta validate this works all over, but it does for the listeners :)
+            the header's RelatesTo has to match the request's MessageID (like WSMan.invoke checks it) -- that's checked when the Body
+            starts, so a response without one (or with the wrong one) raises before any object from it is yielded
         """
-        if debug:
-            print(objects)
+        parse = parse or resource.parse
+        (message_id, response) = self._send_raw(wsman, action, resource.resource_uri, request)
+
+        items_tags = ("{%s}Items" % NAMESPACES["wsman"], "{%s}Items" % NAMESPACES["wsen"])
+        end_tags = ("{%s}EndOfSequence" % NAMESPACES["wsman"], "{%s}EndOfSequence" % NAMESPACES["wsen"])
+        context_tag = "{%s}EnumerationContext" % NAMESPACES["wsen"]
+        relates_to_tag = "{%s}RelatesTo" % NAMESPACES["wsa"]
+        header_tag = "{%s}Header" % NAMESPACES["s"]
+        body_tag = "{%s}Body" % NAMESPACES["s"]
+
+        def check_relates_to():
+            if relates_to != message_id:
+                raise WinRMError(f"Received related id does not match related expected message id: Sent: {message_id}, Received: {relates_to}")
 
-        if isinstance(objects, dict):
-            objects = [objects]
+        parser = ET.XMLPullParser(events=("start", "end"))
+        view = memoryview(response)
+        items = None
+        depth = 0
+        in_header = False
+        relates_to = ""
+        checked = False
+        for offset in range(0, len(view), chunk_size):
+            parser.feed(view[offset:offset + chunk_size])
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if element.tag == header_tag and depth == 2:
+                        in_header = True
+                    elif element.tag == body_tag and depth == 2 and not checked:
+                        check_relates_to()
+                        checked = True
+                    if items is None and element.tag in items_tags:
+                        items = (element, depth)
+                    continue
 
-        _objects = []
-        for object in objects:
-            obj = {}
-            for key, item in object.items():
-                obj[key.split(":")[1]] = item
-            _objects.append(obj)
-        return _objects
+                if items is not None and element is items[0]:
+                    items = None
+                elif items is not None and depth == items[1] + 1:
+                    # an object directly under Items just closed
+                    record = parse(element)
+                    items[0].remove(element)
+                    element.clear()
+                    yield record
+                elif element.tag == context_tag:
+                    state["context"] = element.text
+                elif element.tag in end_tags:
+                    state["end_of_sequence"] = True
+                elif element.tag == relates_to_tag and in_header and depth == 3:
+                    relates_to = element.text or ""
+                elif element.tag == header_tag and depth == 2:
+                    in_header = False
+                depth -= 1
+        parser.close()
+        if not checked:
+            check_relates_to()
 
     def _create_element(self, namespace_entry, value):
         element = ET.Element("{%s}%s" % (namespace_entry, value))
 
         return element
 
-    def _create_json_from_xml(self, xml_element):
-        xml_string = ET.tostring(xml_element, encoding="utf8").decode("utf8")
-        obj = xmltodict.parse(xml_string)
-        myjson = json.loads(json.dumps(obj))
 
-        return myjson
+class ListenerPlan(object):
+    """
+        The result of plan_listeners(): the listener state each host had when it was enumerated, and the changes needed to get it to
+        the desired state
+
+        changes: [{"host", "action" (create|set|delete), "transport", "address", "hostname", "certificate_thumbprint", "current"}]
+        errors: {host: exception} for hosts that could not be enumerated (nothing gets applied to those)
+    """
+    def __init__(self):
+        self.current = {}
+        self.changes = []
+        self.errors = {}
+
+    def changes_for(self, host):
+        return [change for change in self.changes if change["host"] == host]
+
+    def hosts_with_changes(self):
+        hosts = []
+        for change in self.changes:
+            if change["host"] not in hosts:
+                hosts.append(change["host"])
+        return hosts
+
+    def format(self):
+        """
+            dry-run output (one line per change)
+        """
+        lines = []
+        for change in self.changes:
+            line = f'{change["host"]}: {change["action"]} listener Transport={change["transport"]} Address={change["address"]}'
+            if change["action"] != "delete":
+                line += f' HostName={change["hostname"]}'
+                if change["transport"] == "HTTPS":
+                    line += f' CertificateThumbprint={change["certificate_thumbprint"]}'
+            lines.append(line)
+        for host, error in self.errors.items():
+            lines.append(f"{host}: ERROR enumerating listeners - {error}")
+        if not lines:
+            lines.append("no changes")
+        return "\n".join(lines)
+
+
+def _listener_key(listener):
+    return (str(listener.get("Transport") or "").upper(), str(listener.get("Address") or "*"))
+
+
+def _normalize_thumbprint(thumbprint):
+    return str(thumbprint or "").replace(" ", "").upper()
+
+
+def _diff_listeners(host, current, desired, purge=False):
+    """
+        compute the minimal set of changes to turn the current listeners into the desired listeners for one host
+    """
+    current_by_key = {_listener_key(listener): listener for listener in current}
+    desired_by_key = {}
+    for listener in desired:
+        # accept HostName (what create sends) or Hostname (what enumerate returns)
+        listener = dict(listener)
+        listener.setdefault("Address", "*")
+        if "HostName" in listener:
+            listener["Hostname"] = listener.pop("HostName")
+        desired_by_key[_listener_key(listener)] = listener
+
+    changes = []
+    if purge:
+        for key, listener in current_by_key.items():
+            if key not in desired_by_key:
+                changes.append({"host": host, "action": "delete", "transport": key[0], "address": key[1],
+                                "hostname": listener.get("Hostname"), "certificate_thumbprint": listener.get("CertificateThumbprint"),
+                                "current": listener})
+
+    for key, listener in desired_by_key.items():
+        change = {"host": host, "transport": key[0], "address": key[1],
+                  "hostname": listener.get("Hostname"), "certificate_thumbprint": listener.get("CertificateThumbprint")}
+        existing = current_by_key.get(key)
+        if existing is None:
+            change["action"] = "create"
+            change["current"] = None
+            changes.append(change)
+            continue
+
+        same_hostname = str(existing.get("Hostname") or "").lower() == str(listener.get("Hostname") or "").lower()
+        same_thumbprint = key[0] != "HTTPS" or \
+            _normalize_thumbprint(existing.get("CertificateThumbprint")) == _normalize_thumbprint(listener.get("CertificateThumbprint"))
+        if not (same_hostname and same_thumbprint):
+            change["action"] = "set"
+            change["current"] = existing
+            changes.append(change)
+
+    # deletes first (frees the Transport/Address pair), then sets, then creates
+    order = {"delete": 0, "set": 1, "create": 2}
+    changes.sort(key=lambda change: order[change["action"]])
+    return changes
+
+
+def plan_listeners(desired: dict, client_factory, purge=False, max_workers=8):
+    """
+        desired: {host: [{"Transport": "HTTPS", "Address": "*", "HostName": "somefqdn", "CertificateThumbprint": "somethumbprint"}, ...]}
+        client_factory: callable(host) returning a WSManClient for that host
+            (use a session_pool in the factory so apply_listener_plan reuses the sessions the enumerate authenticated)
+        purge: delete listeners that exist on a host but aren't in its desired list
+            (careful -- that includes the listener you may be connecting through)
+
+        Enumerates every host once (in parallel) and diffs the result against the desired listeners
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    plan = ListenerPlan()
+
+    def enumerate_host(host):
+        return client_factory(host).enumerate()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {host: executor.submit(enumerate_host, host) for host in desired}
+        for host, future in futures.items():
+            try:
+                plan.current[host] = future.result()
+            except Exception as e:
+                plan.errors[host] = e
+                continue
+            plan.changes.extend(_diff_listeners(host, plan.current[host], desired[host], purge=purge))
+
+    return plan
+
+
+def apply_listener_plan(plan: ListenerPlan, client_factory, max_workers=8, dry_run=False):
+    """
+        Run the changes in a ListenerPlan (hosts in parallel, changes for one host in order)
+
+        returns a list of (change, error) -- error is None when the change worked
+        a failed change stops the remaining changes for that host, the other hosts carry on
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if dry_run:
+        print(plan.format())
+        return [(change, None) for change in plan.changes]
+
+    def apply_host(host):
+        client = client_factory(host)
+        results = []
+        changes = plan.changes_for(host)
+        for index, change in enumerate(changes):
+            try:
+                if change["action"] == "delete":
+                    client.delete(change["transport"], change["hostname"], change["certificate_thumbprint"], address=change["address"])
+                elif change["action"] == "set":
+                    client.set(change["transport"], change["hostname"], change["certificate_thumbprint"], address=change["address"])
+                else:
+                    client.create(change["hostname"], change["certificate_thumbprint"], transport=change["transport"], address=change["address"])
+                results.append((change, None))
+            except Exception as e:
+                results.append((change, e))
+                results.extend((skipped, RuntimeError("skipped after an earlier change failed")) for skipped in changes[index + 1:])
+                break
+        return results
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for host_results in executor.map(apply_host, plan.hosts_with_changes()):
+            results.extend(host_results)
+
+    return results
+
+
+def ensure_listeners(desired: dict, client_factory, purge=False, dry_run=True, max_workers=8):
+    """
+        plan + apply in one go (dry_run=True by default, so you see the plan before anything changes)
+    """
+    plan = plan_listeners(desired, client_factory, purge=purge, max_workers=max_workers)
+    return plan, apply_listener_plan(plan, client_factory, max_workers=max_workers, dry_run=dry_run)
 
 
 if __name__ == "__main__":
 
     # first, lets just negotiate the credentials from the currently logged in user
+    #   (sessions come from the process-wide pool so the enumerate/get calls below share one authenticated connection)
     wsman = WSManClient(
         "someserver.somedomain.local",
         ssl=False,  # set to false so that if the HTTPS listener is not setup or getting deleted, this will still succeed
@@ -169,7 +1036,8 @@ if __name__ == "__main__":
         # change to ntlm and send username/password parameters if you need to log in as someoen else (tested)
         auth="negotiate",
         encryption="always",
-        cert_validation=False)
+        cert_validation=False,
+        session_pool=SESSION_POOL)
 
     # enumerate all of the listeners
     wsman.enumerate()
@@ -191,7 +1059,8 @@ if __name__ == "__main__":
         encryption="always",
         username="someuser@somedomain.local",
         password=password,
-        cert_validation=False)
+        cert_validation=False,
+        session_pool=SESSION_POOL)
 
     # enumerate all of the listeners
     wsman.enumerate()
@@ -211,3 +1080,15 @@ if __name__ == "__main__":
     # wsman.delete(transport="HTTPS", address="*", hostname="someserver.somedomain.local", certificate_thumbprint="somethumbprint")
     # create HTTPS mapping again so it will be available again
     # wsman.create(transport="HTTPS", address="*", hostname="someserver.somedomain.local", certificate_thumbprint="somethumbprint")
+
+    # monitoring jobs that read the same hosts over and over can share a cache (creates/sets/deletes on a host invalidate it)
+    # cache = WSManResultCache(default_ttl=60, ttls={"listener": 300})
+    # wsman = WSManClient("someserver.somedomain.local", ssl=False, auth="negotiate", cert_validation=False, session_pool=SESSION_POOL, cache=cache)
+    # wsman.get("HTTPS", "*"); print(cache.stats())
+
+    # or declare what every host should look like and only send the changes that are actually needed
+    #   (hosts that already match cost one enumerate)
+    # desired = {"someserver.somedomain.local": [{"Transport": "HTTPS", "Address": "*", "HostName": "someserver.somedomain.local",
+    #                                             "CertificateThumbprint": "somethumbprint"}]}
+    # factory = lambda host: WSManClient(host, ssl=False, auth="negotiate", encryption="always", cert_validation=False, session_pool=SESSION_POOL)
+    # plan, results = ensure_listeners(desired, factory, dry_run=True)